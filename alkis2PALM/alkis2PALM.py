@@ -2,17 +2,39 @@
 import geopandas as gpd
 import pandas as pd
 import os
+import sys
 import numpy as np
 import xarray as xr
 import rioxarray as rio
 from geocube.vector import vectorize
 import shapely
 import json
-import rasterio
-from rasterio.transform import from_origin
-from rasterio.features import rasterize
 import fiona
+import pyogrio
+import tempfile
+import shutil
+import subprocess
 from shapely.geometry import shape
+from concurrent.futures import ProcessPoolExecutor
+import rasterio
+import rasterio.windows
+from rasterio.enums import Resampling
+from rasterio.features import shapes
+
+# the GDAL Python bindings are optional, without them the ALKIS files are converted with ogr2ogr (see buildSidecar)
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cachedClip, geometryHash
+from common.config import configure
+from common.crs import clipAndReproject, clipAndReprojectRaster, clipperInCrs
+from common.manifest import isUpToDate, outputsUpToDate, readManifest, recordOutput, recordOutputs, writeManifest
+from common.vectorio import readVector, vectorPath, writeVector
+from common.rasterise import GTIFF_PROFILE, RasterGrid, blockWindows, fillFromIndex, gridFromBounds, rasteriseColumns, rasteriseIndex, rasteriseToGeoTiff, valueArray, writeRasters
 
 # set data paths
 data_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use"
@@ -20,9 +42,51 @@ alkis_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodat
 keys_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use/translation_tables"
 outpath = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use/processed"
 
-# define gloabl variables
-with open(os.path.join(data_path,"alkis_dict.json")) as jsonFile:
-    layers = json.load(jsonFile)
+# set input files and domain
+clip_file = "clip.shp"
+layer_config = "alkis_dict.json"
+city = "Bochum"
+imperv_raster = "Imperviousness/DATA/IMD_2018_010m_E41N31_03035_v020.tif"
+epsg = 25832
+resolution = 2.0
+
+# processing options
+# number of processes translating the ALKIS layers in parallel, 1 translates the layers one after another
+workers = 1
+# method to identify green and sealed areas: "overlay" (union overlay of the whole layer), "sindex" (spatial index, only intersecting features are split)
+# or "raster" (per raster cell after rasterisation, without vectorising the imperviousness)
+correction = "overlay"
+# upper class breaks for the imperviousness classes 0 to 25%, 26 to 50% and more than 50%
+class_breaks = [0, 26, 51]
+# with the raster correction, also save the corrected surface types as shapefile (polygonised from the rasters)
+vectorise_corrected = False
+# rasterise block by block with this block size (in cells) for domains larger than memory, None rasterises the whole grid at once
+block_size = None
+# read the ALKIS layers feature by feature ("fiona", invalid geometries are dropped) or only the features intersecting the clipper
+# with a spatial filter applied by GDAL ("pyogrio", invalid geometries are repaired)
+read_engine = "fiona"
+# read all layers of an ALKIS file at once from a GeoPackage copy of the file (sidecar), instead of parsing the GML file once per layer
+# (needs the GDAL Python bindings or ogr2ogr)
+load_by_file = False
+# directory to keep the sidecars between runs, so later runs skip the GML parsing, None uses a temporary directory
+sidecar_path = None
+# directory to save each translated layer, later runs only translate the layers whose inputs or config changed (see
+# translateLayersIncremental) and skip the rest if the outputs are up to date, None translates all layers in every run
+layer_path = None
+# translate all layers and recompute the outputs, even if the manifests show that their inputs and config did not change
+force = False
+# directory to cache clipped inputs between runs (GeoParquet), None disables the cache
+cache_path = None
+# format of the vector outputs: "parquet" (GeoParquet), "gpkg" (GeoPackage) or "shp" (Shapefile)
+vector_format = "shp"
+
+# inputs shared by all layers in a worker process (see initLayerWorker)
+workerInputs = {}
+# module variables read while translating a layer, they are passed to the worker processes, which do not inherit the
+# configured values of the main process with the spawn or forkserver start method
+WORKER_SETTINGS = ("data_path", "alkis_path", "keys_path", "epsg", "read_engine", "sidecar_path", "cache_path")
+# dictionary of the ALKIS layers of each city (see readLayerConfig), read in run
+layers = {}
 
 # define functions
 def readClipper(file:str) -> gpd.GeoDataFrame:
@@ -32,21 +96,130 @@ def readClipper(file:str) -> gpd.GeoDataFrame:
     filepath = os.path.join(data_path,file)
     return gpd.read_file(filepath)
 
-def readAndClipLayers(filename:str, layername:str, clipper:gpd.GeoDataFrame, epsg = 25832) -> gpd.GeoDataFrame:
+def readAndClipLayers(filename:str, layername:str, clipper:gpd.GeoDataFrame, epsg = 25832, cache_dir:str = None, engine="fiona") -> gpd.GeoDataFrame:
+    '''
+    Reads the ALKIS layer (xml file) into a Geodataframe and clips to desired extent with a clipper Geodataframe \n
+    The layer is clipped in its own CRS (epsg if the file does not define one) and only the clipped features are reprojected to epsg. \n
+    With the engine "pyogrio", only the features intersecting the clipper are read (see readLayerFiltered). \n
+    With a cache directory, the clipped layer is read from the cache as long as the ALKIS file and the clipper did not change
+    '''
+    def readLayer() -> gpd.GeoDataFrame:
+        if engine == "pyogrio":
+            gdf = readLayerFiltered(os.path.join(alkis_path,filename), layername, clipper, epsg)
+        else:
+            # Open the file with Fiona
+            with fiona.open(os.path.join(alkis_path,filename), driver="GML", layer=layername) as src:
+                # Create a new GeoDataFrame
+                gdf = gpd.GeoDataFrame.from_features([feature for feature in src if shape(feature['geometry']).is_valid])
+                crs = src.crs
+
+            # Set the CRS of the file, ALKIS files without a known CRS are in epsg
+            gdf = gdf.set_crs(crs or epsg)
+
+        # Clip the GeoDataFrame
+        return clipAndReproject(gdf, clipper, epsg, keep_geom_type=True)
+
+    return cachedClip(readLayer, os.path.join(alkis_path,filename), f"{layername} ({engine})", clipper, epsg, cache_dir)
+
+def buildSidecar(filepath:str, sidecar_dir:str) -> str:
+    '''
+    Converts all layers of an ALKIS file (GML) once to a GeoPackage with a spatial index (sidecar) and returns its path. \n
+    The sidecar is reused as long as it is newer than the GML file. The GML file is converted in one pass with VectorTranslate
+    of the GDAL Python bindings or, without them, with the ogr2ogr command line tool. If neither is installed, an ImportError is raised,
+    since converting each layer separately would parse the GML file once per layer
+    '''
+    name = os.path.splitext(os.path.basename(filepath))[0] + ".gpkg"
+    sidecar = os.path.join(sidecar_dir, name)
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) > os.path.getmtime(filepath):
+        return sidecar
+
+    # write to a temporary file first, so that no incomplete sidecars are read
+    os.makedirs(sidecar_dir, exist_ok=True)
+    tmpPath = os.path.join(sidecar_dir, f"tmp_{name}")
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+
+    ogr2ogr = shutil.which("ogr2ogr")
+    if gdal is None and ogr2ogr is None:
+        raise ImportError("load_by_file needs the GDAL Python bindings (osgeo) or the ogr2ogr command line tool to convert the ALKIS files, install GDAL or set load_by_file = False")
+
+    print(f"convert {os.path.basename(filepath)} to GeoPackage")
+    if gdal is not None:
+        gdal.UseExceptions()
+        gdal.VectorTranslate(tmpPath, filepath, format="GPKG", layerCreationOptions=["SPATIAL_INDEX=YES"])
+    else:
+        subprocess.run([ogr2ogr, "-f", "GPKG", "-lco", "SPATIAL_INDEX=YES", tmpPath, filepath], check=True)
+    os.replace(tmpPath, sidecar)
+
+    return sidecar
+
+def readFileLayers(filename:str, layernames:list, clipper:gpd.GeoDataFrame, epsg = 25832, cache_dir:str = None, sidecar_dir:str = None) -> dict:
+    '''
+    Reads all requested layers of one ALKIS file and clips them, the GML file is parsed only once. \n
+    The file is converted to a sidecar (see buildSidecar), from which each layer is read with the clipper as spatial filter
+    (see readLayerFiltered). Without a sidecar directory, the sidecar is only kept in a temporary directory during the call.
+    Returns a dictionary of the clipped layers by layer name
+    '''
+    filepath = os.path.join(alkis_path,filename)
+    clippedLayers = {}
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        sidecar = None
+
+        def readLayer(layername:str) -> gpd.GeoDataFrame:
+            # the sidecar is only built if a layer is not in the cache of clipped inputs
+            nonlocal sidecar
+            if sidecar is None:
+                sidecar = buildSidecar(filepath, sidecar_dir or tmpDir)
+            gdf = readLayerFiltered(sidecar, layername, clipper, epsg)
+            return clipAndReproject(gdf, clipper, epsg, keep_geom_type=True)
+
+        for layername in layernames:
+            clippedLayers[layername] = cachedClip(lambda: readLayer(layername), filepath, f"{layername} (pyogrio)", clipper, epsg, cache_dir)
+
+    return clippedLayers
+
+def readLayerFiltered(filepath:str, layername:str, clipper:gpd.GeoDataFrame, epsg = 25832) -> gpd.GeoDataFrame:
     '''
-    Reads the ALKIS layer (xml file) into a Geodataframe and clips to desired extent with a clipper Geodataframe
+    Reads only the features of an ALKIS layer that intersect the clipper, the spatial filter is applied by GDAL while reading. \n
+    The features keep the CRS of the layer (epsg if the file does not define one), the clipper is transformed to it for the filter. \n
+    Invalid geometries are repaired (see repairGeometries) instead of being dropped
     '''
-    # Open the file with Fiona
-    with fiona.open(os.path.join(alkis_path,filename), driver="GML", layer=layername) as src:
-        # Create a new GeoDataFrame
-        gdf = gpd.GeoDataFrame.from_features([feature for feature in src if shape(feature['geometry']).is_valid])
+    crs = pyogrio.read_info(filepath, layer=layername)["crs"] or epsg
+    mask = shapely.union_all(clipperInCrs(clipper, crs).geometry.values)
+    gdf = gpd.read_file(filepath, layer=layername, engine="pyogrio", mask=mask)
+    gdf = gdf.set_crs(crs, allow_override=True)
 
-    # Set the CRS
-    gdf = gdf.set_crs(epsg)
+    gdf, repaired = repairGeometries(gdf)
+    if repaired:
+        print(f"{layername}: repaired {repaired} invalid geometries")
+    return gdf
 
-    # Clip the GeoDataFrame
-    clipped = gdf.clip(clipper, keep_geom_type=True)
-    return clipped
+def repairGeometries(gdf:gpd.GeoDataFrame) -> tuple[gpd.GeoDataFrame, int]:
+    '''
+    Finds invalid geometries on the whole geometry array and repairs them with make_valid. Repaired polygons keep only their
+    polygonal parts. Returns the Geodataframe and the number of repaired geometries
+    '''
+    geometries = np.asarray(gdf.geometry.array)
+    invalid = ~shapely.is_valid(geometries) & ~shapely.is_missing(geometries)
+    count = int(invalid.sum())
+    if count == 0:
+        return gdf, 0
+
+    geometries = geometries.copy()
+    repaired = shapely.make_valid(geometries[invalid])
+    polygonal = np.isin(shapely.get_type_id(geometries[invalid]), [3, 6])
+    repaired[polygonal] = polygonalParts(repaired[polygonal])
+    geometries[invalid] = repaired
+
+    return gdf.set_geometry(gpd.GeoSeries(geometries, index=gdf.index, crs=gdf.crs)), count
+
+def readLayerConfig(file:str) -> dict:
+    '''
+    Reads the dictionary (json file) which defines the translation and further operations of the ALKIS layers for each city
+    '''
+    with open(os.path.join(data_path,file)) as jsonFile:
+        return json.load(jsonFile)
 
 def readKeyTable(file:str) -> pd.DataFrame:
     '''
@@ -84,11 +257,8 @@ def vectoriseImperviousness(rasterDs:str, clipper:gpd.GeoDataFrame, class_breaks
     ## read imperviousness data and simplify
     imperv = rio.open_rasterio(os.path.join(data_path,rasterDs), masked=True).squeeze()
 
-    # reproject to 25832
-    imperv = imperv.rio.reproject(clipper.crs)
-
-    # clip
-    imperv_clip = imperv.rio.clip(clipper.geometry.values, clipper.crs)
+    # clip in the CRS of the raster and reproject only the clipped part to the CRS of the clipper
+    imperv_clip = clipAndReprojectRaster(imperv, clipper)
 
     # reclassify raster
     classes = class_breaks
@@ -104,6 +274,78 @@ def vectoriseImperviousness(rasterDs:str, clipper:gpd.GeoDataFrame, class_breaks
     return imperv_low, imperv_high
 
 
+def readImperviousnessClasses(rasterDs:str, clipper:gpd.GeoDataFrame, class_breaks:list) -> xr.DataArray:
+    '''
+    Reads the imperviousness raster, clips and reprojects it to the CRS of the clipper and reclassifies the degrees of imperviousness
+    into the three classes at the resolution of the raster, exactly as vectoriseImperviousness does before the vectorisation. \n
+    Cells without imperviousness data (NaN) are therefore put in the highest class by np.digitize in both correction methods,
+    and the corrected rasters are the same as the rasterised result of the overlay.
+    '''
+    imperv = rio.open_rasterio(os.path.join(data_path,rasterDs), masked=True).squeeze()
+
+    # clip in the CRS of the raster and reproject only the clipped part, the classes are resampled to the target grid later
+    imperv_clip = clipAndReprojectRaster(imperv, clipper)
+
+    # reclassify raster
+    imperv_class = xr.DataArray(np.digitize(imperv_clip.values, class_breaks).astype("int8"), coords=imperv_clip.coords, dims=imperv_clip.dims)
+    return imperv_class.rio.write_nodata(0)
+
+def classifyImperviousness(imperv_class:xr.DataArray, grid:RasterGrid, window:rasterio.windows.Window=None) -> np.ndarray:
+    '''
+    Resamples the imperviousness classes (see readImperviousnessClasses) onto the target grid or a window of it (nearest neighbour),
+    no vectorisation is done. Cells outside the imperviousness raster receive class 0.
+    '''
+    if window is None:
+        shape, transform = (grid.height, grid.width), grid.transform
+    else:
+        shape, transform = (int(window.height), int(window.width)), rasterio.windows.transform(window, grid.transform)
+
+    imperv_grid = imperv_class.rio.reproject(grid.crs, shape=shape, transform=transform, resampling=Resampling.nearest, nodata=0)
+    return imperv_grid.values.astype("int8")
+
+def correctSurfaceRaster(rasters:dict, imperv_class:np.ndarray, nodata=-9999) -> dict:
+    '''
+    Identifies green and sealed areas per raster cell with the same rules as identifyGreen and identifySealed. \n
+    - cells of layers flagged with identifyGreen with PALM pavement type 3 and low imperviousness (class 1) are changed to vegetation type 8
+    - cells of layers flagged with identifySealed without pavement type and high imperviousness (class 3) are changed to pavement type 3 \n
+    Water cells keep their land use.
+    '''
+    pavement = rasters["pavement"]
+    land_use = rasters["land_use"]
+    water = land_use > 20
+
+    green = (rasters["identifyGreen"] == 1) & (pavement == 3) & (imperv_class == 1)
+    sealed = (rasters["identifySealed"] == 1) & (pavement == nodata) & (imperv_class == 3)
+
+    pavement[green] = nodata
+    land_use[green & ~water] = 8
+    pavement[sealed] = 3
+    land_use[sealed & ~water] = nodata
+
+    return rasters
+
+def vectoriseSurfaceRaster(rasters:dict, grid:RasterGrid, nodata=-9999) -> gpd.GeoDataFrame:
+    '''
+    Polygonises the (corrected) pavement and land use rasters into a Geodataframe. \n
+    Only needed if a vector dataset of the corrected surface types is required.
+    '''
+    # combine both int16 rasters into one key per cell and polygonise the keys
+    key = rasters["pavement"].astype("int64") * 65536 + (rasters["land_use"].astype("int64") + 32768)
+    codes, labels = np.unique(key, return_inverse=True)
+    labels = labels.reshape(key.shape).astype("int32")
+
+    geometries, values = [], []
+    for geom, value in shapes(labels, transform=grid.transform):
+        geometries.append(shape(geom))
+        values.append(int(value))
+    codes = codes[values]
+
+    surface = gpd.GeoDataFrame({"pavement": codes // 65536, "land_use": codes % 65536 - 32768}, geometry=geometries, crs=grid.crs)
+
+    # drop cells without ALKIS data and set nodata to NaN
+    surface = surface[(surface["pavement"] != 0) | (surface["land_use"] != 0)]
+    return surface.replace(nodata, np.nan)
+
 def identifyGreen(imperv_low:gpd.GeoDataFrame, alkis_edit:gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     '''
     This function identifies green areas within areas currently defined as a PALM pavement (artificial) type 3.\n
@@ -169,6 +411,71 @@ def identifySealed(imperv_high:gpd.GeoDataFrame, alkis_edit:gpd.GeoDataFrame) ->
 
     return alkis_palm1
 
+def polygonalParts(geometries:np.ndarray) -> np.ndarray:
+    '''
+    Keeps only the polygonal parts of geometries (e.g. of geometry collections after an intersection), other geometries become empty
+    '''
+    geometries = geometries.copy()
+    typeIds = shapely.get_type_id(geometries)
+    for i in np.flatnonzero(~np.isin(typeIds, [3, 6])):
+        parts = shapely.get_parts(geometries[i])
+        geometries[i] = shapely.union_all(parts[shapely.get_type_id(parts) == 3])
+    return geometries
+
+def reclassifyIntersections(alkis_edit:gpd.GeoDataFrame, subset:pd.Series, imperv:gpd.GeoDataFrame, newValues:dict) -> gpd.GeoDataFrame:
+    '''
+    Splits the features of the subset of the ALKIS Geodataframe that intersect imperviousness polygons. \n
+    Candidate pairs are found with the spatial index (STRtree) of the imperviousness polygons. The parts inside the
+    imperviousness polygons receive the new column values, the remaining parts keep their attributes. All other
+    features are kept unchanged, so no union overlay of the whole layer is needed.
+    '''
+    subsetPositions = np.flatnonzero(subset.to_numpy())
+    geometries = alkis_edit.geometry.values
+
+    # candidate pairs of (subset feature, imperviousness polygon) from the spatial index
+    featureIdx, impervIdx = imperv.sindex.query(geometries[subsetPositions], predicate="intersects")
+    if len(featureIdx) == 0:
+        return alkis_edit.copy()
+
+    # intersect each pair and keep the polygonal parts
+    pieces = shapely.intersection(geometries[subsetPositions[featureIdx]], imperv.geometry.values[impervIdx])
+    parts, partIdx = shapely.get_parts(pieces, return_index=True)
+    polygonal = (shapely.get_type_id(parts) == 3) & (shapely.area(parts) > 0)
+    parts = parts[polygonal]
+    owners = subsetPositions[featureIdx[partIdx[polygonal]]]
+    if len(parts) == 0:
+        return alkis_edit.copy()
+
+    # remaining part of each touched feature outside the imperviousness polygons
+    order = np.argsort(owners, kind="stable")
+    touched, starts = np.unique(owners[order], return_index=True)
+    covered = np.array([shapely.union_all(group) for group in np.split(parts[order], starts[1:])], dtype=object)
+    remainder = polygonalParts(shapely.difference(geometries[touched], covered))
+
+    # splice the split features back into the layer
+    untouched = alkis_edit.iloc[np.setdiff1d(np.arange(len(alkis_edit)), touched)]
+    rest = alkis_edit.iloc[touched].set_geometry(remainder)
+    rest = rest[~rest.geometry.is_empty]
+    inside = alkis_edit.iloc[owners].set_geometry(parts)
+    for column, value in newValues.items():
+        inside[column] = value
+
+    return gpd.GeoDataFrame(pd.concat([untouched, rest, inside], ignore_index=True), crs=alkis_edit.crs)
+
+def identifyGreenIndexed(imperv_low:gpd.GeoDataFrame, alkis_edit:gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    '''
+    Same result as identifyGreen without union overlay: only the features with PALM pavement type 3 that intersect
+    polygons with low imperviousness are split and the parts inside are changed to vegetation type 8.
+    '''
+    return reclassifyIntersections(alkis_edit, alkis_edit["pavement"] == 3.0, imperv_low, {"vegetation": 8.0, "pavement": np.nan})
+
+def identifySealedIndexed(imperv_high:gpd.GeoDataFrame, alkis_edit:gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    '''
+    Same result as identifySealed without union overlay: only the features without pavement type that intersect
+    polygons with high imperviousness are split and the parts inside are changed to pavement type 3.
+    '''
+    return reclassifyIntersections(alkis_edit, alkis_edit["pavement"].isna(), imperv_high, {"vegetation": np.nan, "pavement": 3.0})
+
 def overlayRail(city:str) -> None:
     '''
     Overlays the ALKIS rail layer with other layers defined in the dictionary to exclude subways 
@@ -188,107 +495,369 @@ def overlayRail(city:str) -> None:
         if layer["layername"] == "AX_Bahnverkehr":
             layer["clippedLayer"] =  rail
 
-def rasteriseSurface(gdf:gpd.GeoDataFrame,column:str,resolution:float) -> None:
+def translateLayer(layer:dict, clipper:gpd.GeoDataFrame, imperv_low:gpd.GeoDataFrame, imperv_high:gpd.GeoDataFrame, correction="overlay", clippedLayer:gpd.GeoDataFrame=None) -> gpd.GeoDataFrame:
     '''
-    Rasterises the processed ALKIS dataset with a desired resolution and converts to values to integer
+    Translates one ALKIS layer to PALM classes based on its entry in the layer dictionary (alkis_dict.json). \n
+    The layer is read and clipped (unless an already clipped layer is given), mapped to PALM classes either with a translation table or as a whole layer,
+    NAN values are replaced and green and sealed areas are identified if configured (with the correction method "overlay" or "sindex").
+    With the correction method "raster", the layer is only flagged for the identification after rasterisation.
+    The translated layer is returned.
     '''
-    output_raster_path = os.path.join(outpath,f"alkis_palm_{column}.tif")
-
-    # Set the desired raster resolution and bounding box
-    pixel_size = resolution  # Adjust this according to your needs
-    minx, miny, maxx, maxy = gdf.total_bounds
-    width = int((maxx - minx) / pixel_size)
-    height = int((maxy - miny) / pixel_size)
-
-    # Define the raster transform
-    transform = from_origin(minx, maxy, pixel_size, pixel_size)
-
-    # Define the CRS
-    crs = gdf.crs
-
-    # Create a new raster file
-    with rasterio.open(output_raster_path, 'w', driver='GTiff', count=1, dtype='int16', width=width, height=height, transform=transform, crs=crs, nodata=-9999) as dst:
-        # Handle NaN values and round to integers
-        shapes = [
-            (geom, int(round(value)) if not np.isnan(value) else -9999)
-            for geom, value in zip(gdf.geometry, gdf[column])
-        ]
-        # Rasterize the GeoDataFrame into the new raster
-        raster = rasterize(shapes, out_shape=(height, width), transform=transform)
-        
-        # Write the raster data to the output raster
-        dst.write(raster, 1)
-
-## translate ALKIS to PALM surface types
-# step 1 read clipper and vectorise imperviousness
-clipper = readClipper("clip.shp")
-
-imperv_low, imperv_high = vectoriseImperviousness(
-    rasterDs="Imperviousness/DATA/IMD_2018_010m_E41N31_03035_v020.tif",
-    clipper = clipper
-)
-
-# step 2 loop through dictionary which defines translation and further operations
-for layer in layers["Bochum"]:
     print(layer["layername"])
-    # read and clip each ALKIS layer
-    layer["clippedLayer"] = readAndClipLayers(
-        filename = layer["filename"],
-        layername = layer["layername"],
-        clipper=clipper
-    )
+    # read and clip the ALKIS layer
+    if clippedLayer is None:
+        clippedLayer = readAndClipLayers(
+            filename = layer["filename"],
+            layername = layer["layername"],
+            clipper=clipper,
+            epsg=epsg,
+            cache_dir=cache_path,
+            engine=read_engine
+        )
 
     # translate to PALM classes either with translation table or as a whole layer
     if layer["mapOnAttribute"]:
         keyTable = readKeyTable(layer["keyTable"])
         if layer["mergeKeyOnFunction"]:
-            layer["clippedLayer"] = layer["clippedLayer"].merge(keyTable, how="left", on="funktion")
+            clippedLayer = clippedLayer.merge(keyTable, how="left", on="funktion")
         else:
-            layer["clippedLayer"] = layer["clippedLayer"].merge(keyTable, how="left", on="vegetationsmerkmal")
+            clippedLayer = clippedLayer.merge(keyTable, how="left", on="vegetationsmerkmal")
         
         # replace NAN values due to missing attributes in ALKIS layer
-        layer["clippedLayer"] = replaceNA(
+        clippedLayer = replaceNA(
             config = layer["replaceNA"]["config"],
-            layer = layer["clippedLayer"],
+            layer = clippedLayer,
             value = layer["replaceNA"]["value"],
             columnToOverwrite = layer["replaceNA"]["column"]
         )
     else:
-        layer["clippedLayer"][layer["palmMapping"]["palmSurfaceType"]] = layer["palmMapping"]["palmValue"]
+        clippedLayer[layer["palmMapping"]["palmSurfaceType"]] = layer["palmMapping"]["palmValue"]
+
+    # with the raster correction, green and sealed areas are identified per cell after rasterisation
+    if correction == "raster":
+        clippedLayer["identifyGreen"] = float(layer["identifyGreen"])
+        clippedLayer["identifySealed"] = float(layer["identifySealed"])
+        return clippedLayer
 
     # identify green areas in sealed classes and change to vegetation
     if layer["identifyGreen"]:
-        layer["clippedLayer"]=identifyGreen(imperv_low,layer["clippedLayer"])
+        if correction == "sindex":
+            clippedLayer = identifyGreenIndexed(imperv_low,clippedLayer)
+        else:
+            clippedLayer = identifyGreen(imperv_low,clippedLayer)
 
     # identify sealed areas in sports and leisure facilities and change to pavement
     if layer["identifySealed"]:
-        layer["clippedLayer"]=identifySealed(imperv_high,layer["clippedLayer"])
+        if correction == "sindex":
+            clippedLayer = identifySealedIndexed(imperv_high,clippedLayer)
+        else:
+            clippedLayer = identifySealed(imperv_high,clippedLayer)
+
+    return clippedLayer
+
+def translateFileLayers(fileLayers:list, clipper:gpd.GeoDataFrame, imperv_low:gpd.GeoDataFrame, imperv_high:gpd.GeoDataFrame, correction="overlay") -> list:
+    '''
+    Reads all layers of one ALKIS file at once (see readFileLayers) and translates each of them with translateLayer. \n
+    fileLayers are the entries of the layer dictionary that share the same file, the translated layers are returned in this order
+    '''
+    clippedLayers = readFileLayers(
+        filename = fileLayers[0]["filename"],
+        layernames = [layer["layername"] for layer in fileLayers],
+        clipper = clipper,
+        epsg = epsg,
+        cache_dir = cache_path,
+        sidecar_dir = sidecar_path
+    )
+    return [translateLayer(layer, clipper, imperv_low, imperv_high, correction, clippedLayers[layer["layername"]]) for layer in fileLayers]
+
+def groupLayersByFile(layerConfig:list) -> dict:
+    '''
+    Groups the positions of the entries of the layer dictionary by their file name. 
+
+    Entries without a file name (e.g. Berlin, whose layers are read from one GeoPackage by alkis2PALM_gpkg.py) cannot be
+    read file by file and raise a ValueError
+    '''
+    missing = [layer["layername"] for layer in layerConfig if not layer.get("filename")]
+    if missing:
+        raise ValueError(f"layers without filename cannot be read by file: {', '.join(missing)} (see alkis2PALM_gpkg.py)")
+
+    groups = {}
+    for i, layer in enumerate(layerConfig):
+        groups.setdefault(layer["filename"], []).append(i)
+    return groups
+
+def initLayerWorker(settings:dict, clipper:gpd.GeoDataFrame, imperv_low:gpd.GeoDataFrame, imperv_high:gpd.GeoDataFrame, correction:str) -> None:
+    '''
+    Applies the configured module variables of the main process (see WORKER_SETTINGS) and stores the inputs shared by all
+    layers once in each worker process, so they are not sent along with every layer
+    '''
+    configure(globals(), settings)
+    workerInputs.update(clipper=clipper, imperv_low=imperv_low, imperv_high=imperv_high, correction=correction)
+
+def translateLayerInWorker(layer:dict) -> gpd.GeoDataFrame:
+    '''
+    Translates one ALKIS layer in a worker process with the inputs stored by initLayerWorker
+    '''
+    return translateLayer(layer, **workerInputs)
+
+def translateFileLayersInWorker(fileLayers:list) -> list:
+    '''
+    Translates all layers of one ALKIS file in a worker process with the inputs stored by initLayerWorker
+    '''
+    return translateFileLayers(fileLayers, **workerInputs)
+
+def translateLayers(layerConfig:list, clipper:gpd.GeoDataFrame, imperv_low:gpd.GeoDataFrame, imperv_high:gpd.GeoDataFrame, workers=1, correction="overlay", by_file=False) -> list:
+    '''
+    Translates all ALKIS layers of a city to PALM classes and returns the translated layers in the order of the layer dictionary. \n
+    With more than one worker the layers are translated in parallel in a process pool. With by_file, the layers are read
+    file by file (see translateFileLayers) and the files are processed in parallel.
+    '''
+    settings = {key: globals()[key] for key in WORKER_SETTINGS}
+    if not by_file:
+        if workers == 1:
+            return [translateLayer(layer, clipper, imperv_low, imperv_high, correction) for layer in layerConfig]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=initLayerWorker, initargs=(settings, clipper, imperv_low, imperv_high, correction)) as executor:
+            return list(executor.map(translateLayerInWorker, layerConfig))
+
+    groups = groupLayersByFile(layerConfig)
+    fileLayers = [[layerConfig[i] for i in positions] for positions in groups.values()]
+
+    if workers == 1:
+        translatedFiles = [translateFileLayers(layers, clipper, imperv_low, imperv_high, correction) for layers in fileLayers]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initLayerWorker, initargs=(settings, clipper, imperv_low, imperv_high, correction)) as executor:
+            translatedFiles = list(executor.map(translateFileLayersInWorker, fileLayers))
+
+    # restore the order of the layer dictionary
+    translated = [None] * len(layerConfig)
+    for positions, layers in zip(groups.values(), translatedFiles):
+        for i, clippedLayer in zip(positions, layers):
+            translated[i] = clippedLayer
+    return translated
+
+def layerPartPath(layer:dict, layer_dir:str) -> str:
+    '''
+    Returns the path of the translated part of an ALKIS layer in the layer directory (GeoParquet or GeoPackage, see vectorPath)
+    '''
+    return vectorPath(layer_dir, f"{os.path.splitext(layer['filename'])[0]}_{layer['layername']}")
+
+def layerDependencies(layer:dict, clipper:gpd.GeoDataFrame, correction="overlay") -> tuple[list,dict]:
+    '''
+    Returns the input files and the config a translated ALKIS layer depends on: the ALKIS file, the translation table,
+    the imperviousness raster (only if green or sealed areas are identified on the vector data), the entry of the layer dictionary,
+    the clipper and the processing options
+    '''
+    inputs = [os.path.join(alkis_path,layer["filename"])]
+    if layer["mapOnAttribute"]:
+        inputs.append(os.path.join(keys_path,layer["keyTable"]))
+    if correction != "raster" and (layer["identifyGreen"] or layer["identifySealed"]):
+        inputs.append(os.path.join(data_path,imperv_raster))
+
+    options = {
+        "layer": {key: value for key, value in layer.items() if key != "clippedLayer"},
+        "clipper": geometryHash(clipper),
+        "epsg": epsg,
+        "correction": correction,
+        "class_breaks": class_breaks,
+        "read_engine": read_engine
+    }
+    return inputs, options
+
+def staleLayers(layerConfig:list, clipper:gpd.GeoDataFrame, layer_dir:str, manifest:dict, correction="overlay") -> list:
+    '''
+    Returns the positions of the ALKIS layers whose translated part is missing or whose inputs or config changed since it was saved
+    '''
+    return [i for i, layer in enumerate(layerConfig) if not isUpToDate(manifest, layerPartPath(layer, layer_dir), *layerDependencies(layer, clipper, correction))]
+
+def translateLayersIncremental(layerConfig:list, clipper:gpd.GeoDataFrame, layer_dir:str, manifest:dict, stale:list, workers=1, correction="overlay", by_file=False) -> list:
+    '''
+    Translates only the stale ALKIS layers (see staleLayers) and saves each of them as a part in the layer directory, the
+    other layers are read from their parts. 
+
+    The imperviousness is only vectorised if a stale layer needs it. The translated layers are returned in the order of the layer dictionary
+    '''
+    translated = [None] * len(layerConfig)
+    if stale:
+        staleConfig = [layerConfig[i] for i in stale]
+        imperv_low, imperv_high = None, None
+        if correction != "raster" and any(layer["identifyGreen"] or layer["identifySealed"] for layer in staleConfig):
+            imperv_low, imperv_high = vectoriseImperviousness(rasterDs=imperv_raster, clipper=clipper, class_breaks=class_breaks)
+
+        os.makedirs(layer_dir, exist_ok=True)
+        for i, clippedLayer in zip(stale, translateLayers(staleConfig, clipper, imperv_low, imperv_high, workers=workers, correction=correction, by_file=by_file)):
+            part = layerPartPath(layerConfig[i], layer_dir)
+            writeVector(clippedLayer, part)
+            recordOutput(manifest, part, *layerDependencies(layerConfig[i], clipper, correction))
+            translated[i] = clippedLayer
+        writeManifest(layer_dir, manifest, "alkis2PALM")
+
+    print(f"translated {len(stale)} layers, reused {len(layerConfig) - len(stale)} layers")
+    return [clippedLayer if clippedLayer is not None else readVector(layerPartPath(layer, layer_dir)) for layer, clippedLayer in zip(layerConfig, translated)]
+
+def rasteriseSurface(gdf:gpd.GeoDataFrame,column:str,resolution:float,block_size:int=None) -> None:
+    '''
+    Rasterises the processed ALKIS dataset with a desired resolution and converts to values to integer
+    '''
+    rasteriseSurfaces(gdf,[column],resolution,block_size)
+
+def rasteriseSurfaces(gdf:gpd.GeoDataFrame,columns:list,resolution:float,block_size:int=None) -> None:
+    '''
+    Rasterises several columns of the processed ALKIS dataset in one pass onto the same grid and converts the values to integer. \n
+    Each column is saved as a separate GeoTiff. With a block_size the grid is rasterised and written block by block.
+    '''
+    grid = gridFromBounds(gdf.total_bounds, resolution, gdf.crs)
+    outputs = {column: os.path.join(outpath,f"alkis_palm_{column}.tif") for column in columns}
 
-# overlay rail with sealed ALKIS data to exclude subways
-overlayRail("Bochum")
+    # features without a value are set to nodata, cells without features keep 0
+    rasteriseToGeoTiff(gdf, columns, grid, outputs, fill=0, nodata=-9999, block_size=block_size)
 
-# create empty geodataframe for combined ALKIS layers
-alkis_palm_all= gpd.GeoDataFrame()
+def rasteriseSurfacesCorrected(gdf:gpd.GeoDataFrame, resolution:float, rasterDs:str, clipper:gpd.GeoDataFrame, class_breaks:list, block_size:int=None) -> tuple[dict,RasterGrid]:
+    '''
+    Rasterises pavement and land use of the processed ALKIS dataset, identifies green and sealed areas per raster cell
+    with the imperviousness raster (see correctSurfaceRaster) and saves both as GeoTiffs. \n
+    The layer flags identifyGreen and identifySealed are rasterised in the same pass. The corrected rasters and the grid are returned.
+    With a block_size the correction is done block by block and each block is written directly into the GeoTiffs
+    (see rasteriseSurfacesCorrectedWindowed), then no rasters are returned.
+    '''
+    grid = gridFromBounds(gdf.total_bounds, resolution, gdf.crs)
+    imperv_class = readImperviousnessClasses(rasterDs, clipper, class_breaks)
+    outputs = {column: os.path.join(outpath,f"alkis_palm_{column}.tif") for column in ["pavement","land_use"]}
 
-# combine all ALKIS layers translated to PALM
-for layer in layers["Bochum"]:
-    alkis_palm_all = pd.concat([alkis_palm_all, layer["clippedLayer"]])
+    if block_size is not None:
+        rasteriseSurfacesCorrectedWindowed(gdf, grid, imperv_class, outputs, block_size)
+        return None, grid
 
-# keep only necessary columns
-alkis_palm_all = alkis_palm_all[["pavement","vegetation","water","geometry"]]
+    rasters = rasteriseColumns(gdf, ["pavement","land_use","identifyGreen","identifySealed"], grid, fill=0, nodata=-9999)
+    rasters = correctSurfaceRaster(rasters, classifyImperviousness(imperv_class, grid))
+    writeRasters({column: rasters[column] for column in outputs}, grid, outputs, nodata=-9999)
 
-# combine with named PALM class table for visualisation purposes
-class_names = pd.read_csv(os.path.join(data_path,"PALM_classes.csv"))
+    return rasters, grid
 
-alkis_palm_named = alkis_palm_all.merge(class_names, on=["pavement","vegetation","water"], how="left")
+def rasteriseSurfacesCorrectedWindowed(gdf:gpd.GeoDataFrame, grid:RasterGrid, imperv_class:xr.DataArray, outputs:dict, block_size:int=4096) -> None:
+    '''
+    Rasterises and corrects pavement and land use block by block (see rasteriseSurfacesCorrected) and writes each block directly
+    into the GeoTiffs. Only the features intersecting a block are rasterised and the imperviousness classes are resampled
+    per block, so the memory needed is bounded by the block size and not by the size of the domain.
+    '''
+    columns = ["pavement","land_use","identifyGreen","identifySealed"]
+    geometries = gdf.geometry.values
+    tree = shapely.STRtree(geometries)
+    values = {column: valueArray(gdf, column, "int16", -9999) for column in columns}
+    profile = dict(GTIFF_PROFILE, width=grid.width, height=grid.height, transform=grid.transform, crs=grid.crs, nodata=-9999)
+
+    with rasterio.open(outputs["pavement"], "w", count=1, dtype="int16", **profile) as pavement, \
+         rasterio.open(outputs["land_use"], "w", count=1, dtype="int16", **profile) as land_use:
+        for window in blockWindows(grid, block_size):
+            index = rasteriseIndex(geometries, grid, window=window, tree=tree)
+            rasters = {column: fillFromIndex(index, values[column], fill=0) for column in columns}
+            rasters = correctSurfaceRaster(rasters, classifyImperviousness(imperv_class, grid, window))
+            pavement.write(rasters["pavement"], 1, window=window)
+            land_use.write(rasters["land_use"], 1, window=window)
+
+def readSurfaceRasters(outputs:dict) -> dict:
+    '''
+    Reads the saved pavement and land use rasters, e.g. to polygonise the corrected rasters after a correction block by block
+    '''
+    rasters = {}
+    for column, path in outputs.items():
+        with rasterio.open(path) as src:
+            rasters[column] = src.read(1)
+    return rasters
 
-# create land_use column from combination of vegetation and water for later use in GEO4PALM
-alkis_palm_named["land_use"] = alkis_palm_named["vegetation"]
-alkis_palm_named["land_use"] = np.where(alkis_palm_named["water"].notna(), alkis_palm_named["water"] + 20, alkis_palm_named["land_use"])
+def run(config:dict = None) -> None:
+    '''
+    Translates the ALKIS layers of a city to PALM surface types and rasterises them. \n
+    The data paths and processing options of this script can be overridden with a step config (see runner/run_domain.py)
+    '''
+    # the layer dictionary is shared with overlayRail
+    global layers
+    configure(globals(), config)
+
+    ## translate ALKIS to PALM surface types
+    # read dictionary which defines translation and further operations
+    layers = readLayerConfig(layer_config)
+
+    # step 1 read clipper
+    clipper = readClipper(clip_file)
+
+    # outputs of this script, their inputs and config (see manifest of the outpath, only used with a layer directory)
+    outputs = [vectorPath(outpath, "alkis_palm_test", vector_format)] + [os.path.join(outpath,f"alkis_palm_{column}.tif") for column in ["pavement","land_use"]]
+    if correction == "raster" and vectorise_corrected:
+        outputs.append(vectorPath(outpath, "alkis_palm_corrected", vector_format))
+    options = {"city": city, "resolution": resolution, "correction": correction, "class_breaks": class_breaks, "vector_format": vector_format}
+
+    if layer_path is not None:
+        # step 2 translate only the layers whose inputs or config changed, skip everything if the outputs are up to date
+        layerManifest = {} if force else readManifest(layer_path, "alkis2PALM")
+        stale = staleLayers(layers[city], clipper, layer_path, layerManifest, correction)
+
+        inputs = [layerPartPath(layer, layer_path) for layer in layers[city]] + [os.path.join(data_path,"PALM_classes.csv")]
+        if correction == "raster":
+            inputs.append(os.path.join(data_path,imperv_raster))
+        manifest = {} if force else readManifest(outpath, "alkis2PALM")
+        if not stale and outputsUpToDate(manifest, outputs, inputs, options):
+            print("ALKIS outputs are up to date")
+            return
+
+        translated = translateLayersIncremental(layers[city], clipper, layer_path, layerManifest, stale, workers=workers, correction=correction, by_file=load_by_file)
+    else:
+        # vectorise imperviousness (not needed with the raster correction)
+        imperv_low, imperv_high = None, None
+        if correction != "raster":
+            imperv_low, imperv_high = vectoriseImperviousness(
+                rasterDs=imperv_raster,
+                clipper = clipper,
+                class_breaks = class_breaks
+            )
+
+        # step 2 translate each layer as defined in the dictionary, the layers are independent and can be translated in parallel
+        translated = translateLayers(layers[city], clipper, imperv_low, imperv_high, workers=workers, correction=correction, by_file=load_by_file)
+    for layer, clippedLayer in zip(layers[city], translated):
+        layer["clippedLayer"] = clippedLayer
+
+    # overlay rail with sealed ALKIS data to exclude subways
+    overlayRail(city)
+
+    # create empty geodataframe for combined ALKIS layers
+    alkis_palm_all= gpd.GeoDataFrame()
+
+    # combine all ALKIS layers translated to PALM
+    for layer in layers[city]:
+        alkis_palm_all = pd.concat([alkis_palm_all, layer["clippedLayer"]])
+
+    # keep only necessary columns
+    flags = ["identifyGreen","identifySealed"] if correction == "raster" else []
+    alkis_palm_all = alkis_palm_all[["pavement","vegetation","water"] + flags + ["geometry"]]
+
+    # combine with named PALM class table for visualisation purposes
+    class_names = pd.read_csv(os.path.join(data_path,"PALM_classes.csv"))
+
+    alkis_palm_named = alkis_palm_all.merge(class_names, on=["pavement","vegetation","water"], how="left")
+
+    # create land_use column from combination of vegetation and water for later use in GEO4PALM
+    alkis_palm_named["land_use"] = alkis_palm_named["vegetation"]
+    alkis_palm_named["land_use"] = np.where(alkis_palm_named["water"].notna(), alkis_palm_named["water"] + 20, alkis_palm_named["land_use"])
+
+    # save vector data
+    writeVector(alkis_palm_named.drop(columns=flags), vectorPath(outpath, "alkis_palm_test", vector_format))
+
+    # rasterise both layers
+    if correction == "raster":
+        # identify green and sealed areas per raster cell
+        rasters, grid = rasteriseSurfacesCorrected(alkis_palm_named, resolution, imperv_raster, clipper, class_breaks, block_size)
+        if vectorise_corrected:
+            # the polygonisation needs the whole rasters, after a correction block by block they are read from the GeoTiffs
+            if rasters is None:
+                rasters = readSurfaceRasters({column: os.path.join(outpath,f"alkis_palm_{column}.tif") for column in ["pavement","land_use"]})
+            writeVector(vectoriseSurfaceRaster(rasters, grid), vectorPath(outpath, "alkis_palm_corrected", vector_format))
+    else:
+        rasteriseSurfaces(alkis_palm_named,["pavement","land_use"],resolution,block_size)
 
-# save shapefile
-alkis_palm_named.to_file(os.path.join(outpath,"alkis_palm_test.shp"))
+    # record the dependencies of the outputs
+    if layer_path is not None:
+        recordOutputs(manifest, outputs, inputs, options)
+        writeManifest(outpath, manifest, "alkis2PALM")
 
-# rasterise both layers
-rasteriseSurface(alkis_palm_named,"pavement",2.0)
-rasteriseSurface(alkis_palm_named,"land_use",2.0)
\ No newline at end of file
+if __name__ == "__main__":
+    run()
\ No newline at end of file
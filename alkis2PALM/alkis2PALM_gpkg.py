@@ -2,24 +2,34 @@
 import geopandas as gpd
 import pandas as pd
 import os
+import sys
 import numpy as np
 import xarray as xr
 import rioxarray as rio
 from geocube.vector import vectorize
 import shapely
 import json
-import rasterio
-from rasterio.transform import from_origin
-from rasterio.features import rasterize
 import fiona
 from shapely.geometry import shape
 
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.crs import clipAndReproject, clipAndReprojectRaster
+from common.rasterise import gridFromBounds, rasteriseToGeoTiff
+from common.vectorio import vectorPath, writeVector
+
 # set data paths
 data_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use"
 alkis_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use/ALKIS/bo_nutzung"
 keys_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use/translation_tables"
 outpath = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use/processed"
 
+# processing options
+# rasterise block by block with this block size (in cells) for domains larger than memory, None rasterises the whole grid at once
+block_size = None
+# format of the vector outputs: "parquet" (GeoParquet), "gpkg" (GeoPackage) or "shp" (Shapefile)
+vector_format = "shp"
+
 # define gloabl variables
 with open(os.path.join(data_path,"alkis_dict.json")) as jsonFile:
     layers = json.load(jsonFile)
@@ -40,12 +50,13 @@ def readAndClipLayers(filename:str, layername:str, clipper:gpd.GeoDataFrame, eps
     with fiona.open(os.path.join(alkis_path,filename), driver="GML", layer=layername) as src:
         # Create a new GeoDataFrame
         gdf = gpd.GeoDataFrame.from_features([feature for feature in src if shape(feature['geometry']).is_valid])
+        crs = src.crs
 
-    # Set the CRS
-    gdf = gdf.set_crs(epsg)
+    # Set the CRS of the file, ALKIS files without a known CRS are in epsg
+    gdf = gdf.set_crs(crs or epsg)
 
-    # Clip the GeoDataFrame
-    clipped = gdf.clip(clipper, keep_geom_type=True)
+    # Clip the GeoDataFrame in its own CRS and reproject only the clipped features
+    clipped = clipAndReproject(gdf, clipper, epsg, keep_geom_type=True)
     return clipped
 
 def readKeyTable(file:str) -> pd.DataFrame:
@@ -84,11 +95,8 @@ def vectoriseImperviousness(rasterDs:str, clipper:gpd.GeoDataFrame, class_breaks
     ## read imperviousness data and simplify
     imperv = rio.open_rasterio(os.path.join(data_path,rasterDs), masked=True).squeeze()
 
-    # reproject to 25832
-    imperv = imperv.rio.reproject(clipper.crs)
-
-    # clip
-    imperv_clip = imperv.rio.clip(clipper.geometry.values, clipper.crs)
+    # clip in the CRS of the raster and reproject only the clipped part to the CRS of the clipper
+    imperv_clip = clipAndReprojectRaster(imperv, clipper)
 
     # reclassify raster
     classes = class_breaks
@@ -188,36 +196,22 @@ def overlayRail(city:str) -> None:
         if layer["layername"] == "AX_Bahnverkehr":
             layer["clippedLayer"] =  rail
 
-def rasteriseSurface(gdf:gpd.GeoDataFrame,column:str,resolution:float) -> None:
+def rasteriseSurface(gdf:gpd.GeoDataFrame,column:str,resolution:float,block_size:int=None) -> None:
     '''
     Rasterises the processed ALKIS dataset with a desired resolution and converts to values to integer
     '''
-    output_raster_path = os.path.join(outpath,f"alkis_palm_{column}.tif")
-
-    # Set the desired raster resolution and bounding box
-    pixel_size = resolution  # Adjust this according to your needs
-    minx, miny, maxx, maxy = gdf.total_bounds
-    width = int((maxx - minx) / pixel_size)
-    height = int((maxy - miny) / pixel_size)
-
-    # Define the raster transform
-    transform = from_origin(minx, maxy, pixel_size, pixel_size)
-
-    # Define the CRS
-    crs = gdf.crs
-
-    # Create a new raster file
-    with rasterio.open(output_raster_path, 'w', driver='GTiff', count=1, dtype='int16', width=width, height=height, transform=transform, crs=crs, nodata=-9999) as dst:
-        # Handle NaN values and round to integers
-        shapes = [
-            (geom, int(round(value)) if not np.isnan(value) else -9999)
-            for geom, value in zip(gdf.geometry, gdf[column])
-        ]
-        # Rasterize the GeoDataFrame into the new raster
-        raster = rasterize(shapes, out_shape=(height, width), transform=transform)
-        
-        # Write the raster data to the output raster
-        dst.write(raster, 1)
+    rasteriseSurfaces(gdf,[column],resolution,block_size)
+
+def rasteriseSurfaces(gdf:gpd.GeoDataFrame,columns:list,resolution:float,block_size:int=None) -> None:
+    '''
+    Rasterises several columns of the processed ALKIS dataset in one pass onto the same grid and converts the values to integer. \n
+    Each column is saved as a separate GeoTiff. With a block_size the grid is rasterised and written block by block.
+    '''
+    grid = gridFromBounds(gdf.total_bounds, resolution, gdf.crs)
+    outputs = {column: os.path.join(outpath,f"alkis_palm_{column}.tif") for column in columns}
+
+    # features without a value are set to nodata, cells without features keep 0
+    rasteriseToGeoTiff(gdf, columns, grid, outputs, fill=0, nodata=-9999, block_size=block_size)
 
 ## translate ALKIS to PALM surface types
 # step 1 read clipper and vectorise imperviousness
@@ -228,8 +222,8 @@ imperv_low, imperv_high = vectoriseImperviousness(
     clipper = clipper
 )
 
-# read and clip the ALKIS layer before the loop
-alkis = gpd.read_file(f"{alkis_path}/alkis.gpkg", layer="nutzung")
+# read and clip the ALKIS layer before the loop, only features intersecting the clipper are read
+alkis = gpd.read_file(f"{alkis_path}/alkis.gpkg", layer="nutzung", mask=clipper)
 
 alkis = alkis.clip(clipper, keep_geom_type=True)
 
@@ -294,9 +288,8 @@ alkis_palm_named = alkis_palm_all.merge(class_names, on=["pavement","vegetation"
 alkis_palm_named["land_use"] = alkis_palm_named["vegetation"]
 alkis_palm_named["land_use"] = np.where(alkis_palm_named["water"].notna(), alkis_palm_named["water"] + 20, alkis_palm_named["land_use"])
 
-# save shapefile
-alkis_palm_named.to_file(os.path.join(outpath,"alkis_palm_test.shp"))
+# save vector data
+writeVector(alkis_palm_named, vectorPath(outpath, "alkis_palm_test", vector_format))
 
 # rasterise both layers
-rasteriseSurface(alkis_palm_named,"pavement",2.0)
-rasteriseSurface(alkis_palm_named,"land_use",2.0)
\ No newline at end of file
+rasteriseSurfaces(alkis_palm_named,["pavement","land_use"],2.0,block_size)
\ No newline at end of file
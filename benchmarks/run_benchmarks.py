@@ -0,0 +1,498 @@
+import argparse
+import fnmatch
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, NamedTuple
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+# shared modules of this repository
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_PATH)
+from common.config import configure
+from synthetic import imperviousnessPolygons, prepareDataset
+
+# resolution of the rasterised outputs (in m) and class breaks of the imperviousness, as in the scripts
+RESOLUTION = 2.0
+CLASS_BREAKS = [0, 26, 51]
+# buildings converted with the row by row API of citygml2gpd (see benchExtractHeights)
+ROW_BY_ROW_BUILDINGS = 200
+
+class Benchmark(NamedTuple):
+    '''
+    A benchmark of a public function: the script (relative to the repository), the synthetic datasets it needs, the setup that
+    prepares the inputs (not timed) and returns the timed call, and the unit of the items the call returns for the throughput
+    '''
+    script: str
+    datasets: tuple
+    setup: Callable
+    unit: str
+
+def clipper(data:dict) -> gpd.GeoDataFrame:
+    '''
+    Reads the clipper of the domain
+    '''
+    return gpd.read_file(os.path.join(data["clipper"]["directory"], data["clipper"]["clip_file"]))
+
+def alkisLayers(module, data:dict) -> list:
+    '''
+    Configures the ALKIS script with the synthetic layers and returns the layer dictionary of the city
+    '''
+    alkis = data["alkis"]
+    configure(vars(module), {key: alkis[key] for key in ("alkis_path", "keys_path", "layer_config", "city")})
+    module.data_path = data["clipper"]["directory"]
+    return module.readLayerConfig(alkis["layer_config"])[alkis["city"]]
+
+def translatedAlkis(module, data:dict, layers:list) -> gpd.GeoDataFrame:
+    '''
+    Translates the ALKIS layers without correction of green and sealed areas, as input of the correction and rasterisation
+    '''
+    domain = clipper(data)
+    translated = [module.translateLayer(layer, domain, None, None, correction="raster") for layer in layers]
+    return gpd.GeoDataFrame(pd.concat(translated, ignore_index=True).drop(columns=["identifyGreen", "identifySealed"]), crs=domain.crs)
+
+def gridCells(gdf:gpd.GeoDataFrame, resolution:float = RESOLUTION) -> int:
+    '''
+    Returns the number of cells of the grid covering a GeoDataFrame
+    '''
+    minx, miny, maxx, maxy = gdf.total_bounds
+    return int(round((maxx - minx) / resolution) * round((maxy - miny) / resolution))
+
+def benchReadAndClipLayers(engine:str) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        layers, domain = alkisLayers(module, data), clipper(data)
+        return lambda: sum(len(module.readAndClipLayers(layer["filename"], layer["layername"], domain, engine=engine)) for layer in layers)
+    return setup
+
+def benchReadFileLayers(module, data:dict, workdir:str) -> Callable:
+    layers, domain = alkisLayers(module, data), clipper(data)
+    byFile = module.groupLayersByFile(layers)
+    return lambda: sum(len(gdf) for filename, positions in byFile.items() for gdf in module.readFileLayers(filename, [layers[i]["layername"] for i in positions], domain).values())
+
+def benchTranslateLayers(correction:str) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        layers, domain = alkisLayers(module, data), clipper(data)
+        low, high = imperviousnessPolygons(data["imperviousness"]["imperv_raster"], CLASS_BREAKS, domain)
+        return lambda: sum(len(gdf) for gdf in module.translateLayers(layers, domain, low, high, correction=correction))
+    return setup
+
+def benchCorrection(function:str, flag:str, imperviousness:int) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        layers, domain = alkisLayers(module, data), clipper(data)
+        alkis = translatedAlkis(module, data, [layer for layer in layers if layer[flag]])
+        polygons = imperviousnessPolygons(data["imperviousness"]["imperv_raster"], CLASS_BREAKS, domain)[imperviousness]
+        return lambda: len(getattr(module, function)(polygons, alkis))
+    return setup
+
+def benchVectoriseImperviousness(module, data:dict, workdir:str) -> Callable:
+    domain = clipper(data)
+    return lambda: sum(len(gdf) for gdf in module.vectoriseImperviousness(data["imperviousness"]["imperv_raster"], domain, CLASS_BREAKS))
+
+def benchClassifyImperviousness(module, data:dict, workdir:str) -> Callable:
+    domain = clipper(data)
+    grid = module.gridFromBounds(domain.total_bounds, RESOLUTION, domain.crs)
+    return lambda: module.classifyImperviousness(module.readImperviousnessClasses(data["imperviousness"]["imperv_raster"], domain, CLASS_BREAKS), grid).size
+
+def benchAlkisRasterise(function:str) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        alkis = translatedAlkis(module, data, alkisLayers(module, data))
+        module.outpath = workdir
+        if function == "rasteriseSurface":
+            return lambda: module.rasteriseSurface(alkis, "pavement", RESOLUTION) or gridCells(alkis)
+        return lambda: module.rasteriseSurfaces(alkis, ["pavement", "vegetation", "water"], RESOLUTION) or 3 * gridCells(alkis)
+    return setup
+
+def gmlTiles(data:dict) -> list:
+    directory = data["citygml"]["directory"]
+    return sorted(os.path.join(directory, file) for file in os.listdir(directory) if file.endswith(".gml"))
+
+def benchExtractHeights(module, data:dict, workdir:str) -> Callable:
+    # the row by row API of the first converter grows quadratically, so only the first buildings of the first tile are converted
+    root = module.parseGml(gmlTiles(data)[0])
+    buildings = module.findAllInETree(root, f".//{{{module.BLDG_NS}}}Building")[:ROW_BY_ROW_BUILDINGS]
+
+    def call() -> int:
+        gdf = gpd.GeoDataFrame(columns=["gml_id", "height", "function", "buildingPart", "geometry"], geometry="geometry", crs="EPSG:25832")
+        for building in buildings:
+            gmlID = building.attrib[f"{{{module.GML_NS}}}id"]
+            function = module.findAllInETree(building, f".//{{{module.BLDG_NS}}}function")[0].text
+            parts = module.findAllInETree(building, f".//{{{module.BLDG_NS}}}BuildingPart")
+            for part in parts or [building]:
+                gdf = module.extractHeightsAndGeometryFromGML(part, gdf, gmlID, function, bool(parts))
+        return len(buildings)
+    return call
+
+def benchStreamBuildings(module, data:dict, workdir:str) -> Callable:
+    return lambda: sum(len(module.streamBuildingsFromGml(path)) for path in gmlTiles(data))
+
+def benchConvertTiles(module, data:dict, workdir:str) -> Callable:
+    return lambda: sum(result["features"] for result in module.convertTiles(data["citygml"]["directory"], workers=1, outFormat="parquet", outDir=workdir, force=True))
+
+def xyzTiles(data:dict) -> list:
+    directory = data["xyz"]["directory"]
+    return sorted(os.path.join(directory, file) for file in os.listdir(directory) if file.endswith(".xyz"))
+
+def benchResampleGeotiff(module, data:dict, workdir:str) -> Callable:
+    return lambda: [module.resample_geotiff(path, os.path.join(workdir, "resampled.tif"), RESOLUTION) for path in xyzTiles(data)] and data["xyz"]["features"]
+
+def benchReadXyz(module, data:dict, workdir:str) -> Callable:
+    return lambda: sum(module.read_xyz(path)[0].size for path in xyzTiles(data))
+
+def checkBilinear(module, path:str, workdir:str) -> None:
+    '''
+    Checks that the bilinear resampling of xyz_to_geotiff equals gdal.Warp with bilinear resampling on the same grid
+    '''
+    output, reference = os.path.join(workdir, "bilinear.tif"), os.path.join(workdir, "warp.tif")
+    module.xyz_to_geotiff(path, output, RESOLUTION, aggregation="bilinear")
+    dataset = module.gdal.Open(output)
+    originX, resolution, _, originY, _, _ = dataset.GetGeoTransform()
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    resampled = dataset.ReadAsArray()
+    dataset = None
+
+    warped = module.gdal.Warp(reference, path, outputBounds=(originX, originY - height * resolution, originX + width * resolution, originY),
+                              width=width, height=height, resampleAlg=module.gdal.GRA_Bilinear, outputType=module.gdal.GDT_Float32)
+    expected = warped.ReadAsArray()
+    warped = None
+    differing = np.count_nonzero(~np.isclose(resampled, expected, atol=1e-3, equal_nan=True))
+    if differing:
+        raise AssertionError(f"xyz_to_geotiff differs from gdal.Warp in {differing} cells")
+
+def benchXyzToGeotiff(aggregation:str) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        if aggregation == "bilinear":
+            checkBilinear(module, xyzTiles(data)[0], workdir)
+        return lambda: [module.xyz_to_geotiff(path, os.path.join(workdir, "resampled.tif"), RESOLUTION, aggregation=aggregation) for path in xyzTiles(data)] and data["xyz"]["features"]
+    return setup
+
+def benchTranslateCLC(module, data:dict, workdir:str) -> Callable:
+    clc = data["clc"]
+    configure(vars(module), {key: clc[key] for key in ("data_path", "keys_path")})
+    clip = os.path.join(data["clipper"]["directory"], data["clipper"]["clip_file_3035"])
+    return lambda: len(module.translateCLC(clip, clc["clc_file"], clc["key_file"])[0])
+
+def benchClcRasterise(module, data:dict, workdir:str) -> Callable:
+    clc = data["clc"]
+    configure(vars(module), {key: clc[key] for key in ("data_path", "keys_path")})
+    gdf = module.translateCLC(os.path.join(data["clipper"]["directory"], data["clipper"]["clip_file_3035"]), clc["clc_file"], clc["key_file"])[0]
+    module.outpath = workdir
+    return lambda: module.rasteriseSurfaces(gdf, ["pavement", "vegetation", "water"], RESOLUTION) or 3 * gridCells(gdf)
+
+def benchTranslateSoil(module, data:dict, workdir:str) -> Callable:
+    soil = data["soil"]
+    configure(vars(module), {key: soil[key] for key in ("data_path", "keys_path")})
+    clip = os.path.join(data["clipper"]["directory"], data["clipper"]["clip_file"])
+    return lambda: len(module.translateSoil(clip, soil["soil_file"], soil["key_file"]))
+
+def benchRasteriseSoil(module, data:dict, workdir:str) -> Callable:
+    soil = data["soil"]
+    configure(vars(module), {key: soil[key] for key in ("data_path", "keys_path")})
+    gdf = module.translateSoil(os.path.join(data["clipper"]["directory"], data["clipper"]["clip_file"]), soil["soil_file"], soil["key_file"])
+    module.outpath = workdir
+    return lambda: module.rasteriseSoil(gdf, "soil_type", RESOLUTION, 2) or gridCells(gdf)
+
+def configureBuildings(module, data:dict) -> None:
+    zensus = data["zensus"]
+    configure(vars(module), {"zensus_path": zensus["zensus_path"], "clip_path": data["clipper"]["directory"]})
+
+def benchCombineShapefiles(module, data:dict, workdir:str) -> Callable:
+    configureBuildings(module, data)
+    return lambda: len(module.combine_shapefiles(data["buildings"]["build_path"], data["clipper"]["clip_file"]))
+
+def benchTranslateZensus(module, data:dict, workdir:str) -> Callable:
+    configureBuildings(module, data)
+    zensus = data["zensus"]
+    return lambda: len(module.translateZensus(data["clipper"]["clip_file_3035"], zensus["grid_file"], zensus["zensus_file"], zensus["key_file"]))
+
+def benchJoinZensusGrid(module, data:dict, workdir:str) -> Callable:
+    configureBuildings(module, data)
+    buildings = module.combine_shapefiles(data["buildings"]["build_path"], data["clipper"]["clip_file"])
+    return lambda: len(module.joinZensusGrid(buildings, data["zensus"]["zensus_file"], data["zensus"]["key_file"]))
+
+def benchRasteriseBuildings(module, data:dict, workdir:str) -> Callable:
+    configureBuildings(module, data)
+    buildings = module.combine_shapefiles(data["buildings"]["build_path"], data["clipper"]["clip_file"])
+    buildings = module.joinZensusGrid(buildings, data["zensus"]["zensus_file"], data["zensus"]["key_file"]).fillna({"building_type": 5})
+    columns = {"building_type": "int16", "ID": "int32", "height": "float32"}
+    return lambda: module.rasteriseBuildingColumns(buildings, columns, RESOLUTION, -9999, workdir) or len(columns) * gridCells(buildings)
+
+def benchCreateTreeMask(module, data:dict, workdir:str) -> Callable:
+    module.force = True
+    return lambda: module.create_tree_mask(data["buildings"]["build_path"], workdir) or data["buildings"]["features"]
+
+def benchCreateTreeMaskTiled(module, data:dict, workdir:str) -> Callable:
+    module.force = True
+    return lambda: module.create_tree_mask_tiled(data["buildings"]["build_path"], workdir, tile_size=500, workers=1) is not None and data["buildings"]["features"]
+
+def configureTrees(module, data:dict, workdir:str) -> gpd.GeoDataFrame:
+    configure(vars(module), {key: data["lai"][key] for key in ("lai_path", "lai_file")})
+    configure(vars(module), {"tree_path": data["trees"]["tree_path"], "chm_path": workdir})
+    return module.combine_tree_files(module.tree_path)
+
+def benchPrepareLai(window:bool) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        trees = configureTrees(module, data, workdir)
+        if window:
+            return lambda: module.prepare_lai_window(module.lai_file, trees.total_bounds)[0].size
+        return lambda: module.prepare_lai_raster(module.lai_file)[0].size
+    return setup
+
+def checkZonalStats(module, trees:gpd.GeoDataFrame, lai, affine) -> None:
+    '''
+    Checks that the grouped zonal statistics equal those of rasterstats for the synthetic tree crowns, many of which overlap
+    '''
+    grouped = module.zonal_stats_grouped(trees, lai, affine, nodata=-32768)
+    reference = module.zonal_stats(trees, lai, affine=affine, stats=["mean", "median", "max"], nodata=-32768)
+    for stat in ("mean", "median", "max"):
+        expected = np.array([np.nan if result[stat] is None else result[stat] for result in reference], dtype="float64")
+        differing = np.count_nonzero(~np.isclose(grouped[stat].to_numpy(dtype="float64"), expected, equal_nan=True))
+        if differing:
+            raise AssertionError(f"zonal_stats_grouped differs from rasterstats for {differing} {stat} values")
+
+def benchZonalStats(engine:str) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        trees = configureTrees(module, data, workdir)
+        lai, affine = module.prepare_lai_window(module.lai_file, trees.total_bounds)
+        if engine == "bincount":
+            checkZonalStats(module, trees, lai, affine)
+            return lambda: len(module.zonal_stats_grouped(trees, lai, affine, nodata=-32768))
+        return lambda: len(module.zonal_stats(trees, lai, affine=affine, stats=["mean", "median", "max"], nodata=-32768, geojson_out=True))
+    return setup
+
+def benchCreateChm(windowed:bool) -> Callable:
+    def setup(module, data:dict, workdir:str) -> Callable:
+        trees = configureTrees(module, data, workdir)
+        configure(vars(module), {key: data["elevation"][key] for key in ("dem_path", "dsm_path")})
+        cells = data["elevation"]["features"]
+        if windowed:
+            return lambda: module.create_chm_windowed("dem.tif", "dsm.tif", trees, block_size=1024) or cells
+        return lambda: module.create_chm("dem.tif", "dsm.tif", trees) or cells
+    return setup
+
+ALKIS = ("alkis2PALM/alkis2PALM.py", ("clipper", "alkis"))
+ALKIS_IMPERV = ("alkis2PALM/alkis2PALM.py", ("clipper", "alkis", "imperviousness"))
+CITYGML = ("citygml2gpd/citygml2gpd.py", ("citygml",))
+XYZ = ("xyz2tiff/xyz2tiff.py", ("xyz",))
+BUILDINGS = ("buildings2PALM/buildings2PALM.py", ("clipper", "buildings", "zensus"))
+TREES = ("trees2PALM/process_tree_data.py", ("lai", "trees"))
+
+# all benchmarks by name (<script>.<function>, variants in brackets)
+BENCHMARKS = {
+    "alkis2PALM.readAndClipLayers[fiona]": Benchmark(*ALKIS, benchReadAndClipLayers("fiona"), "features"),
+    "alkis2PALM.readAndClipLayers[pyogrio]": Benchmark(*ALKIS, benchReadAndClipLayers("pyogrio"), "features"),
+    "alkis2PALM.readFileLayers": Benchmark(*ALKIS, benchReadFileLayers, "features"),
+    "alkis2PALM.translateLayers[overlay]": Benchmark(*ALKIS_IMPERV, benchTranslateLayers("overlay"), "features"),
+    "alkis2PALM.translateLayers[sindex]": Benchmark(*ALKIS_IMPERV, benchTranslateLayers("sindex"), "features"),
+    "alkis2PALM.identifyGreen": Benchmark(*ALKIS_IMPERV, benchCorrection("identifyGreen", "identifyGreen", 0), "features"),
+    "alkis2PALM.identifyGreenIndexed": Benchmark(*ALKIS_IMPERV, benchCorrection("identifyGreenIndexed", "identifyGreen", 0), "features"),
+    "alkis2PALM.identifySealed": Benchmark(*ALKIS_IMPERV, benchCorrection("identifySealed", "identifySealed", 1), "features"),
+    "alkis2PALM.identifySealedIndexed": Benchmark(*ALKIS_IMPERV, benchCorrection("identifySealedIndexed", "identifySealed", 1), "features"),
+    "alkis2PALM.vectoriseImperviousness": Benchmark(*ALKIS_IMPERV, benchVectoriseImperviousness, "polygons"),
+    "alkis2PALM.classifyImperviousness": Benchmark(*ALKIS_IMPERV, benchClassifyImperviousness, "cells"),
+    "alkis2PALM.rasteriseSurface": Benchmark(*ALKIS, benchAlkisRasterise("rasteriseSurface"), "cells"),
+    "alkis2PALM.rasteriseSurfaces": Benchmark(*ALKIS, benchAlkisRasterise("rasteriseSurfaces"), "cells"),
+    "citygml2gpd.extractHeightsAndGeometryFromGML": Benchmark(*CITYGML, benchExtractHeights, "buildings"),
+    "citygml2gpd.streamBuildingsFromGml": Benchmark(*CITYGML, benchStreamBuildings, "surfaces"),
+    "citygml2gpd.convertTiles": Benchmark(*CITYGML, benchConvertTiles, "surfaces"),
+    "xyz2tiff.resample_geotiff": Benchmark(*XYZ, benchResampleGeotiff, "points"),
+    "xyz2tiff.read_xyz": Benchmark(*XYZ, benchReadXyz, "cells"),
+    "xyz2tiff.xyz_to_geotiff[bilinear]": Benchmark(*XYZ, benchXyzToGeotiff("bilinear"), "points"),
+    "xyz2tiff.xyz_to_geotiff[mean]": Benchmark(*XYZ, benchXyzToGeotiff("mean"), "points"),
+    "clc2PALM.translateCLC": Benchmark("clc2PALM/clc2PALM.py", ("clipper", "clc"), benchTranslateCLC, "features"),
+    "clc2PALM.rasteriseSurfaces": Benchmark("clc2PALM/clc2PALM.py", ("clipper", "clc"), benchClcRasterise, "cells"),
+    "soil2PALM.translateSoil": Benchmark("soil2PALM/soil2PALM.py", ("clipper", "soil"), benchTranslateSoil, "features"),
+    "soil2PALM.rasteriseSoil": Benchmark("soil2PALM/soil2PALM.py", ("clipper", "soil"), benchRasteriseSoil, "cells"),
+    "buildings2PALM.combine_shapefiles": Benchmark(*BUILDINGS, benchCombineShapefiles, "features"),
+    "buildings2PALM.translateZensus": Benchmark(*BUILDINGS, benchTranslateZensus, "cells"),
+    "buildings2PALM.joinZensusGrid": Benchmark(*BUILDINGS, benchJoinZensusGrid, "features"),
+    "buildings2PALM.rasteriseBuildingColumns": Benchmark(*BUILDINGS, benchRasteriseBuildings, "cells"),
+    "build_tree_mask.create_tree_mask": Benchmark("trees2PALM/build_tree_mask.py", ("buildings",), benchCreateTreeMask, "features"),
+    "build_tree_mask.create_tree_mask_tiled": Benchmark("trees2PALM/build_tree_mask.py", ("buildings",), benchCreateTreeMaskTiled, "features"),
+    "process_tree_data.prepare_lai_raster": Benchmark(*TREES, benchPrepareLai(False), "cells"),
+    "process_tree_data.prepare_lai_window": Benchmark(*TREES, benchPrepareLai(True), "cells"),
+    "process_tree_data.zonal_stats[rasterstats]": Benchmark(*TREES, benchZonalStats("rasterstats"), "trees"),
+    "process_tree_data.zonal_stats_grouped": Benchmark(*TREES, benchZonalStats("bincount"), "trees"),
+    "process_tree_data.create_chm": Benchmark("trees2PALM/process_tree_data.py", ("lai", "trees", "elevation"), benchCreateChm(False), "cells"),
+    "process_tree_data.create_chm_windowed": Benchmark("trees2PALM/process_tree_data.py", ("lai", "trees", "elevation"), benchCreateChm(True), "cells"),
+}
+
+def resetPeakRss() -> None:
+    '''
+    Resets the peak resident set size of this process to the current one (Linux only), so that the setup is not part of the peak
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+def currentRss() -> int:
+    '''
+    Returns the resident set size of this process in bytes (Linux only, 0 elsewhere)
+    '''
+    try:
+        with open("/proc/self/status") as file:
+            return next(int(line.split()[1]) * 1024 for line in file if line.startswith("VmRSS"))
+    except (OSError, StopIteration):
+        return 0
+
+def peakRss() -> int:
+    '''
+    Returns the peak resident set size of this process and its finished child processes in bytes
+    '''
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    try:
+        with open("/proc/self/status") as file:
+            own = next(int(line.split()[1]) * 1024 for line in file if line.startswith("VmHWM"))
+    except (OSError, StopIteration):
+        # kB on Linux, bytes on macOS
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return max(own, children)
+
+def importScript(script:str):
+    '''
+    Imports the script of a benchmark as module, as the runner does
+    '''
+    path = os.path.join(REPO_PATH, script)
+    sys.path.insert(0, os.path.dirname(path))
+    return importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+
+def runBenchmark(name:str, root:str, scale:float, repeat:int = 1) -> dict:
+    '''
+    Runs one benchmark in this process: prepares its inputs, then times the call (best of repeat) and measures the peak RSS
+    during the calls and its increase over the RSS before the calls (memory allocated by the call). The output of the scripts
+    is suppressed
+    '''
+    benchmark = BENCHMARKS[name]
+    data = {dataset: prepareDataset(dataset, root, scale) for dataset in benchmark.datasets}
+    module = importScript(benchmark.script)
+
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            call = benchmark.setup(module, data, workdir)
+            resetPeakRss()
+            baseline = currentRss()
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                items = call()
+                seconds.append(time.perf_counter() - start)
+        finally:
+            sys.stdout = stdout
+
+    best, peak = min(seconds), peakRss()
+    return {"benchmark": name, "scale": scale, "seconds": round(best, 4), "items": int(items), "unit": benchmark.unit,
+            "throughput": round(items / best, 1) if best > 0 else None, "peak_rss_mb": round(peak / 2**20, 1),
+            "rss_increase_mb": round(max(peak - baseline, 0) / 2**20, 1) if baseline else None}
+
+def runSuite(names:list, scales:list, root:str, repeat:int = 1, timeout:float = None) -> list:
+    '''
+    Runs each benchmark at each scale in a separate process, so that the peak RSS of one benchmark is not influenced by the
+    others. The synthetic datasets are generated once per scale before the benchmarks using them. Failed benchmarks (e.g. a
+    missing optional dependency) are reported with their error
+    '''
+    results = []
+    for scale in scales:
+        for name in names:
+            for dataset in BENCHMARKS[name].datasets:
+                prepareDataset(dataset, root, scale)
+
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as resultFile:
+                resultPath = resultFile.name
+            command = [sys.executable, os.path.abspath(__file__), "--worker", name, "--scales", str(scale), "--data", root, "--repeat", str(repeat), "--output", resultPath]
+            try:
+                process = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+                if process.returncode == 0:
+                    with open(resultPath) as jsonFile:
+                        result = json.load(jsonFile)
+                else:
+                    lines = process.stderr.strip().splitlines()
+                    result = {"benchmark": name, "scale": scale, "error": lines[-1] if lines else f"exit code {process.returncode}"}
+            except subprocess.TimeoutExpired:
+                result = {"benchmark": name, "scale": scale, "error": f"timeout after {timeout} s"}
+            finally:
+                os.remove(resultPath)
+
+            results.append(result)
+            printResult(result)
+    return results
+
+def printResult(result:dict) -> None:
+    '''
+    Prints one result as a row of the report
+    '''
+    if "error" in result:
+        print(f"{result['benchmark']:<50} {result['scale']:>6g}  failed: {result['error']}")
+    else:
+        throughput = f"{result['throughput']:,.0f} {result['unit']}/s" if result["throughput"] is not None else "-"
+        increase = f"+{result['rss_increase_mb']:.1f} MB" if result.get("rss_increase_mb") is not None else "-"
+        print(f"{result['benchmark']:<50} {result['scale']:>6g} {result['seconds']:>10.3f} s {throughput:>24} {result['peak_rss_mb']:>10.1f} MB {increase:>12}")
+
+def compareResults(results:list, baseline:list, tolerance:float) -> list:
+    '''
+    Compares results with a baseline run by benchmark and scale. Returns the regressions: benchmarks whose time or peak RSS
+    increased by more than the tolerance (fraction of the baseline)
+    '''
+    known = {(result["benchmark"], result["scale"]): result for result in baseline if "error" not in result}
+    regressions = []
+    for result in results:
+        before = known.get((result["benchmark"], result["scale"]))
+        if before is None or "error" in result:
+            continue
+        for key in ("seconds", "peak_rss_mb"):
+            if result[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{result['benchmark']} (scale {result['scale']:g}): {key} {before[key]} -> {result[key]}")
+    return regressions
+
+def parseArguments() -> argparse.Namespace:
+    '''
+    Reads the command line arguments of the benchmark suite
+    '''
+    parser = argparse.ArgumentParser(description="Benchmarks the public functions of the preprocessing scripts with synthetic data.")
+    parser.add_argument("-b", "--benchmarks", nargs="+", default=["*"], help="names or patterns of the benchmarks to run, e.g. 'alkis2PALM.*' (default: all)")
+    parser.add_argument("-s", "--scales", nargs="+", type=float, default=[1.0, 4.0], help="scale factors, area of the domain in km² (default: 1 4)")
+    parser.add_argument("--data", default=os.path.join(tempfile.gettempdir(), "palm_benchmark_data"), help="directory of the synthetic datasets, reused between runs")
+    parser.add_argument("--repeat", type=int, default=1, help="number of timed calls per benchmark, the fastest is reported")
+    parser.add_argument("--timeout", type=float, default=None, help="maximum runtime of one benchmark in seconds")
+    parser.add_argument("-o", "--output", default=None, help="save the results as json file")
+    parser.add_argument("--compare", default=None, help="json file of a baseline run, regressions are reported and set the exit code")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed increase of time and peak RSS relative to the baseline (default: 0.2)")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parseArguments()
+
+    # a single benchmark in a worker process started by runSuite
+    if args.worker:
+        result = runBenchmark(args.worker, args.data, args.scales[0], args.repeat)
+        with open(args.output, "w") as jsonFile:
+            json.dump(result, jsonFile)
+        sys.exit(0)
+
+    names = [name for name in BENCHMARKS if any(fnmatch.fnmatchcase(name, pattern) for pattern in args.benchmarks)]
+    if args.list:
+        print("\n".join(names))
+        sys.exit(0)
+
+    results = runSuite(names, args.scales, args.data, args.repeat, args.timeout)
+
+    if args.output:
+        with open(args.output, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=1)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as jsonFile:
+            regressions = compareResults(results, json.load(jsonFile), args.tolerance)
+        print("\n".join(["regressions:"] + regressions) if regressions else "no regressions")
+    sys.exit(1 if regressions else 0)
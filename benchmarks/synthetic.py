@@ -0,0 +1,418 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+from rasterio.features import shapes
+from rasterio.mask import mask
+from rasterio.transform import from_origin
+from shapely.geometry import shape
+
+# shared modules of this repository
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_PATH)
+from common.vectorio import writeVector
+
+# the translation tables and the layer dictionary of the scripts are used for the synthetic data
+ALKIS_DICT = os.path.join(REPO_PATH, "alkis2PALM", "alkis_dict.json")
+ALKIS_KEYS = os.path.join(REPO_PATH, "alkis2PALM", "ALKIS_translation")
+CLC_KEYS = os.path.join(REPO_PATH, "clc2PALM", "CLC_key.csv")
+SOIL_KEYS = os.path.join(REPO_PATH, "soil2PALM", "BK50_PALM.csv")
+ZENSUS_KEYS = os.path.join(REPO_PATH, "buildings2PALM", "keys_Zensus.csv")
+
+# lower left corner of the domain (EPSG:25832, Bochum) and side length of the domain at scale 1 (in m)
+ORIGIN = (371000.0, 5703000.0)
+DOMAIN_SIZE = 1000.0
+# side length of the CityGML, XYZ and tree tiles (in m), as the 1 km tiles of the NRW open data
+TILE_SIZE = 1000.0
+EPSG = 25832
+
+# features per km² of the domain
+PARCELS_PER_KM2 = 1500
+BUILDINGS_PER_KM2 = 1600
+TREES_PER_KM2 = 4000
+CLC_PER_KM2 = 20
+SOIL_PER_KM2 = 60
+
+# the datasets that cover a larger area (e.g. a whole Copernicus tile) extend over the domain by this margin (in m)
+MARGIN = 2000.0
+
+def domainBounds(scale:float, margin:float = 0) -> tuple:
+    '''
+    Returns the bounds (minx, miny, maxx, maxy in EPSG:25832) of the domain at a scale factor (area relative to 1 km²),
+    optionally extended by a margin
+    '''
+    size = DOMAIN_SIZE * np.sqrt(scale)
+    return (ORIGIN[0] - margin, ORIGIN[1] - margin, ORIGIN[0] + size + margin, ORIGIN[1] + size + margin)
+
+def featureCount(perKm2:int, bounds:tuple) -> int:
+    '''
+    Returns the number of features of a density (per km²) within bounds
+    '''
+    return max(int(perKm2 * (bounds[2] - bounds[0]) * (bounds[3] - bounds[1]) / 1e6), 1)
+
+def tiles(bounds:tuple, tile_size:float = TILE_SIZE):
+    '''
+    Iterates over the tiles (lower left corner and tile bounds) aligned to multiples of the tile size that intersect bounds
+    '''
+    for x in np.arange(np.floor(bounds[0] / tile_size), np.ceil(bounds[2] / tile_size)) * tile_size:
+        for y in np.arange(np.floor(bounds[1] / tile_size), np.ceil(bounds[3] / tile_size)) * tile_size:
+            yield (int(x), int(y)), (x, y, x + tile_size, y + tile_size)
+
+def voronoiParcels(bounds:tuple, count:int, rng:np.random.Generator) -> np.ndarray:
+    '''
+    Divides bounds into about count polygons (Voronoi cells of random points), which look like parcels or land cover patches
+    '''
+    points = shapely.multipoints(rng.uniform(bounds[:2], bounds[2:], size=(count, 2)))
+    extent = shapely.box(*bounds)
+    cells = shapely.get_parts(shapely.voronoi_polygons(points, extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+    return cells[~shapely.is_empty(cells)]
+
+def writeClipper(directory:str, scale:float) -> dict:
+    '''
+    Writes the clipper of the domain as shapefile in EPSG:25832 (clip.shp) and EPSG:3035 (clip_3035.shp)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    clipper = gpd.GeoDataFrame({"id": [1]}, geometry=[shapely.box(*domainBounds(scale))], crs=EPSG)
+    clipper.to_file(os.path.join(directory, "clip.shp"))
+    clipper.to_crs(3035).to_file(os.path.join(directory, "clip_3035.shp"))
+    return {"clip_file": "clip.shp", "clip_file_3035": "clip_3035.shp", "features": 1}
+
+def writeAlkisLayers(directory:str, scale:float, city:str = "Bochum", seed:int = 0) -> dict:
+    '''
+    Writes ALKIS-like land use layers as GML files, one per entry of the layer dictionary (alkis_dict.json) of a city with its
+    file and layer name. The parcels divide the domain (with a margin) and each parcel belongs to one layer. Layers with a
+    translation table get the attribute of the table (funktion or vegetationsmerkmal) with values of the table, 10 % of the
+    values are missing
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    with open(ALKIS_DICT) as jsonFile:
+        layers = json.load(jsonFile)[city]
+
+    bounds = domainBounds(scale, margin=100)
+    parcels = voronoiParcels(bounds, featureCount(PARCELS_PER_KM2, bounds), rng)
+    layerOfParcel = rng.integers(0, len(layers), len(parcels))
+
+    for index, layer in enumerate(layers):
+        gdf = gpd.GeoDataFrame(geometry=parcels[layerOfParcel == index], crs=EPSG)
+        if layer["mapOnAttribute"]:
+            attribute = "funktion" if layer["mergeKeyOnFunction"] else "vegetationsmerkmal"
+            values = pd.read_csv(os.path.join(ALKIS_KEYS, layer["keyTable"]))[attribute].to_numpy()
+            gdf[attribute] = rng.choice(values, len(gdf)).astype("float64")
+            gdf.loc[rng.random(len(gdf)) < 0.1, attribute] = np.nan
+        else:
+            gdf["funktion"] = 0
+        gdf.to_file(os.path.join(directory, layer["filename"]), driver="GML", layer=layer["layername"])
+
+    return {"alkis_path": directory, "keys_path": ALKIS_KEYS, "layer_config": ALKIS_DICT, "city": city, "features": len(parcels)}
+
+def writeImperviousness(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes an imperviousness raster like the Copernicus High Resolution Layer (10 m, EPSG:3035, 0 to 100 %, nodata 255) covering
+    the domain with a margin. Patches of similar imperviousness are created from smoothed noise
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = gpd.GeoSeries([shapely.box(*domainBounds(scale, margin=MARGIN))], crs=EPSG).to_crs(3035).total_bounds
+    minx, maxy = np.floor(minx / 10) * 10, np.ceil(maxy / 10) * 10
+    width, height = int(np.ceil((maxx - minx) / 10)), int(np.ceil((maxy - miny) / 10))
+
+    # patches of 5 x 5 cells with noise
+    coarse = rng.uniform(0, 100, (height // 5 + 1, width // 5 + 1))
+    values = np.kron(coarse, np.ones((5, 5)))[:height, :width] + rng.normal(0, 10, (height, width))
+    values = np.clip(values, 0, 100).astype("uint8")
+    values[rng.random((height, width)) < 0.01] = 255
+
+    path = os.path.join(directory, "imperviousness.tif")
+    with rasterio.open(path, "w", driver="GTiff", width=width, height=height, count=1, dtype="uint8", nodata=255, crs="EPSG:3035",
+                       transform=from_origin(minx, maxy, 10, 10), tiled=True, compress="deflate") as dst:
+        dst.write(values, 1)
+
+    return {"imperv_raster": path, "features": width * height}
+
+def imperviousnessPolygons(path:str, class_breaks:list, clipper:gpd.GeoDataFrame) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    '''
+    Vectorises the imperviousness classes of the synthetic raster within the clipper with rasterio (as vectoriseImperviousness,
+    without geocube) and returns the polygons of low (class 1) and high (class 3) imperviousness in the CRS of the clipper
+    '''
+    with rasterio.open(path) as src:
+        values, transform = mask(src, clipper.to_crs(src.crs).geometry, crop=True, filled=False)
+        crs = src.crs
+    classes = np.digitize(values[0].filled(0), class_breaks).astype("int32")
+    classes[values[0].mask] = 0
+
+    geometries, impervi = zip(*((shape(geometry), value) for geometry, value in shapes(classes, transform=transform)))
+    polygons = gpd.GeoDataFrame({"impervi": np.array(impervi, dtype="int32")}, geometry=list(geometries), crs=crs).to_crs(clipper.crs)
+    return polygons[polygons.impervi == 1], polygons[polygons.impervi == 3]
+
+def buildingFootprints(bounds:tuple, rng:np.random.Generator) -> gpd.GeoDataFrame:
+    '''
+    Creates rectangular building footprints with heights and ALKIS building functions, about 20 % of the buildings consist of two
+    building parts
+    '''
+    count = featureCount(BUILDINGS_PER_KM2, bounds)
+    centres = rng.uniform(bounds[:2], bounds[2:], size=(count, 2))
+    sizes = rng.uniform(6, 18, size=(count, 2))
+    footprints = shapely.box(centres[:, 0] - sizes[:, 0] / 2, centres[:, 1] - sizes[:, 1] / 2, centres[:, 0] + sizes[:, 0] / 2, centres[:, 1] + sizes[:, 1] / 2)
+    functions = rng.choice(["31001_1000", "31001_2000", "31001_1010", "53001_1800"], count, p=[0.6, 0.25, 0.1, 0.05])
+    return gpd.GeoDataFrame({
+        "gml_id": [f"DENW{index:012d}" for index in range(count)],
+        "function": functions,
+        "height": rng.uniform(3, 30, count).round(2),
+        "parts": np.where(rng.random(count) < 0.2, 2, 1),
+    }, geometry=footprints, crs=EPSG)
+
+def roofSurfaces(footprint:shapely.Polygon, parts:int) -> list:
+    '''
+    Splits a footprint into its building parts and each part into the two roof surfaces of a gable roof
+    '''
+    minx, miny, maxx, maxy = footprint.bounds
+    edges = np.linspace(minx, maxx, parts + 1)
+    middle = (miny + maxy) / 2
+    return [[shapely.box(left, miny, right, middle), shapely.box(left, middle, right, maxy)] for left, right in zip(edges[:-1], edges[1:])]
+
+def posList(polygon:shapely.Polygon, height:float) -> str:
+    '''
+    Returns the exterior ring of a polygon as GML posList with the height as z coordinate
+    '''
+    return " ".join(f"{x:.2f} {y:.2f} {height:.2f}" for x, y in polygon.exterior.coords)
+
+def writeCityGmlTiles(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes CityGML LoD2 tiles (1 km, named like the NRW tiles) with bldg:Building elements with function, measured height and
+    RoofSurface posLists. Buildings with two parts have their roof surfaces in bldg:BuildingPart elements
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    buildings = buildingFootprints(domainBounds(scale), rng)
+    centroids = buildings.geometry.centroid
+    surfaces = 0
+
+    for (x, y), tileBounds in tiles(domainBounds(scale)):
+        inTile = (centroids.x >= tileBounds[0]) & (centroids.x < tileBounds[2]) & (centroids.y >= tileBounds[1]) & (centroids.y < tileBounds[3])
+        members = []
+        for building in buildings[inTile].itertuples():
+            parts = roofSurfaces(building.geometry, building.parts)
+            surfaces += 2 * len(parts)
+            roofs = ["".join(f"<bldg:boundedBy><bldg:RoofSurface><gml:posList>{posList(roof, building.height)}</gml:posList></bldg:RoofSurface></bldg:boundedBy>" for roof in part) for part in parts]
+            if building.parts == 1:
+                body = f"<bldg:measuredHeight>{building.height}</bldg:measuredHeight>{roofs[0]}"
+            else:
+                body = "".join(f"<bldg:consistsOfBuildingPart><bldg:BuildingPart gml:id=\"{building.gml_id}_{index}\"><bldg:measuredHeight>{building.height}</bldg:measuredHeight>{roof}</bldg:BuildingPart></bldg:consistsOfBuildingPart>" for index, roof in enumerate(roofs))
+            members.append(f"<core:cityObjectMember><bldg:Building gml:id=\"{building.gml_id}\"><bldg:function>{building.function}</bldg:function>{body}</bldg:Building></core:cityObjectMember>")
+
+        with open(os.path.join(directory, f"LoD2_32_{x // 1000}_{y // 1000}_1_NW.gml"), "w") as file:
+            file.write('<?xml version="1.0" encoding="UTF-8"?>\n<core:CityModel xmlns:core="http://www.opengis.net/citygml/1.0" '
+                       'xmlns:bldg="http://www.opengis.net/citygml/building/1.0" xmlns:gml="http://www.opengis.net/gml">\n')
+            file.write("\n".join(members))
+            file.write("\n</core:CityModel>\n")
+
+    return {"directory": directory, "features": len(buildings), "surfaces": surfaces}
+
+def writeBuildingFiles(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes the roof surfaces of the synthetic buildings (the same as in the CityGML tiles) as GeoParquet files per tile with the
+    columns of citygml2gpd (gml_id, height, function, buildingPart)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    buildings = buildingFootprints(domainBounds(scale), rng)
+    centroids = buildings.geometry.centroid
+    count = 0
+
+    for (x, y), tileBounds in tiles(domainBounds(scale)):
+        inTile = (centroids.x >= tileBounds[0]) & (centroids.x < tileBounds[2]) & (centroids.y >= tileBounds[1]) & (centroids.y < tileBounds[3])
+        rows = {"gml_id": [], "height": [], "function": [], "buildingPart": [], "geometry": []}
+        for building in buildings[inTile].itertuples():
+            for part in roofSurfaces(building.geometry, building.parts):
+                for roof in part:
+                    rows["gml_id"].append(building.gml_id)
+                    rows["height"].append(building.height)
+                    rows["function"].append(building.function)
+                    rows["buildingPart"].append(building.parts > 1)
+                    rows["geometry"].append(roof)
+        writeVector(gpd.GeoDataFrame(rows, geometry="geometry", crs=EPSG), os.path.join(directory, f"LoD2_32_{x // 1000}_{y // 1000}_1_NW.parquet"))
+        count += len(rows["gml_id"])
+
+    return {"build_path": directory, "features": count}
+
+def elevation(x:np.ndarray, y:np.ndarray) -> np.ndarray:
+    '''
+    Smooth synthetic terrain height (in m) at the given coordinates
+    '''
+    return 80 + 20 * np.sin(x / 700) + 15 * np.cos(y / 900) + 5 * np.sin((x + y) / 150)
+
+def writeXyzTiles(directory:str, scale:float, spacing:float = 1.0) -> dict:
+    '''
+    Writes DEM tiles as XYZ files (1 km, x y z of the cell centres separated by spaces, rows from north to south) with the
+    given point spacing, as the DGM1 tiles of NRW
+    '''
+    os.makedirs(directory, exist_ok=True)
+    points = 0
+    for (x, y), tileBounds in tiles(domainBounds(scale)):
+        xs = np.arange(tileBounds[0], tileBounds[2], spacing) + spacing / 2
+        ys = np.arange(tileBounds[3], tileBounds[1], -spacing) - spacing / 2
+        gx, gy = np.meshgrid(xs, ys)
+        gx, gy = gx.ravel(), gy.ravel()
+        table = pd.DataFrame({"x": gx, "y": gy, "z": elevation(gx, gy).round(2)})
+        table.to_csv(os.path.join(directory, f"dgm1_32_{x // 1000}_{y // 1000}_1_nw.xyz"), sep=" ", header=False, index=False, float_format="%.2f")
+        points += len(table)
+    return {"directory": directory, "features": points}
+
+def writeElevationRasters(directory:str, scale:float, resolution:float = 1.0, seed:int = 0) -> dict:
+    '''
+    Writes a DEM and a DSM (DEM with buildings and tree crowns) of the domain as GeoTiffs, as input of the canopy height model
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = domainBounds(scale)
+    width, height = int(np.ceil((maxx - minx) / resolution)), int(np.ceil((maxy - miny) / resolution))
+    transform = from_origin(minx, maxy, resolution, resolution)
+    profile = dict(driver="GTiff", width=width, height=height, count=1, dtype="float32", crs=f"EPSG:{EPSG}", transform=transform, tiled=True, compress="deflate")
+
+    with rasterio.open(os.path.join(directory, "dem.tif"), "w", **profile) as dem, rasterio.open(os.path.join(directory, "dsm.tif"), "w", **profile) as dsm:
+        # written in row blocks, so large scales do not need the whole grids in memory
+        for row in range(0, height, 1024):
+            rows = min(1024, height - row)
+            ys = maxy - (np.arange(row, row + rows) + 0.5) * resolution
+            xs = minx + (np.arange(width) + 0.5) * resolution
+            terrain = elevation(*np.meshgrid(xs, ys)).astype("float32")
+            objects = np.where(rng.random((rows, width)) < 0.3, rng.uniform(0, 25, (rows, width)), 0).astype("float32")
+            window = rasterio.windows.Window(0, row, width, rows)
+            dem.write(terrain, 1, window=window)
+            dsm.write(terrain + objects, 1, window=window)
+
+    return {"dem_path": directory, "dsm_path": directory, "dem_file": "dem.tif", "dsm_file": "dsm.tif", "features": width * height}
+
+def writeLai(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes a LAI raster like the Sentinel-2 LAI product (10 m, UTM 32N WGS84, int16 with scale factor 0.0008, nodata -32768)
+    covering the domain with a margin, so that the LAI has to be reprojected and only a part of it covers the trees
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = domainBounds(scale, margin=MARGIN)
+    width, height = int((maxx - minx) / 10), int((maxy - miny) / 10)
+    values = rng.integers(0, 8000, (height, width), dtype="int16")
+    values[rng.random((height, width)) < 0.02] = -32768
+
+    path = os.path.join(directory, "lai.tif")
+    with rasterio.open(path, "w", driver="GTiff", width=width, height=height, count=1, dtype="int16", nodata=-32768, crs="EPSG:32632",
+                       transform=from_origin(minx, maxy, 10, 10), tiled=True, compress="deflate") as dst:
+        dst.write(values, 1)
+    return {"lai_path": directory, "lai_file": "lai.tif", "features": width * height}
+
+def writeTreeCrowns(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes tree crowns (circular polygons with a radius of 1.5 to 8 m and a tree height) as GeoParquet files per tile, as the
+    output of the tree detection
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    bounds = domainBounds(scale)
+    count = featureCount(TREES_PER_KM2, bounds)
+    centres = rng.uniform(bounds[:2], bounds[2:], size=(count, 2))
+    crowns = gpd.GeoDataFrame({"treeID": np.arange(count), "Z": rng.uniform(4, 30, count).round(2)},
+                              geometry=shapely.buffer(shapely.points(centres), rng.uniform(1.5, 8, count), quad_segs=4), crs=EPSG)
+
+    for (x, y), tileBounds in tiles(bounds):
+        inTile = (centres[:, 0] >= tileBounds[0]) & (centres[:, 0] < tileBounds[2]) & (centres[:, 1] >= tileBounds[1]) & (centres[:, 1] < tileBounds[3])
+        writeVector(crowns[inTile], os.path.join(directory, f"trees_{x // 1000}_{y // 1000}.parquet"))
+    return {"tree_path": directory, "features": count}
+
+def writeClcPolygons(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes CORINE Land Cover polygons (EPSG:3035, layer and Code_18 column as text as in the CLC GeoPackage) covering the domain
+    with a margin, with the codes of the CLC translation table
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    bounds = domainBounds(scale, margin=MARGIN)
+    polygons = voronoiParcels(bounds, featureCount(CLC_PER_KM2, bounds), rng)
+    codes = pd.read_csv(CLC_KEYS)["Code_18"].astype(str).to_numpy()
+    clc = gpd.GeoDataFrame({"Code_18": rng.choice(codes, len(polygons)), "ID": np.arange(len(polygons))}, geometry=polygons, crs=EPSG).to_crs(3035)
+    clc.to_file(os.path.join(directory, "clc.gpkg"), layer="U2018_CLC2018_V2020_20u1", driver="GPKG")
+    return {"data_path": directory, "clc_file": "clc.gpkg", "keys_path": os.path.dirname(CLC_KEYS), "key_file": os.path.basename(CLC_KEYS), "features": len(clc)}
+
+def writeSoilPolygons(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes soil polygons like the BK50 shapefile (EPSG:25832) covering the domain with a margin, with the soil types (ART) of the
+    BK50 translation table
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    bounds = domainBounds(scale, margin=MARGIN)
+    polygons = voronoiParcels(bounds, featureCount(SOIL_PER_KM2, bounds), rng)
+    types = pd.read_csv(SOIL_KEYS)["ART"].to_numpy()
+    soil = gpd.GeoDataFrame({"ART": rng.choice(types, len(polygons))}, geometry=polygons, crs=EPSG)
+    soil.to_file(os.path.join(directory, "BK50.shp"))
+    return {"data_path": directory, "soil_file": "BK50.shp", "keys_path": os.path.dirname(SOIL_KEYS), "key_file": os.path.basename(SOIL_KEYS), "features": len(soil)}
+
+def writeZensus(directory:str, scale:float, seed:int = 0) -> dict:
+    '''
+    Writes the Zensus 100 m grid (GeoPackage, EPSG:3035) and the building data (Geb100m.csv) of the cells covering the domain with
+    a margin. Each cell has three building age classes (BAUJAHR_MZ) and one row of another feature
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = gpd.GeoSeries([shapely.box(*domainBounds(scale, margin=MARGIN))], crs=EPSG).to_crs(3035).total_bounds
+    east = np.arange(np.floor(minx / 100), np.ceil(maxx / 100)).astype(np.int64)
+    north = np.arange(np.floor(miny / 100), np.ceil(maxy / 100)).astype(np.int64)
+    east, north = (values.ravel() for values in np.meshgrid(east, north))
+    ids = np.char.add(np.char.add(np.char.add("CRS3035RES100mN", (north * 100).astype(str)), "E"), (east * 100).astype(str))
+
+    grid = gpd.GeoDataFrame({"id": ids}, geometry=shapely.box(east * 100, north * 100, east * 100 + 100, north * 100 + 100), crs=3035)
+    grid.to_file(os.path.join(directory, "grid.gpkg"), layer="de_grid_laea_100m", driver="GPKG")
+
+    keys = pd.read_csv(ZENSUS_KEYS)
+    codes = np.stack([rng.choice(keys["Auspraegung_Code"].to_numpy(), 3, replace=False) for _ in range(len(ids))])
+    texts = dict(zip(keys["Auspraegung_Code"], keys["Auspraegung_Text"]))
+    zensus = pd.DataFrame({
+        "Gitter_ID_100m": np.repeat(ids, 4),
+        "Merkmal": np.tile(["BAUJAHR_MZ"] * 3 + ["GEBTYPBAUWEISE"], len(ids)),
+        "Auspraegung_Code": np.column_stack([codes, np.ones(len(ids), dtype=int)]).ravel(),
+        "Anzahl": rng.integers(1, 50, 4 * len(ids)),
+        "Anzahl_q": 0,
+    })
+    zensus.insert(3, "Auspraegung_Text", zensus["Auspraegung_Code"].map(texts).where(zensus["Merkmal"] == "BAUJAHR_MZ", "Freistehendes Haus"))
+    zensus.to_csv(os.path.join(directory, "Geb100m.csv"), index=False, encoding="latin_1")
+
+    return {"zensus_path": directory, "grid_file": "grid.gpkg", "zensus_file": "Geb100m.csv", "key_file": ZENSUS_KEYS, "features": len(zensus)}
+
+# generator of each dataset and the datasets it needs in the same directory
+DATASETS = {
+    "clipper": writeClipper,
+    "alkis": writeAlkisLayers,
+    "imperviousness": writeImperviousness,
+    "citygml": writeCityGmlTiles,
+    "buildings": writeBuildingFiles,
+    "xyz": writeXyzTiles,
+    "elevation": writeElevationRasters,
+    "lai": writeLai,
+    "trees": writeTreeCrowns,
+    "clc": writeClcPolygons,
+    "soil": writeSoilPolygons,
+    "zensus": writeZensus,
+}
+
+def prepareDataset(name:str, root:str, scale:float) -> dict:
+    '''
+    Generates a dataset at a scale factor in its own directory below root, unless it was generated before, and returns its
+    description (paths and file names as module variables of the scripts, number of features). The description is saved
+    as json next to the data, so that the benchmark processes can read it
+    '''
+    directory = os.path.join(root, f"{name}_{scale:g}")
+    description = os.path.join(directory, "dataset.json")
+    if os.path.exists(description):
+        with open(description) as jsonFile:
+            return dict(json.load(jsonFile), directory=directory)
+
+    result = dict(DATASETS[name](directory, scale), directory=directory)
+    with open(description, "w") as jsonFile:
+        json.dump(result, jsonFile, indent=1)
+    return result
@@ -1,9 +1,19 @@
 import geopandas as gpd
 import pandas as pd
+import numpy as np
 import os
-import rasterio
-from rasterio.transform import from_origin
-from rasterio.features import rasterize
+import sys
+import hashlib
+import json
+
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import DEFAULT_MAX_BYTES, cachedClip, evict, sourceIdentity
+from common.config import configure
+from common.crs import clipAndReproject, transformCoordinates
+from common.manifest import outputsUpToDate, readManifest, recordOutputs, writeManifest
+from common.vectorio import datasetFiles, listVectorFiles, readVectorFiles, vectorPath, writeVector
+from common.rasterise import gridFromBounds, rasteriseToGeoTiff
 
 # set data paths
 build_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/buildings/Geb_BO"
@@ -11,20 +21,53 @@ zensus_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geoda
 outpath = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/buildings/processed"
 clip_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/buildings"
 
-def translateZensus(clip_file:str, grid_file:str, zensus_file:str, key_file:str, layername= "de_grid_laea_100m", epsg=25832) -> gpd.GeoDataFrame:
+# set input files and domain
+clip_file = "clip.shp"
+zensus_clip_file = "clip_3035.shp"
+grid_file = "DE_Grid_ETRS89-LAEA_100m.gpkg"
+zensus_file = "Geb100m.csv"
+key_file = "keys_Zensus.csv"
+epsg = 25832
+resolution = 5
+
+# processing options
+# rasterise block by block with this block size (in cells) for domains larger than memory, None rasterises the whole grid at once
+block_size = None
+# directory to cache clipped inputs between runs (GeoParquet), None disables the cache
+cache_path = None
+# format of the vector outputs: "parquet" (GeoParquet), "gpkg" (GeoPackage) or "shp" (Shapefile)
+vector_format = "shp"
+# recompute the outputs, even if the manifest shows that their inputs and options did not change
+force = False
+# join of the Zensus data to the buildings: "sjoin" (spatial join with the clipped grid polygons) or "grid" (grid cell of the
+# representative point of each building calculated from its coordinates, see joinZensusGrid)
+zensus_join = "sjoin"
+
+# CRS and cell size of the Zensus grid
+ZENSUS_EPSG = 3035
+ZENSUS_CELL_SIZE = 100
+# columns of the Zensus building data that are read and their dtypes, and number of rows read at once
+ZENSUS_DTYPES = {"Gitter_ID_100m": "str", "Merkmal": "category", "Auspraegung_Code": "int16", "Auspraegung_Text": "category", "Anzahl": "int32"}
+ZENSUS_CHUNK_SIZE = 1000000
+
+def translateZensus(clip_file:str, grid_file:str, zensus_file:str, key_file:str, layername= "de_grid_laea_100m", epsg=25832, cache_dir:str=None) -> gpd.GeoDataFrame:
     '''
-    This function translates the Zensus data to the PALM building types
+    This function translates the Zensus data to the PALM building types \n
+    With a cache directory, the clipped Zensus grid is read from the cache as long as the grid file and the clipper did not change
     '''
     
     # read and clip data
     clipper = gpd.read_file(os.path.join(clip_path,clip_file))
-    grid = gpd.read_file(os.path.join(zensus_path, grid_file), layer=layername, mask = clipper)
-    grid = grid.clip(clipper)
-    grid.to_crs(epsg, inplace=True)
 
-    # read zensus data and reduce to building age
-    zensus = pd.read_csv(os.path.join(zensus_path,zensus_file), encoding="latin_1")
-    zensus = zensus[zensus["Merkmal"] == "BAUJAHR_MZ"]
+    def readGrid() -> gpd.GeoDataFrame:
+        # clip in the CRS of the grid, only the clipped cells are reprojected
+        grid = gpd.read_file(os.path.join(zensus_path, grid_file), layer=layername, mask = clipper)
+        return clipAndReproject(grid, clipper, epsg)
+
+    grid = cachedClip(readGrid, os.path.join(zensus_path, grid_file), layername, clipper, epsg, cache_dir)
+
+    # read zensus data, reduced to building age in the cells of the grid
+    zensus = readZensus(zensus_file, cells=parseGridIds(grid["id"]), cache_dir=cache_dir)
 
     # read translation table
     keys = pd.read_csv(os.path.join(zensus_path,key_file))
@@ -38,81 +81,178 @@ def translateZensus(clip_file:str, grid_file:str, zensus_file:str, key_file:str,
     # return geodataframe
     return zensus_palm
 
-def combine_shapefiles(directory:str, clip_file:str) -> gpd.GeoDataFrame:
+def cellKeys(easting:np.ndarray, northing:np.ndarray, cell_size:float=ZENSUS_CELL_SIZE) -> np.ndarray:
+    '''
+    This function calculates the key of the Zensus grid cell containing each point (EPSG:3035) from the row and column of the cell
+    '''
+    return np.floor(np.asarray(northing) / cell_size).astype("int64") * 10**6 + np.floor(np.asarray(easting) / cell_size).astype("int64")
+
+def parseGridIds(ids:pd.Series) -> np.ndarray:
+    '''
+    This function converts Zensus grid IDs to cell keys (see cellKeys) without reading the grid. Both formats are parsed vectorised: \n
+    - "100mN26840E43200" (Gitter_ID_100m, lower left corner in units of the cell size)
+    - "CRS3035RES100mN2684000E4320000" (Gitter_ID_100m_neu, lower left corner in metres)
+    '''
+    parts = ids.str.extract(r"^(CRS3035RES)?(\d+)mN(\d+)E(\d+)$")
+    size = parts[1].astype("float64").to_numpy()
+    unit = np.where(parts[0].notna(), 1.0, size)
+    # the lower left corner plus half a cell lies within the cell
+    return cellKeys(parts[3].astype("float64").to_numpy() * unit + size / 2, parts[2].astype("float64").to_numpy() * unit + size / 2)
+
+def readZensus(zensus_file:str, cells:np.ndarray=None, merkmal="BAUJAHR_MZ", cache_dir:str=None) -> pd.DataFrame:
+    '''
+    This function reads the rows of one feature (Merkmal) of the Zensus data in the given grid cells (cell keys, see parseGridIds). \n
+    The CSV file is read in chunks with only the needed columns and compact dtypes, each chunk is filtered while reading,
+    so the national file is never held in memory. With a cache directory, the filtered rows are saved as Parquet and read from
+    there as long as the CSV file and the cells did not change
+    '''
+    source = os.path.join(zensus_path,zensus_file)
+    cachedFile = None
+    if cache_dir is not None:
+        key = {"source": sourceIdentity(source), "merkmal": merkmal, "cells": hashlib.sha256(np.unique(cells).tobytes()).hexdigest() if cells is not None else None}
+        cachedFile = os.path.join(cache_dir, f"zensus_{hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()}.parquet")
+        if os.path.exists(cachedFile):
+            print(f"read {zensus_file} from cache")
+            os.utime(cachedFile)
+            return pd.read_parquet(cachedFile)
+
+    chunks = []
+    reader = pd.read_csv(source, encoding="latin_1", usecols=list(ZENSUS_DTYPES), dtype=ZENSUS_DTYPES, chunksize=ZENSUS_CHUNK_SIZE)
+    for chunk in reader:
+        chunk = chunk[chunk["Merkmal"] == merkmal]
+        if cells is not None:
+            chunk = chunk[np.isin(parseGridIds(chunk["Gitter_ID_100m"]), cells)]
+        chunks.append(chunk)
+
+    # the categories of the chunks differ, so they are combined once after reading
+    zensus = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=list(ZENSUS_DTYPES))
+    zensus = zensus.astype({"Merkmal": "category", "Auspraegung_Text": "category"})
+    zensus["Auspraegung_Text"] = zensus["Auspraegung_Text"].cat.remove_unused_categories()
+
+    if cachedFile is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmpFile = os.path.join(cache_dir, f"tmp_{os.path.basename(cachedFile)}")
+        zensus.to_parquet(tmpFile, index=False)
+        os.replace(tmpFile, cachedFile)
+        evict(cache_dir, DEFAULT_MAX_BYTES, keep=cachedFile)
+    return zensus
+
+def dominantBuildingTypes(zensus:pd.DataFrame, keys:pd.DataFrame) -> pd.DataFrame:
+    '''
+    This function reduces the Zensus data to the building age class with the most buildings (Anzahl) in each grid cell and translates
+    it to the PALM building type. The result is indexed by the cell key (see parseGridIds)
+    '''
+    zensus = zensus[zensus["Merkmal"] == "BAUJAHR_MZ"]
+    zensus = zensus.sort_values("Anzahl", ascending=False, kind="stable").drop_duplicates("Gitter_ID_100m")
+    zensus = zensus.merge(keys.loc[keys["Merkmal"] == "BAUJAHR_MZ", ["Auspraegung_Code", "building_type"]], how="left", on="Auspraegung_Code")
+    zensus.index = parseGridIds(zensus["Gitter_ID_100m"])
+    return zensus[["Gitter_ID_100m", "Auspraegung_Code", "building_type"]]
+
+def joinZensusGrid(buildings:gpd.GeoDataFrame, zensus_file:str, key_file:str, cache_dir:str=None) -> gpd.GeoDataFrame:
     '''
-    This function combines all shapefiles in a directory to one geodataframe and creates a unique ID for each GML ID
-    The data is clipped to the domain extend
+    This function joins the PALM building type of the Zensus grid cell containing the representative point of each building, without
+    reading the grid polygons: the points are transformed to EPSG:3035 at once, the cell keys are calculated from the coordinates
+    and the building types are looked up by cell key. Each building gets exactly one row. \n
+    With a cache directory, the Zensus data of the cells is cached (see readZensus)
     '''
-    # Get a list of all building shapefiles in the directory
-    shapefile_list = [file for file in os.listdir(directory) if file.endswith(".shp")]
+    points = buildings.geometry.representative_point()
+    easting, northing = transformCoordinates(points.x.to_numpy(), points.y.to_numpy(), buildings.crs, ZENSUS_EPSG)
+    cells = cellKeys(easting, northing)
+
+    # read zensus data, reduced to building age in the cells of the buildings
+    zensus = readZensus(zensus_file, cells=cells, cache_dir=cache_dir)
 
-    # Create an empty GeoDataFrame to store the combined data
-    buildings = gpd.GeoDataFrame()
+    # read translation table
+    keys = pd.read_csv(os.path.join(zensus_path,key_file))
+
+    types = dominantBuildingTypes(zensus, keys).reindex(cells)
+    return buildings.assign(**{column: types[column].to_numpy() for column in types.columns})
+
+def combine_shapefiles(directory:str, clip_file:str, workers:int=None) -> gpd.GeoDataFrame:
+    '''
+    This function combines all building files (GeoParquet, GeoPackage or Shapefile) in a directory to one geodataframe and creates a unique ID for each GML ID
+    The data is clipped to the domain extend, the files are read concurrently and only buildings within the bounding box of the domain are loaded
+    '''
+    clipper = gpd.read_file(os.path.join(clip_path,clip_file))
 
-    # Iterate over each shapefile and read it into a GeoDataFrame
-    for shapefile in shapefile_list:
-        # Read the shapefile into a GeoDataFrame
-        gdf = gpd.read_file(os.path.join(directory, shapefile))
-            
-        # Concatenate the GeoDataFrame to the combined GeoDataFrame
-        buildings = pd.concat([buildings, gdf], ignore_index=True)
+    # Read all building files in the directory and combine them into one GeoDataFrame
+    buildings = readVectorFiles(listVectorFiles(directory), bbox=clipper.total_bounds, workers=workers)
 
     # create unique ID for each GML ID
     buildings["ID"] = buildings.groupby("gml_id").ngroup()
 
     # clip data
-    clipper = gpd.read_file(os.path.join(clip_path,clip_file))
     buildings.geometry = buildings.geometry.buffer(0)
-    buildings = buildings.clip(clipper)
+    buildings = clipAndReproject(buildings, clipper)
 
     # drop all where function is 53001_1800, 53001_1806, 53001_1807, 53001_1808, 53001_1830
     buildings = buildings[~buildings["function"].isin(["53001_1800", "53001_1806", "53001_1807", "53001_1808", "53001_1830"])]
     
     return buildings
 
-def rasteriseBuildings(gdf:gpd.GeoDataFrame,column:str,resolution:float,dtype:str,nodata:float,out_path:str) -> None:
+def rasteriseBuildings(gdf:gpd.GeoDataFrame,column:str,resolution:float,dtype:str,nodata:float,out_path:str,block_size:int=None) -> None:
     '''
     This function rasterizes the buildings to a given resolution and saves it as a GeoTiff
     '''
-    # Set the desired raster resolution and bounding box
-    pixel_size = resolution  
-    minx, miny, maxx, maxy = gdf.total_bounds
-    width = int((maxx - minx) / pixel_size)
-    height = int((maxy - miny) / pixel_size)
-
-    # Define the raster transform
-    transform = from_origin(minx, maxy, pixel_size, pixel_size)
-
-    # Create a new raster object with the specified parameters
-    with rasterio.open(f"{out_path}/build_{column}.tif", 'w', driver='GTiff', height=height, width=width, count=1, dtype=dtype, crs=gdf.crs, transform=transform, nodata=nodata) as dst:
-        # Rasterize the GeoDataFrame
-        raster = rasterize(
-            [(geom, float(value)) for geom, value in zip(gdf.geometry, gdf[column])],
-            out_shape=(height, width),
-            transform=transform,
-            fill=nodata,
-            all_touched=True,
-            dtype=dtype
-        )
-        dst.write(raster, 1)
-
-# translate Zensus data and read buildings
-zensus_palm = translateZensus(clip_file="clip_3035.shp",grid_file="DE_Grid_ETRS89-LAEA_100m.gpkg",zensus_file="Geb100m.csv",key_file="keys_Zensus.csv")
-buildings = combine_shapefiles(build_path,"clip.shp")
-
-# Spatially join the dataframes
-joined_df = gpd.sjoin(buildings, zensus_palm, how="left", predicate="intersects")
-
-# Drop unnecessary columns
-joined_df = joined_df.drop(columns=["index_right"])
-
-# Fill NaN values in building_type column with 5
-joined_df["building_type"].fillna(5, inplace=True)
-
-# save as shapefile
-joined_df.to_file(os.path.join(outpath,"buildings.shp"))
-
-# rasterise buildings
-rasteriseBuildings(joined_df,"building_type",5,"int16",-9999,outpath)
-rasteriseBuildings(joined_df,"ID",5,"int32",-9999,outpath)
-rasteriseBuildings(joined_df,"height",5,"float32",-9999,outpath)
\ No newline at end of file
+    rasteriseBuildingColumns(gdf,{column: dtype},resolution,nodata,out_path,block_size)
+
+def rasteriseBuildingColumns(gdf:gpd.GeoDataFrame,columns:dict,resolution:float,nodata:float,out_path:str,block_size:int=None) -> None:
+    '''
+    This function rasterizes several columns of the buildings in one pass to a given resolution and saves each as a GeoTiff. \n
+    columns is a dictionary with the column names and their dtype. With a block_size the grid is rasterised and written block by block.
+    '''
+    grid = gridFromBounds(gdf.total_bounds, resolution, gdf.crs)
+    outputs = {column: f"{out_path}/build_{column}.tif" for column in columns}
+
+    rasteriseToGeoTiff(gdf, list(columns), grid, outputs, dtypes=columns, fill=nodata, nodata=nodata, all_touched=True, block_size=block_size)
+
+def run(config:dict = None) -> None:
+    '''
+    Translates the Zensus data to PALM building types, joins them with the buildings and rasterises them. \n
+    The data paths and processing options of this script can be overridden with a step config (see runner/run_domain.py)
+    '''
+    configure(globals(), config)
+
+    # skip the translation if the outputs were created from the same inputs and options (manifest of outpath)
+    outputs = [vectorPath(outpath, "buildings", vector_format)] + [f"{outpath}/build_{column}.tif" for column in ["building_type","ID","height"]]
+    inputs = [file for building_file in listVectorFiles(build_path) for file in datasetFiles(building_file)]
+    inputs += datasetFiles(os.path.join(clip_path,clip_file)) + [os.path.join(zensus_path,zensus_file), os.path.join(zensus_path,key_file)]
+    # the grid join does not read the grid polygons
+    if zensus_join != "grid":
+        inputs += datasetFiles(os.path.join(clip_path,zensus_clip_file)) + [os.path.join(zensus_path,grid_file)]
+    options = {"epsg": epsg, "resolution": resolution, "zensus_join": zensus_join}
+    manifest = readManifest(outpath, "buildings2PALM")
+    if not force and outputsUpToDate(manifest, outputs, inputs, options):
+        print("building outputs are up to date")
+        return
+
+    if zensus_join == "grid":
+        # read buildings and look up the building type of their grid cell
+        buildings = combine_shapefiles(build_path,clip_file)
+        joined_df = joinZensusGrid(buildings, zensus_file, key_file, cache_dir=cache_path)
+    else:
+        # translate Zensus data and read buildings
+        zensus_palm = translateZensus(clip_file=zensus_clip_file,grid_file=grid_file,zensus_file=zensus_file,key_file=key_file,epsg=epsg,cache_dir=cache_path)
+        buildings = combine_shapefiles(build_path,clip_file)
+
+        # Spatially join the dataframes
+        joined_df = gpd.sjoin(buildings, zensus_palm, how="left", predicate="intersects")
+
+        # Drop unnecessary columns
+        joined_df = joined_df.drop(columns=["index_right"])
+
+    # Fill NaN values in building_type column with 5
+    joined_df["building_type"].fillna(5, inplace=True)
+
+    # save vector data
+    writeVector(joined_df, vectorPath(outpath, "buildings", vector_format))
+
+    # rasterise buildings
+    rasteriseBuildingColumns(joined_df,{"building_type": "int16", "ID": "int32", "height": "float32"},resolution,-9999,outpath,block_size)
+
+    # record the dependencies of the outputs
+    recordOutputs(manifest, outputs, inputs, options)
+    writeManifest(outpath, manifest, "buildings2PALM")
+
+if __name__ == "__main__":
+    run()
\ No newline at end of file
@@ -1,9 +1,23 @@
 import xml.etree.ElementTree as ET
 import geopandas as gpd
 from shapely.geometry import Polygon
+import shapely
+import numpy as np
 import pandas as pd
 import glob
 import os
+import time
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.manifest import isUpToDate, readManifest, recordOutput, writeManifest
+from common.vectorio import writeVector
+
+BLDG_NS = "http://www.opengis.net/citygml/building/1.0"
+GML_NS = "http://www.opengis.net/gml"
 
 def parseGml(filePath: str) -> ET.ElementTree:
     """Reads GML File and returns it as an Element Tree."""
@@ -27,6 +41,38 @@ def posListToShapelyPolygon(posList: str) -> Polygon:
 
     return shapely_polygon
 
+def posListsToShapelyPolygons(posLists: list) -> np.ndarray:
+    """Converts a list of PosList strings into an array of shapely Polygons with a single vectorised call.
+
+    All coordinates are parsed into one flat float64 buffer. The rings are separated by a nan sentinel,
+    from which the ring offsets are derived. Missing or empty PosLists result in empty Polygons, as well as PosLists whose
+    number of values is not a multiple of 3 (malformed or not 3D), which are skipped so the other rings keep their coordinates.
+    """
+    polygons = shapely.empty(len(posLists), geom_type=shapely.GeometryType.POLYGON)
+    if len(posLists) == 0:
+        return polygons
+
+    # parse all coordinates at once, every ring is terminated by a nan
+    buffer = np.fromstring(" nan ".join(pl or "" for pl in posLists) + " nan", dtype=np.float64, sep=" ")
+    isSentinel = np.isnan(buffer)
+    ringEnds = np.flatnonzero(isSentinel)
+    ringLengths = np.diff(ringEnds, prepend=-1) - 1
+
+    # skip the values of rings that are not made of 3D coordinates
+    complete = ringLengths % 3 == 0
+    if not complete.all():
+        print(f"skipped {np.count_nonzero(~complete)} posLists whose number of values is not a multiple of 3")
+    values = buffer[~isSentinel][np.repeat(complete, ringLengths)]
+
+    # 3D coordinates with ring index for each coordinate
+    coords = values.reshape(-1, 3)
+    valid = complete & (ringLengths > 0)
+    ringIndex = np.repeat(np.arange(np.count_nonzero(valid)), ringLengths[valid] // 3)
+
+    rings = shapely.linearrings(coords, indices=ringIndex)
+    polygons[valid] = shapely.polygons(rings)
+    return polygons
+
 def addRowToGeoDataFrame(geoDataFrame: gpd.GeoDataFrame, newRow: dict) -> gpd.GeoDataFrame:
     """Adds a new row to an existing GeoDataFrame."""
     if geoDataFrame.empty:
@@ -72,45 +118,165 @@ def extractHeightsAndGeometryFromGML(eTree: ET.ElementTree, geoDataFrame: gpd.Ge
     
     return geoDataFrame
 
+def collectHeightsAndGeometryFromGML(eTree: ET.Element, rows: dict, gmlID: str, function: str, buildingPart: bool) -> None:
+    """Extracts the height and PosList from a building / roof surface and appends them to columnar row buffers."""
+
+    height = None
+    heights = findAllInETree(eTree, f".//{{{BLDG_NS}}}measuredHeight")
+    if len(heights) == 0: print(f"no height for {gmlID}")
+    elif len(heights) > 1: print(f"height on {gmlID} might be lost...")
+    else: height = float(heights[0].text)
+
+    roofSurfaces = findAllInETree(eTree, f".//{{{BLDG_NS}}}RoofSurface")
+    if len(roofSurfaces) == 0:
+        print(f"no roofSurfaces for {gmlID}")
+        return
+
+    for rs in roofSurfaces:
+        posLists = findAllInETree(rs, f".//{{{GML_NS}}}posList")
+        if len(posLists) == 0:
+            print(f"no geometry for {gmlID}")
+        for pl in posLists:
+            rows["gml_id"].append(gmlID)
+            rows["height"].append(height)
+            rows["function"].append(function)
+            rows["buildingPart"].append(buildingPart)
+            rows["geometry"].append(pl.text)
+
+def collectBuilding(building: ET.Element, rows: dict) -> None:
+    """Collects all roof surfaces of a building (or of its building parts) into columnar row buffers."""
+    gmlID = building.attrib[f"{{{GML_NS}}}id"]
+    function = None
+
+    buildingParts = findAllInETree(building, f".//{{{BLDG_NS}}}BuildingPart")
+
+    functions = findAllInETree(building, f".//{{{BLDG_NS}}}function")
+    if len(functions) == 0: print(f"no function for {gmlID}")
+    elif len(functions) > 1: print(f"function on {gmlID} might be lost...")
+    else: function = functions[0].text
+
+    if len(buildingParts) == 0:
+        collectHeightsAndGeometryFromGML(building, rows, gmlID, function, False)
+    else:
+        for bp in buildingParts:
+            collectHeightsAndGeometryFromGML(bp, rows, gmlID, function, True)
+
+def streamBuildingsFromGml(filePath: str, crs: str = "EPSG:25832") -> gpd.GeoDataFrame:
+    """Parses a GML File incrementally building by building and returns all roof surfaces as one GeoDataFrame.
+
+    Each bldg:Building subtree (including its BuildingParts) is processed as soon as it has been read completely
+    and is cleared afterwards, so only one building is held in memory at a time.
+    """
+    rows = {"gml_id": [], "height": [], "function": [], "buildingPart": [], "geometry": []}
+    buildingTag = f"{{{BLDG_NS}}}Building"
+    root = None
+
+    for event, elem in ET.iterparse(filePath, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "end" and elem.tag == buildingTag:
+            collectBuilding(elem, rows)
+            # free the processed subtree and detach it from the document root
+            elem.clear()
+            root.clear()
+
+    # convert all PosLists of the tile to polygons at once
+    rows["geometry"] = posListsToShapelyPolygons(rows["geometry"])
+
+    return gpd.GeoDataFrame(rows, geometry="geometry", crs=crs)
+
 def saveGeoDataFrameAsShape(filePath: str, geoDataFrame: gpd.GeoDataFrame): 
     geoDataFrame.to_file(filePath)   
 
-if __name__ == "__main__":
-    build_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/buildings/LOD2"
-    filePathList = glob.glob(os.path.join(build_path,'*.gml'))
+def outputPathForTile(filePath: str, outFormat: str = "shp", outDir: str = None) -> str:
+    """Returns the output path of a converted tile (same name as the GML file with the extension of the output format)."""
+    fileName = os.path.splitext(os.path.basename(filePath))[0] + f".{outFormat}"
+    return os.path.join(outDir or os.path.dirname(filePath), fileName)
+
+def convertTile(filePath: str, outPath: str) -> dict:
+    """Converts a single GML tile and returns a summary of the conversion. Errors are returned instead of raised."""
+    start = time.perf_counter()
+    try:
+        data = streamBuildingsFromGml(filePath)
+        writeVector(data, outPath)
+        return {"tile": filePath, "status": "converted", "features": len(data), "seconds": time.perf_counter() - start}
+    except Exception as e:
+        return {"tile": filePath, "status": "failed", "features": 0, "seconds": time.perf_counter() - start, "error": repr(e)}
+
+def convertTiles(directory: str, workers: int = 1, outFormat: str = "shp", outDir: str = None, force: bool = False) -> list:
+    """Converts all GML tiles in a directory with a pool of worker processes.
+
+    Tiles whose GML file did not change since their output was written (content hash recorded in the manifest of the
+    output directory) are skipped unless force is set. A failing tile does not abort the conversion of the other tiles.
+    """
+    filePathList = sorted(glob.glob(os.path.join(directory, "*.gml")))
+    manifestDir = outDir or directory
+    manifest = readManifest(manifestDir)
+    config = {"outFormat": outFormat}
+    summary = []
+    jobs = {}
 
-    #filePath = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/buildings/LOD2/LoD2_32_376_5706_1_NW.gml"
     for filePath in filePathList:
-        rootNodeGml = parseGml(filePath)
+        outPath = outputPathForTile(filePath, outFormat, outDir)
+        if not force and isUpToDate(manifest, outPath, [filePath], config):
+            summary.append({"tile": filePath, "status": "skipped", "features": 0, "seconds": 0.0})
+        else:
+            jobs[filePath] = outPath
 
-        data = gpd.GeoDataFrame(
-            columns=["gml_id", "height", "function", "buildingPart"],
-            geometry=[],
-            crs="EPSG:25832",
-        )
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convertTile, filePath, outPath) for filePath, outPath in jobs.items()]
+        for future in as_completed(futures):
+            result = future.result()
+            summary.append(result)
+            printTileSummary(result)
+            # save the manifest after each tile, so an interrupted run keeps the finished tiles
+            if result["status"] == "converted":
+                recordOutput(manifest, jobs[result["tile"]], [result["tile"]], config)
+                writeManifest(manifestDir, manifest)
 
-        buildings = findAllInETree(rootNodeGml, ".//{http://www.opengis.net/citygml/building/1.0}Building")
+    return summary
 
-        for building in buildings:
+def printTileSummary(result: dict) -> None:
+    """Prints the timing and feature count of a converted tile."""
+    line = f"{result['status']:>9} {os.path.basename(result['tile'])}: {result['features']} features in {result['seconds']:.1f} s"
+    if "error" in result:
+        line += f" ({result['error']})"
+    print(line)
 
-            gmlID = building.attrib['{http://www.opengis.net/gml}id']
-            function = None
-            height = None
-            buildingPart = None
-            geometry = None
+def parseArguments() -> argparse.Namespace:
+    """Reads the command line arguments of the batch conversion."""
+    parser = argparse.ArgumentParser(description="Converts a directory of CityGML LoD2 tiles to roof surface shapefiles, GeoPackages or GeoParquet files.")
+    parser.add_argument("directory", nargs="?", default="/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/buildings/LOD2", help="directory containing the *.gml tiles")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-f", "--format", dest="outFormat", choices=["shp", "gpkg", "parquet"], default="shp", help="output format (parquet: GeoParquet)")
+    parser.add_argument("-o", "--outdir", dest="outDir", default=None, help="output directory (default: next to the tiles)")
+    parser.add_argument("--force", action="store_true", help="convert tiles even if their GML file did not change")
+    return parser.parse_args()
 
-            buildingParts = findAllInETree(building, ".//{http://www.opengis.net/citygml/building/1.0}BuildingPart")
+def run(config: dict) -> list:
+    """Runs the batch conversion with a config (the command line arguments or a step config, see runner/run_domain.py) and prints a summary.
 
-            functions = findAllInETree(building, ".//{http://www.opengis.net/citygml/building/1.0}function")
-            
-            if len(functions) == 0: print(f"no function for {gmlID}")
-            elif len(functions) > 1: print(f"function on {gmlID} might be lost...") 
-            else: function = functions[0].text
+    Missing entries fall back to the defaults of the command line arguments. Returns the summary of all tiles and
+    raises a RuntimeError after the summary if any tile failed, so that the conversion is not regarded as complete.
+    """
+    config = {key: value for key, value in config.items() if key != "domain"}
+    unknown = set(config) - {"directory", "workers", "outFormat", "outDir", "force"}
+    if unknown:
+        raise KeyError(f"unknown config entries: {', '.join(sorted(unknown))}")
 
-            if len(buildingParts) == 0:
-                data = extractHeightsAndGeometryFromGML(building, data, gmlID, function, False)
-            else:
-                for bp in buildingParts:
-                    data = extractHeightsAndGeometryFromGML(bp, data, gmlID, function, True)
+    summary = convertTiles(config["directory"], workers=config.get("workers", os.cpu_count()), outFormat=config.get("outFormat", "shp"),
+                           outDir=config.get("outDir"), force=config.get("force", False))
+
+    converted = [result for result in summary if result["status"] == "converted"]
+    skipped = [result for result in summary if result["status"] == "skipped"]
+    failed = [result for result in summary if result["status"] == "failed"]
+    print(f"{len(converted)} converted ({sum(result['features'] for result in converted)} features, {sum(result['seconds'] for result in converted):.1f} s summed tile time), {len(skipped)} up to date, {len(failed)} failed")
+    for result in failed:
+        print(f"failed: {result['tile']} {result['error']}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(summary)} tiles failed")
 
-        saveGeoDataFrameAsShape(os.path.join(build_path,filePath.replace(".gml", ".shp")), data)
\ No newline at end of file
+    return summary
+
+if __name__ == "__main__":
+    run(vars(parseArguments()))
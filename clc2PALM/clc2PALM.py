@@ -1,61 +1,76 @@
 import geopandas as gpd
 import pandas as pd
 import os
+import sys
 import numpy as np
-import rasterio
-from rasterio.transform import from_origin
-from rasterio.features import rasterize
 from geocube.vector import vectorize
 import xarray as xr
 import rioxarray as rio
 import shapely
 
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cachedClip
+from common.config import configure
+from common.crs import clipAndReproject
+from common.manifest import outputsUpToDate, readManifest, recordOutputs, writeManifest
+from common.vectorio import datasetFiles, vectorPath, writeVector
+from common.rasterise import gridFromBounds, rasteriseToGeoTiff
+
 # set data paths
 data_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use/CLC"
 keys_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use"
 outpath = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/land_use/processed"
 
+# set input files and domain
+clip_file = "clip_clc_3035.shp"
+clc_file = "U2018_CLC2018_V2020_20u1_gpkg.gpkg"
+key_file = "CLC_key.csv"
+epsg = 25832
+resolution = 32.0
+
+# processing options
+# rasterise block by block with this block size (in cells) for domains larger than memory, None rasterises the whole grid at once
+block_size = None
+# directory to cache clipped inputs between runs (GeoParquet), None disables the cache
+cache_path = None
+# format of the vector outputs: "parquet" (GeoParquet), "gpkg" (GeoPackage) or "shp" (Shapefile)
+vector_format = "shp"
+# recompute the outputs, even if the manifest shows that their inputs and options did not change
+force = False
+
 # define functions
-def rasteriseSurface(gdf:gpd.GeoDataFrame,column:str,resolution:float) -> None:
+def rasteriseSurface(gdf:gpd.GeoDataFrame,column:str,resolution:float,block_size:int=None) -> None:
     '''
-    Rasterises the processed ALKIS dataset with a desired resolution and converts to values to integer
+    Rasterises the processed CLC dataset with a desired resolution and converts to values to integer
     '''
-    output_raster_path = os.path.join(outpath,f"clc_palm_{column}.tif")
-
-    # Set the desired raster resolution and bounding box
-    pixel_size = resolution  # Adjust this according to your needs
-    minx, miny, maxx, maxy = gdf.total_bounds
-    width = int((maxx - minx) / pixel_size)
-    height = int((maxy - miny) / pixel_size)
-
-    # Define the raster transform
-    transform = from_origin(minx, maxy, pixel_size, pixel_size)
-
-    # Define the CRS
-    crs = gdf.crs
-
-    # Create a new raster file
-    with rasterio.open(output_raster_path, 'w', driver='GTiff', count=1, dtype='int16', width=width, height=height, transform=transform, crs=crs, nodata=-9999) as dst:
-        # Handle NaN values and round to integers
-        shapes = [
-            (geom, int(round(value)) if not np.isnan(value) else -9999)
-            for geom, value in zip(gdf.geometry, gdf[column])
-        ]
-        # Rasterize the GeoDataFrame into the new raster
-        raster = rasterize(shapes, out_shape=(height, width), transform=transform)
-        
-        # Write the raster data to the output raster
-        dst.write(raster, 1)
-
-def translateCLC(clip_file:str, clc_file:str, key_file:str, layername= "U2018_CLC2018_V2020_20u1",epsg=25832) -> tuple[gpd.GeoDataFrame,gpd.GeoDataFrame]:
+    rasteriseSurfaces(gdf,[column],resolution,block_size)
+
+def rasteriseSurfaces(gdf:gpd.GeoDataFrame,columns:list,resolution:float,block_size:int=None) -> None:
     '''
-    This function translates the CLC data to PALM classes
+    Rasterises several columns of the processed CLC dataset in one pass onto the same grid and converts the values to integer. \n
+    Each column is saved as a separate GeoTiff. With a block_size the grid is rasterised and written block by block.
+    '''
+    grid = gridFromBounds(gdf.total_bounds, resolution, gdf.crs)
+    outputs = {column: os.path.join(outpath,f"clc_palm_{column}.tif") for column in columns}
+
+    # features without a value are set to nodata, cells without features keep 0
+    rasteriseToGeoTiff(gdf, columns, grid, outputs, fill=0, nodata=-9999, block_size=block_size)
+
+def translateCLC(clip_file:str, clc_file:str, key_file:str, layername= "U2018_CLC2018_V2020_20u1",epsg=25832,cache_dir:str=None) -> tuple[gpd.GeoDataFrame,gpd.GeoDataFrame]:
+    '''
+    This function translates the CLC data to PALM classes \n
+    With a cache directory, the clipped CLC data is read from the cache as long as the CLC file and the clipper did not change
     '''
     # read and clip data
     clipper = gpd.read_file(os.path.join(data_path,clip_file))
-    clc = gpd.read_file(os.path.join(data_path, clc_file), layer=layername, mask = clipper)
-    clc = clc.clip(clipper)
-    clc.to_crs(epsg, inplace=True)
+
+    def readCLC() -> gpd.GeoDataFrame:
+        # clip in the CRS of the CLC data, only the clipped features are reprojected
+        clc = gpd.read_file(os.path.join(data_path, clc_file), layer=layername, mask = clipper)
+        return clipAndReproject(clc, clipper, epsg)
+
+    clc = cachedClip(readCLC, os.path.join(data_path, clc_file), layername, clipper, epsg, cache_dir)
 
     # read translation table
     keys = pd.read_csv(os.path.join(keys_path,key_file))
@@ -73,25 +88,47 @@ def translateCLC(clip_file:str, clc_file:str, key_file:str, layername= "U2018_CL
     # return geodataframe
     return clc_palm, clipper
 
-# read and translate CLC
-clc_palm, clipper = translateCLC("clip_clc_3035.shp","U2018_CLC2018_V2020_20u1_gpkg.gpkg","CLC_key.csv")
+def run(config:dict = None) -> None:
+    '''
+    Translates the CLC data to PALM surface types and rasterises them. \n
+    The data paths and processing options of this script can be overridden with a step config (see runner/run_domain.py)
+    '''
+    configure(globals(), config)
+
+    # skip the translation if the outputs were created from the same inputs and options (manifest of outpath)
+    outputs = [vectorPath(outpath, "clc_palm", vector_format)] + [os.path.join(outpath,f"clc_palm_{column}.tif") for column in ["pavement","land_use"]]
+    inputs = datasetFiles(os.path.join(data_path,clip_file)) + [os.path.join(data_path,clc_file), os.path.join(keys_path,key_file), os.path.join(keys_path,"PALM_classes.csv")]
+    options = {"epsg": epsg, "resolution": resolution}
+    manifest = readManifest(outpath, "clc2PALM")
+    if not force and outputsUpToDate(manifest, outputs, inputs, options):
+        print("CLC outputs are up to date")
+        return
+
+    # read and translate CLC
+    clc_palm, clipper = translateCLC(clip_file,clc_file,key_file,epsg=epsg,cache_dir=cache_path)
+
+    # keep only relevant columns
+    clc_palm = clc_palm[["Code_18","CLC_text","pavement","vegetation","water","geometry"]]
 
-# keep only relevant columns
-clc_palm = clc_palm[["Code_18","CLC_text","pavement","vegetation","water","geometry"]]
+    # combine with named PALM class table for visualisation purposes
+    class_names = pd.read_csv(os.path.join(keys_path,"PALM_classes.csv"))
 
-# combine with named PALM class table for visualisation purposes
-class_names = pd.read_csv(os.path.join(keys_path,"PALM_classes.csv"))
+    clc_palm_named = clc_palm.merge(class_names, on=["pavement","vegetation","water"], how="left")
 
-clc_palm_named = clc_palm.merge(class_names, on=["pavement","vegetation","water"], how="left")
+    # save vector data
+    writeVector(clc_palm_named, vectorPath(outpath, "clc_palm", vector_format))
+    print("saved vector data")
+
+    # create land_use column from combination of vegetation and water for later use in GEO4PALM
+    clc_palm["land_use"] = clc_palm["vegetation"]
+    clc_palm["land_use"] = np.where(clc_palm["water"].notna(), clc_palm["water"] + 20, clc_palm["land_use"])
 
-# save shapefile
-clc_palm_named.to_file(os.path.join(outpath,"clc_palm.shp"))
-print("saved shapefile")
+    # rasterise 
+    rasteriseSurfaces(clc_palm,["pavement","land_use"],resolution,block_size)
 
-# create land_use column from combination of vegetation and water for later use in GEO4PALM
-clc_palm["land_use"] = clc_palm["vegetation"]
-clc_palm["land_use"] = np.where(clc_palm["water"].notna(), clc_palm["water"] + 20, clc_palm["land_use"])
+    # record the dependencies of the outputs
+    recordOutputs(manifest, outputs, inputs, options)
+    writeManifest(outpath, manifest, "clc2PALM")
 
-# rasterise 
-rasteriseSurface(clc_palm,"pavement",32.0)
-rasteriseSurface(clc_palm,"land_use",32.0)
\ No newline at end of file
+if __name__ == "__main__":
+    run()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import geopandas as gpd
+import shapely
+from common.vectorio import VECTOR_FORMAT, readVector, writeVector
+
+# GeoParquet needs pyarrow, otherwise the cache falls back to GeoPackage
+CACHE_FORMAT = VECTOR_FORMAT
+
+# default maximum size of a cache directory in bytes
+DEFAULT_MAX_BYTES = 20 * 1024**3
+
+def sourceIdentity(path:str, hashContent=False) -> dict:
+    '''
+    Identifies a source file by its path, size and modification time (and optionally a hash of its content)
+    '''
+    stat = os.stat(path)
+    identity = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if hashContent:
+        identity["sha256"] = fileHash(path)
+    return identity
+
+def fileHash(path:str, chunkSize=1024**2) -> str:
+    '''
+    Calculates the sha256 hash of the content of a file
+    '''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def geometryHash(gdf:gpd.GeoDataFrame) -> str:
+    '''
+    Calculates a hash of the geometries and the CRS of a Geodataframe, e.g. of the clipper
+    '''
+    digest = hashlib.sha256()
+    for wkb in shapely.to_wkb(gdf.geometry.values):
+        digest.update(wkb)
+    digest.update(str(gdf.crs.to_wkt() if gdf.crs else None).encode())
+    return digest.hexdigest()
+
+def cacheKey(source:str, layer:str, clipper:gpd.GeoDataFrame, crs, hashContent=False) -> str:
+    '''
+    Creates the key of a clipped input from the identity of the source file, the layer name, the clipper geometry and the target CRS
+    '''
+    key = {
+        "source": sourceIdentity(source, hashContent),
+        "layer": layer,
+        "clipper": geometryHash(clipper),
+        "crs": str(crs),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def cachePath(cache_dir:str, key:str) -> str:
+    '''
+    Returns the path of a cache entry
+    '''
+    return os.path.join(cache_dir, f"{key}.{CACHE_FORMAT}")
+
+def readCached(cache_dir:str, key:str) -> gpd.GeoDataFrame:
+    '''
+    Reads a cache entry and marks it as recently used. Returns None if there is no entry for the key
+    '''
+    path = cachePath(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+
+    # the modification time is used as last access time for the eviction
+    os.utime(path)
+    return readVector(path)
+
+def writeCached(cache_dir:str, key:str, gdf:gpd.GeoDataFrame, max_bytes=DEFAULT_MAX_BYTES) -> None:
+    '''
+    Saves a Geodataframe as cache entry and evicts the least recently used entries if the cache is larger than max_bytes
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cachePath(cache_dir, key)
+
+    # write to a temporary file first, so that no incomplete entries are read
+    tmpPath = os.path.join(cache_dir, f"tmp_{key}.{CACHE_FORMAT}")
+    writeVector(gdf, tmpPath)
+    os.replace(tmpPath, path)
+
+    evict(cache_dir, max_bytes, keep=path)
+
+def evict(cache_dir:str, max_bytes:int, keep:str=None) -> None:
+    '''
+    Removes the least recently used entries until the cache directory is not larger than max_bytes. 
+
+    Several processes can share a cache directory and evict at the same time, entries removed by another process are skipped
+    '''
+    entries = []
+    for file in os.listdir(cache_dir):
+        if file.endswith((".parquet", ".gpkg", ".tif")) and not file.startswith("tmp_"):
+            path = os.path.join(cache_dir, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path != keep:
+            # an entry already removed by another process no longer counts either
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def cachedClip(reader, source:str, layer:str, clipper:gpd.GeoDataFrame, crs, cache_dir:str, max_bytes=DEFAULT_MAX_BYTES, hashContent=False) -> gpd.GeoDataFrame:
+    '''
+    Returns a clipped input from the cache or reads it with reader (a function without arguments that reads and clips the source) and caches it. \n
+    Without a cache directory the reader is always called.
+    '''
+    if cache_dir is None:
+        return reader()
+
+    key = cacheKey(source, layer, clipper, crs, hashContent)
+    gdf = readCached(cache_dir, key)
+    if gdf is None:
+        gdf = reader()
+        writeCached(cache_dir, key, gdf, max_bytes)
+    else:
+        print(f"read {os.path.basename(source)} {layer or ''} from cache")
+    return gdf
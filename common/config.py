@@ -0,0 +1,29 @@
+import json
+
+# entries of the domain section of a run config, which are applied to every script that defines them
+DOMAIN_KEYS = ("clip_file", "epsg", "resolution")
+
+def readConfig(file:str) -> dict:
+    '''
+    Reads a run config (json file) with the domain and the configuration of each step
+    '''
+    with open(file) as jsonFile:
+        return json.load(jsonFile)
+
+def configure(moduleGlobals:dict, config:dict = None) -> None:
+    '''
+    Overrides the data paths and processing options (module variables) of a script with the entries of a step config. \n
+    The entries of the optional "domain" section are only applied if the script defines them. Other unknown entries raise
+    a KeyError, so that a typo in the config does not silently fall back to the hardcoded default of the script
+    '''
+    if not config:
+        return
+
+    config = dict(config)
+    domain = config.pop("domain", {})
+    unknown = [key for key in config if key not in moduleGlobals]
+    if unknown:
+        raise KeyError(f"unknown config entries: {', '.join(unknown)}")
+
+    moduleGlobals.update({key: value for key, value in domain.items() if key in DOMAIN_KEYS and key in moduleGlobals})
+    moduleGlobals.update(config)
@@ -0,0 +1,121 @@
+import math
+from functools import lru_cache
+import geopandas as gpd
+import numpy as np
+import rasterio
+from pyproj import CRS, Transformer
+from rasterio.enums import Resampling
+from rasterio.warp import calculate_default_transform, reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
+
+# cells read around the source window of a reprojection, so that the resampling has all neighbours at the edges
+WINDOW_MARGIN = 2
+
+def toCrs(crs) -> CRS:
+    '''
+    Converts an EPSG code, a string like "EPSG:25832" or a CRS object to a pyproj CRS
+    '''
+    return CRS.from_user_input(crs)
+
+def sameCrs(crs, other) -> bool:
+    '''
+    Checks if two CRS (EPSG code, string or CRS object) are equal
+    '''
+    return toCrs(crs) == toCrs(other)
+
+@lru_cache(maxsize=None)
+def cachedTransformer(source:CRS, target:CRS) -> Transformer:
+    '''
+    Creates the transformer of a pair of pyproj CRS, the transformers are cached by CRS
+    '''
+    return Transformer.from_crs(source, target, always_xy=True)
+
+def transformer(source, target) -> Transformer:
+    '''
+    Returns the transformer from one CRS to another (x/y order). Creating a transformer is expensive, so it is created
+    once per pair of CRS and reused
+    '''
+    return cachedTransformer(toCrs(source), toCrs(target))
+
+def transformCoordinates(x:np.ndarray, y:np.ndarray, source, target) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Transforms the coordinate arrays of many points at once with the cached transformer
+    '''
+    return transformer(source, target).transform(x, y)
+
+def clipperInCrs(clipper:gpd.GeoDataFrame, crs) -> gpd.GeoDataFrame:
+    '''
+    Returns the clipper in the given CRS. Only the clipper is transformed, so that the data can be clipped in its own CRS
+    '''
+    if crs is None or clipper.crs is None or sameCrs(clipper.crs, crs):
+        return clipper
+    return clipper.to_crs(crs)
+
+def clipAndReproject(gdf:gpd.GeoDataFrame, clipper:gpd.GeoDataFrame, crs=None, keep_geom_type=False) -> gpd.GeoDataFrame:
+    '''
+    Clips a Geodataframe in its own CRS with the clipper transformed to it and reprojects only the clipped features to the
+    target CRS (None keeps the CRS of the data)
+    '''
+    clipped = gdf.clip(clipperInCrs(clipper, gdf.crs), keep_geom_type=keep_geom_type)
+    if crs is None or sameCrs(clipped.crs, crs):
+        return clipped
+    return clipped.to_crs(crs)
+
+def alignedWindowGrid(src_crs, src_width:int, src_height:int, src_bounds:tuple, crs, bounds:tuple) -> tuple:
+    '''
+    Defines the grid of the window covering the bounds (minx, miny, maxx, maxy in the target CRS) of a raster reprojected to
+    the target CRS. The window is aligned to the grid of the whole reprojected raster, so its cells are the same as if the
+    whole raster was reprojected. Returns the affine transformation, width and height of the window
+    '''
+    transform, width, height = calculate_default_transform(src_crs, toCrs(crs), src_width, src_height, *src_bounds)
+    minx, miny, maxx, maxy = bounds
+    col_start = max(math.floor((minx - transform.c) / transform.a), 0)
+    col_stop = min(math.ceil((maxx - transform.c) / transform.a), width)
+    row_start = max(math.floor((transform.f - maxy) / -transform.e), 0)
+    row_stop = min(math.ceil((transform.f - miny) / -transform.e), height)
+    window_transform = transform * rasterio.Affine.translation(col_start, row_start)
+    return window_transform, max(col_stop - col_start, 1), max(row_stop - row_start, 1)
+
+def sourceWindow(src, crs, transform, width:int, height:int) -> Window:
+    '''
+    Returns the window of an opened raster that covers a grid in the target CRS, with a margin of WINDOW_MARGIN cells
+    '''
+    bounds = transform_bounds(toCrs(crs), src.crs, *rasterio.transform.array_bounds(height, width, transform), densify_pts=21)
+    window = from_bounds(*bounds, src.transform)
+    col_off, row_off = math.floor(window.col_off) - WINDOW_MARGIN, math.floor(window.row_off) - WINDOW_MARGIN
+    window = Window(col_off, row_off, math.ceil(window.width) + 2 * WINDOW_MARGIN + 1, math.ceil(window.height) + 2 * WINDOW_MARGIN + 1)
+    return window.intersection(Window(0, 0, src.width, src.height))
+
+def reprojectWindow(src, crs, bounds:tuple, resampling=Resampling.nearest, band:int=1) -> tuple[np.ma.MaskedArray, rasterio.Affine]:
+    '''
+    Reprojects only the part of an opened raster covering the bounds (minx, miny, maxx, maxy in the target CRS). Only the
+    source window covering the bounds is read. The grid of the result is aligned to the whole reprojected raster (see
+    alignedWindowGrid). Returns the values (dtype of the raster, nodata masked) and the affine transformation
+    '''
+    transform, width, height = alignedWindowGrid(src.crs, src.width, src.height, src.bounds, crs, bounds)
+    window = sourceWindow(src, crs, transform, width, height)
+
+    values = np.full((height, width), src.nodata if src.nodata is not None else 0, dtype=src.dtypes[band - 1])
+    reproject(src.read(band, window=window), values, src_transform=src.window_transform(window), src_crs=src.crs, src_nodata=src.nodata,
+              dst_transform=transform, dst_crs=toCrs(crs), dst_nodata=src.nodata, resampling=resampling)
+    values = np.ma.masked_equal(values, src.nodata) if src.nodata is not None else np.ma.masked_array(values)
+    return values, transform
+
+def clipAndReprojectRaster(raster, clipper:gpd.GeoDataFrame, crs=None, resampling=Resampling.nearest):
+    '''
+    Clips a raster opened with rioxarray in its own CRS with the clipper transformed to it, reprojects only the clipped part
+    to the target CRS (default: CRS of the clipper) on the grid of the whole reprojected raster (see alignedWindowGrid) and
+    clips it again with the clipper in the target CRS, so the cells are the same as if the whole raster was reprojected first
+    '''
+    crs = clipper.crs if crs is None else crs
+    clipper_src = clipperInCrs(clipper, raster.rio.crs)
+    if sameCrs(raster.rio.crs, crs):
+        return raster.rio.clip(clipper_src.geometry.values, clipper_src.crs, from_disk=True)
+
+    # all touched cells are kept in the source CRS, so the target cells at the edge of the clipper have their values
+    clipped = raster.rio.clip(clipper_src.geometry.values, clipper_src.crs, all_touched=True, from_disk=True)
+
+    clipper_dst = clipperInCrs(clipper, crs)
+    transform, width, height = alignedWindowGrid(raster.rio.crs, raster.rio.width, raster.rio.height, raster.rio.bounds(), crs, clipper_dst.total_bounds)
+    reprojected = clipped.rio.reproject(toCrs(crs), shape=(height, width), transform=transform, resampling=resampling)
+    return reprojected.rio.clip(clipper_dst.geometry.values, clipper_dst.crs)
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+from common.cache import fileHash
+
+# file name of the manifest in an output directory
+MANIFEST_NAME = ".manifest.json"
+
+def manifestPath(directory:str, name:str = None) -> str:
+    '''
+    Returns the path of the manifest of an output directory. Scripts sharing an output directory use their name, so that
+    each of them writes its own manifest
+    '''
+    return os.path.join(directory, f".{name}{MANIFEST_NAME}" if name else MANIFEST_NAME)
+
+def readManifest(directory:str, name:str = None) -> dict:
+    '''
+    Reads the manifest of an output directory: the dependencies of every output recorded with recordOutput
+    '''
+    path = manifestPath(directory, name)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as jsonFile:
+        return json.load(jsonFile)
+
+def writeManifest(directory:str, manifest:dict, name:str = None) -> None:
+    '''
+    Saves the manifest of an output directory
+    '''
+    os.makedirs(directory, exist_ok=True)
+    path = manifestPath(directory, name)
+    tmpPath = f"{path}.tmp"
+    with open(tmpPath, "w") as jsonFile:
+        json.dump(manifest, jsonFile, indent=1, sort_keys=True)
+    os.replace(tmpPath, path)
+
+def configHash(config:dict) -> str:
+    '''
+    Hashes the config an output depends on (e.g. resolution, CRS, processing options)
+    '''
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+def fileDigest(path:str, known:dict = None) -> dict:
+    '''
+    Returns size, modification time and sha256 hash of the content of a file. \n
+    The hash of a known digest is reused if size and modification time did not change, so unchanged files are not read again
+    '''
+    stat = os.stat(path)
+    digest = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if known and known.get("size") == digest["size"] and known.get("mtime") == digest["mtime"]:
+        digest["sha256"] = known["sha256"]
+    else:
+        digest["sha256"] = fileHash(path)
+    return digest
+
+def dependencyRecord(inputs:list, config:dict, previous:dict = None) -> dict:
+    '''
+    Creates the record of the dependencies of an output: the content hashes of all input files and the hash of the config
+    '''
+    knownInputs = (previous or {}).get("inputs", {})
+    digests = {}
+    for path in inputs:
+        path = os.path.abspath(path)
+        digests[path] = fileDigest(path, knownInputs.get(path))
+    return {"inputs": digests, "config": configHash(config)}
+
+def sameContent(record:dict, other:dict) -> bool:
+    '''
+    Compares two dependency records by the content hashes of the inputs and the config hash
+    '''
+    if record["config"] != other["config"] or record["inputs"].keys() != other["inputs"].keys():
+        return False
+    return all(record["inputs"][path]["sha256"] == other["inputs"][path]["sha256"] for path in record["inputs"])
+
+def isUpToDate(manifest:dict, output:str, inputs:list, config:dict) -> bool:
+    '''
+    Checks if an output exists, was not changed since it was recorded and the content of its inputs and its config did not change
+    '''
+    output = os.path.abspath(output)
+    entry = manifest.get(output)
+    if entry is None or not os.path.exists(output):
+        return False
+
+    stat = os.stat(output)
+    if entry["output"] != {"size": stat.st_size, "mtime": stat.st_mtime_ns}:
+        return False
+
+    # hashes of unchanged inputs are reused from the manifest
+    record = dependencyRecord(inputs, config, entry)
+    if not sameContent(record, entry):
+        return False
+
+    # keep the new modification times of inputs that were only touched
+    entry["inputs"] = record["inputs"]
+    return True
+
+def recordOutput(manifest:dict, output:str, inputs:list, config:dict) -> None:
+    '''
+    Records the dependencies of an output after it was written
+    '''
+    output = os.path.abspath(output)
+    record = dependencyRecord(inputs, config, manifest.get(output))
+    stat = os.stat(output)
+    record["output"] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    manifest[output] = record
+
+def outputsUpToDate(manifest:dict, outputs:list, inputs:list, config:dict) -> bool:
+    '''
+    Checks if all outputs created together from the same inputs and config are up to date (see isUpToDate)
+    '''
+    return all(isUpToDate(manifest, output, inputs, config) for output in outputs)
+
+def recordOutputs(manifest:dict, outputs:list, inputs:list, config:dict) -> None:
+    '''
+    Records the dependencies of several outputs created together from the same inputs and config
+    '''
+    for output in outputs:
+        recordOutput(manifest, output, inputs, config)
@@ -0,0 +1,190 @@
+import math
+import numpy as np
+import geopandas as gpd
+import shapely
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.features import rasterize
+from rasterio.windows import Window
+import rasterio.windows
+from contextlib import ExitStack
+from typing import NamedTuple
+
+# creation options for all GeoTiffs written by the rasterisation engine
+GTIFF_PROFILE = {
+    "driver": "GTiff",
+    "tiled": True,
+    "blockxsize": 256,
+    "blockysize": 256,
+    "compress": "deflate",
+}
+
+class RasterGrid(NamedTuple):
+    '''
+    Grid definition shared by all rasters of one rasterisation
+    '''
+    transform: rasterio.Affine
+    width: int
+    height: int
+    crs: object
+
+def gridFromBounds(bounds:tuple, resolution:float, crs) -> RasterGrid:
+    '''
+    Defines a raster grid with a given resolution from the bounds (minx, miny, maxx, maxy), e.g. gdf.total_bounds
+    '''
+    minx, miny, maxx, maxy = bounds
+    width = int((maxx - minx) / resolution)
+    height = int((maxy - miny) / resolution)
+    transform = from_origin(minx, maxy, resolution, resolution)
+    return RasterGrid(transform, width, height, crs)
+
+def valueArray(gdf:gpd.GeoDataFrame, column:str, dtype:str, nodata:float) -> np.ndarray:
+    '''
+    Converts a column to an array of the given dtype. NaN values are replaced with nodata and values are rounded for integer dtypes
+    '''
+    values = gdf[column].to_numpy(dtype="float64", na_value=np.nan)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        values = np.round(values)
+    return np.where(np.isnan(values), nodata, values).astype(dtype)
+
+def blockWindows(grid:RasterGrid, block_size:int):
+    '''
+    Iterates over the grid in square blocks of block_size cells (smaller at the right and bottom edge)
+    '''
+    for row_off in range(0, grid.height, block_size):
+        for col_off in range(0, grid.width, block_size):
+            yield Window(col_off, row_off, min(block_size, grid.width - col_off), min(block_size, grid.height - row_off))
+
+def boundsWindow(grid:RasterGrid, bounds:tuple) -> Window:
+    '''
+    Returns the window of whole cells of the grid covering the bounds (minx, miny, maxx, maxy), limited to the grid.
+    None is returned if the bounds do not overlap the grid
+    '''
+    window = rasterio.windows.from_bounds(*bounds, transform=grid.transform)
+    col_start, row_start = max(math.floor(window.col_off), 0), max(math.floor(window.row_off), 0)
+    col_stop = min(math.ceil(window.col_off + window.width), grid.width)
+    row_stop = min(math.ceil(window.row_off + window.height), grid.height)
+    if col_stop <= col_start or row_stop <= row_start:
+        return None
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+def rasteriseIndex(geometries:np.ndarray, grid:RasterGrid, all_touched=False, window:Window=None, tree:shapely.STRtree=None) -> np.ndarray:
+    '''
+    Burns the position of each geometry into the grid (-1 where no geometry is present). \n
+    Later geometries overwrite earlier ones, as in a rasterisation of the values themselves.
+    If a window is given, only this block of the grid is rasterised with the geometries intersecting it (queried from the spatial index tree).
+    '''
+    if window is None:
+        shape = (grid.height, grid.width)
+        transform = grid.transform
+        positions = np.arange(len(geometries))
+    else:
+        shape = (int(window.height), int(window.width))
+        transform = rasterio.windows.transform(window, grid.transform)
+        tree = tree if tree is not None else shapely.STRtree(geometries)
+        # keep the original order of the geometries so that later geometries still win
+        positions = np.sort(tree.query(shapely.box(*rasterio.windows.bounds(window, grid.transform)), predicate="intersects"))
+
+    candidates = geometries[positions]
+    positions = positions[~(shapely.is_missing(candidates) | shapely.is_empty(candidates))]
+    if len(positions) == 0:
+        return np.full(shape, -1, dtype="int32")
+
+    return rasterize(
+        zip(geometries[positions], positions.tolist()),
+        out_shape=shape,
+        transform=transform,
+        fill=-1,
+        all_touched=all_touched,
+        dtype="int32"
+    )
+
+def fillFromIndex(index:np.ndarray, values:np.ndarray, fill=0, replace:dict=None) -> np.ndarray:
+    '''
+    Creates a raster from the burned positions and the value array of a column, optionally replacing values (old value: new value)
+    '''
+    raster = np.full(index.shape, fill, dtype=values.dtype)
+    covered = index >= 0
+    raster[covered] = values[index[covered]]
+    for old, new in (replace or {}).items():
+        raster[raster == old] = new
+    return raster
+
+def rasteriseColumns(gdf:gpd.GeoDataFrame, columns:list, grid:RasterGrid, dtypes=None, fill=0, nodata=-9999, all_touched=False, replace:dict=None) -> dict:
+    '''
+    Rasterises several columns of a Geodataframe onto the same grid in one pass. \n
+    The geometries are rasterised only once and every column is filled from that rasterisation.
+    Cells not covered by a geometry receive the fill value, features with NaN values receive nodata.
+    dtypes is a dictionary with the dtype per column (default int16), replace a dictionary of values to replace afterwards.
+    '''
+    dtypes = dtypes or {}
+    index = rasteriseIndex(gdf.geometry.values, grid, all_touched=all_touched)
+
+    rasters = {}
+    for column in columns:
+        values = valueArray(gdf, column, dtypes.get(column, "int16"), nodata)
+        rasters[column] = fillFromIndex(index, values, fill=fill, replace=replace)
+
+    return rasters
+
+def writeRasters(rasters:dict, grid:RasterGrid, outputs, nodata=-9999, multiband=False) -> None:
+    '''
+    Saves rasters as tiled and compressed GeoTiffs with the shared grid definition. \n
+    outputs is either a dictionary with one output path per raster or, with multiband=True, a single path
+    in which every raster is written as a band (described with its name).
+    '''
+    profile = dict(GTIFF_PROFILE, width=grid.width, height=grid.height, transform=grid.transform, crs=grid.crs, nodata=nodata)
+
+    if multiband:
+        dtype = np.result_type(*rasters.values())
+        with rasterio.open(outputs, "w", count=len(rasters), dtype=dtype, **profile) as dst:
+            for band, (name, raster) in enumerate(rasters.items(), start=1):
+                dst.write(raster.astype(dtype, copy=False), band)
+                dst.set_band_description(band, name)
+        return
+
+    for name, raster in rasters.items():
+        with rasterio.open(outputs[name], "w", count=1, dtype=raster.dtype, **profile) as dst:
+            dst.write(raster, 1)
+
+def rasteriseToGeoTiff(gdf:gpd.GeoDataFrame, columns:list, grid:RasterGrid, outputs, dtypes=None, fill=0, nodata=-9999, all_touched=False, multiband=False, replace:dict=None, block_size:int=None) -> None:
+    '''
+    Rasterises several columns of a Geodataframe in one pass and saves them as GeoTiffs (see rasteriseColumns and writeRasters). \n
+    With a block_size the grid is processed block by block (see rasteriseToGeoTiffWindowed).
+    '''
+    if block_size is not None:
+        rasteriseToGeoTiffWindowed(gdf, columns, grid, outputs, dtypes=dtypes, fill=fill, nodata=nodata, all_touched=all_touched, multiband=multiband, replace=replace, block_size=block_size)
+        return
+
+    rasters = rasteriseColumns(gdf, columns, grid, dtypes=dtypes, fill=fill, nodata=nodata, all_touched=all_touched, replace=replace)
+    writeRasters(rasters, grid, outputs, nodata=nodata, multiband=multiband)
+
+def rasteriseToGeoTiffWindowed(gdf:gpd.GeoDataFrame, columns:list, grid:RasterGrid, outputs, dtypes=None, fill=0, nodata=-9999, all_touched=False, multiband=False, replace:dict=None, block_size:int=4096) -> None:
+    '''
+    Rasterises several columns of a Geodataframe block by block and writes each block directly into the GeoTiffs. \n
+    Only the geometries intersecting a block are selected with a spatial index and rasterised,
+    so the memory needed is bounded by the block size and not by the size of the domain.
+    The result is the same as with rasteriseToGeoTiff.
+    '''
+    dtypes = dtypes or {}
+    geometries = gdf.geometry.values
+    tree = shapely.STRtree(geometries)
+    values = {column: valueArray(gdf, column, dtypes.get(column, "int16"), nodata) for column in columns}
+    profile = dict(GTIFF_PROFILE, width=grid.width, height=grid.height, transform=grid.transform, crs=grid.crs, nodata=nodata)
+
+    with ExitStack() as stack:
+        # output bands as (dataset, band index) for each column
+        if multiband:
+            dtype = np.result_type(*values.values())
+            dst = stack.enter_context(rasterio.open(outputs, "w", count=len(columns), dtype=dtype, **profile))
+            bands = {column: (dst, band) for band, column in enumerate(columns, start=1)}
+            for column, (dst, band) in bands.items():
+                dst.set_band_description(band, column)
+        else:
+            bands = {column: (stack.enter_context(rasterio.open(outputs[column], "w", count=1, dtype=values[column].dtype, **profile)), 1) for column in columns}
+
+        for window in blockWindows(grid, block_size):
+            index = rasteriseIndex(geometries, grid, all_touched=all_touched, window=window, tree=tree)
+            for column, (dst, band) in bands.items():
+                block = fillFromIndex(index, values[column], fill=fill, replace=replace)
+                dst.write(block.astype(dst.dtypes[band - 1], copy=False), band, window=window)
@@ -0,0 +1,106 @@
+import os
+import geopandas as gpd
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# GeoParquet needs pyarrow, otherwise GeoPackage is used as intermediate format
+try:
+    import pyarrow
+    VECTOR_FORMAT = "parquet"
+except ImportError:
+    VECTOR_FORMAT = "gpkg"
+
+# file extensions of the supported vector formats
+EXTENSIONS = {"parquet": ".parquet", "gpkg": ".gpkg", "shp": ".shp"}
+
+# number of features per row group of GeoParquet files, each row group can be skipped by a bbox filter
+ROW_GROUP_SIZE = 50000
+
+def vectorPath(directory:str, name:str, fmt:str = None) -> str:
+    '''
+    Returns the path of a vector file with the extension of the format (default: GeoParquet if pyarrow is installed, otherwise GeoPackage)
+    '''
+    return os.path.join(directory, name + EXTENSIONS[fmt or VECTOR_FORMAT])
+
+def vectorFormat(path:str) -> str:
+    '''
+    Returns the format of a vector file from its extension
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    for fmt, ext in EXTENSIONS.items():
+        if ext == extension:
+            return fmt
+    raise ValueError(f"unsupported vector format: {path}")
+
+def writeVector(gdf:gpd.GeoDataFrame, path:str, row_group_size:int = ROW_GROUP_SIZE) -> None:
+    '''
+    Saves a Geodataframe in the format given by the extension of the path. \n
+    GeoParquet files are written with a bbox column, so that readVector can skip row groups outside of a bbox
+    '''
+    fmt = vectorFormat(path)
+    if fmt == "parquet":
+        gdf.to_parquet(path, index=False, write_covering_bbox=True, row_group_size=row_group_size)
+    elif fmt == "gpkg":
+        gdf.to_file(path, driver="GPKG")
+    else:
+        gdf.to_file(path)
+
+def readVector(path:str, columns:list = None, bbox:tuple = None) -> gpd.GeoDataFrame:
+    '''
+    Reads a vector file, optionally only the given columns and the features intersecting bbox (minx, miny, maxx, maxy). \n
+    GeoParquet files are read with pyarrow, which only loads the requested columns and the row groups intersecting bbox
+    '''
+    if columns is not None and "geometry" not in columns:
+        columns = list(columns) + ["geometry"]
+    if bbox is not None:
+        bbox = tuple(bbox)
+
+    if vectorFormat(path) == "parquet":
+        return gpd.read_parquet(path, columns=columns, bbox=bbox)
+    return gpd.read_file(path, columns=columns, bbox=bbox)
+
+def datasetFiles(path:str) -> list:
+    '''
+    Returns all files of a vector dataset, for a Shapefile also its attribute, index and projection files
+    '''
+    if vectorFormat(path) != "shp":
+        return [path]
+    base = os.path.splitext(path)[0]
+    return [path] + [base + ext for ext in (".dbf", ".shx", ".prj", ".cpg") if os.path.exists(base + ext)]
+
+def readVectorFiles(paths:list, columns:list = None, bbox:tuple = None, workers:int = None) -> gpd.GeoDataFrame:
+    '''
+    Reads several vector files concurrently in a thread pool and concatenates them once in the order of paths. \n
+    columns and bbox are applied to each read (see readVector), so features outside bbox are never loaded
+    '''
+    if not paths:
+        return gpd.GeoDataFrame()
+
+    # reading is mostly I/O and GDAL/pyarrow release the GIL, so threads are sufficient
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(lambda path: readVector(path, columns, bbox), paths))
+
+    return pd.concat(frames, ignore_index=True)
+
+def listVectorFiles(directory:str, formats:tuple = ("parquet", "gpkg", "shp")) -> list:
+    '''
+    Returns the sorted paths of the vector files of the given formats in a directory. 
+
+    A dataset saved in several formats (same name, e.g. after switching vector_format) is only listed once, in the first of
+    the formats, so that it is not read twice
+    '''
+    precedence = {EXTENSIONS[fmt]: rank for rank, fmt in enumerate(formats)}
+    datasets = {}
+    for file in os.listdir(directory):
+        name, extension = os.path.splitext(file)
+        rank = precedence.get(extension.lower())
+        if rank is not None:
+            datasets.setdefault(name, []).append((rank, file))
+
+    paths = []
+    for name, files in datasets.items():
+        files.sort()
+        if len(files) > 1:
+            print(f"{name} is saved in several formats, only {files[0][1]} is read")
+        paths.append(os.path.join(directory, files[0][1]))
+    return sorted(paths)
@@ -0,0 +1,203 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import NamedTuple
+
+# shared modules of this repository
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_PATH)
+from common.cache import fileHash, sourceIdentity
+from common.config import readConfig
+
+class Step(NamedTuple):
+    '''
+    A preprocessing step: the script (relative to the repository), the steps whose outputs it reads and the config entries
+    that are outputs or caches of the step (their content is not part of the fingerprint of the step)
+    '''
+    script: str
+    after: tuple = ()
+    outputs: tuple = ()
+
+# all steps and their dependencies, the R scripts of trees2PALM (clip_laz.R, tree_detection.R) between build_tree_mask
+# and process_tree_data are not run by the runner
+STEPS = {
+    "xyz2tiff": Step("xyz2tiff/xyz2tiff.py"),
+    "citygml2gpd": Step("citygml2gpd/citygml2gpd.py", outputs=("outDir",)),
+    "alkis2PALM": Step("alkis2PALM/alkis2PALM.py", outputs=("outpath", "cache_path", "sidecar_path", "layer_path")),
+    "clc2PALM": Step("clc2PALM/clc2PALM.py", outputs=("outpath", "cache_path")),
+    "soil2PALM": Step("soil2PALM/soil2PALM.py", outputs=("outpath", "cache_path")),
+    "buildings2PALM": Step("buildings2PALM/buildings2PALM.py", after=("citygml2gpd",), outputs=("outpath", "cache_path")),
+    "build_tree_mask": Step("trees2PALM/build_tree_mask.py", after=("citygml2gpd",), outputs=("outpath",)),
+    "process_tree_data": Step("trees2PALM/process_tree_data.py", after=("xyz2tiff", "build_tree_mask"), outputs=("chm_path",)),
+}
+
+def dependencies(steps:dict) -> dict:
+    '''
+    Returns the dependencies of each configured step, dependencies that are not configured are regarded as done
+    '''
+    unknown = [name for name in steps if name not in STEPS]
+    if unknown:
+        raise KeyError(f"unknown steps: {', '.join(unknown)}")
+    return {name: [dependency for dependency in STEPS[name].after if dependency in steps] for name in steps}
+
+def ancestors(name:str, graph:dict) -> set:
+    '''
+    Returns all steps a step depends on directly or indirectly
+    '''
+    found = set()
+    todo = list(graph[name])
+    while todo:
+        dependency = todo.pop()
+        if dependency not in found:
+            found.add(dependency)
+            todo.extend(graph[dependency])
+    return found
+
+def outputPaths(name:str, stepConfig:dict) -> list:
+    '''
+    Returns the absolute output and cache paths of a step config
+    '''
+    return [os.path.abspath(stepConfig[key]) for key in STEPS[name].outputs if stepConfig.get(key)]
+
+def pathIdentity(path:str, excluded:list) -> list:
+    '''
+    Identifies a file or all files of a directory (recursively) by path, size and modification time. Directories in excluded are skipped
+    '''
+    if os.path.isfile(path):
+        return [sourceIdentity(path)]
+
+    identities = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) not in excluded)
+        identities.extend(sourceIdentity(os.path.join(root, file)) for file in sorted(files))
+    return identities
+
+def stepFingerprint(name:str, config:dict, graph:dict) -> str:
+    '''
+    Hashes the script, the step config, the domain and all input files and directories of the step config. \n
+    Outputs of the step itself and of steps that are not upstream of it are excluded, so that steps writing into shared
+    directories do not invalidate each other
+    '''
+    steps, domain = config["steps"], config.get("domain", {})
+    stepConfig = steps[name]
+    excluded = [path for other in steps if other == name or other not in ancestors(name, graph) for path in outputPaths(other, steps[other])]
+
+    inputs = {}
+    for key, value in {**domain, **stepConfig}.items():
+        if key not in STEPS[name].outputs and isinstance(value, str) and os.path.exists(value):
+            inputs[key] = pathIdentity(value, excluded)
+
+    fingerprint = {
+        "script": fileHash(os.path.join(REPO_PATH, STEPS[name].script)),
+        "domain": domain,
+        "config": stepConfig,
+        "inputs": inputs,
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+def readState(stateFile:str) -> dict:
+    '''
+    Reads the fingerprints of the last successful run of each step
+    '''
+    if not os.path.exists(stateFile):
+        return {}
+    with open(stateFile) as jsonFile:
+        return json.load(jsonFile)
+
+def writeState(stateFile:str, state:dict) -> None:
+    '''
+    Saves the fingerprints of the last successful run of each step
+    '''
+    tmpPath = f"{stateFile}.tmp"
+    with open(tmpPath, "w") as jsonFile:
+        json.dump(state, jsonFile, indent=2)
+    os.replace(tmpPath, stateFile)
+
+def runStep(name:str, stepConfig:dict, domain:dict) -> float:
+    '''
+    Imports the script of a step in a worker process and calls its run function with the step config and the domain. Returns the runtime
+    '''
+    script = os.path.join(REPO_PATH, STEPS[name].script)
+    sys.path.insert(0, os.path.dirname(script))
+    module = importlib.import_module(os.path.splitext(os.path.basename(script))[0])
+
+    start = time.perf_counter()
+    module.run({"domain": domain, **stepConfig})
+    return time.perf_counter() - start
+
+def runDomain(config:dict, stateFile:str, workers:int = None, force:bool = False) -> dict:
+    '''
+    Runs all steps of a config in the order of their dependencies. Independent steps run concurrently in a process pool. \n
+    A step is skipped if its fingerprint (see stepFingerprint) did not change since its last successful run and none of its
+    dependencies was run. Steps depending on a failed step are not run. Returns the status of each step
+    '''
+    steps, domain = config["steps"], config.get("domain", {})
+    graph = dependencies(steps)
+    state = readState(stateFile)
+    status = {}
+    pending = set(steps)
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                if any(status.get(dependency) in ("failed", "blocked") for dependency in graph[name]):
+                    pending.discard(name)
+                    status[name] = "blocked"
+                    print(f"blocked {name}: a dependency failed")
+                elif all(dependency in status for dependency in graph[name]):
+                    pending.discard(name)
+                    upstreamRun = any(status[dependency] == "done" for dependency in graph[name])
+                    if not force and not upstreamRun and state.get(name, {}).get("fingerprint") == stepFingerprint(name, config, graph):
+                        status[name] = "skipped"
+                        print(f"skipped {name}: inputs and config unchanged")
+                    else:
+                        print(f"started {name}")
+                        running[executor.submit(runStep, name, steps[name], domain)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    status[name] = "failed"
+                    print(f"failed {name}: {e!r}")
+                    continue
+
+                # the fingerprint is taken after the run, so outputs written into the input directories are part of it
+                status[name] = "done"
+                state[name] = {"fingerprint": stepFingerprint(name, config, graph), "seconds": round(seconds, 1), "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+                writeState(stateFile, state)
+                print(f"finished {name} in {seconds:.1f} s")
+
+    return status
+
+def parseArguments() -> argparse.Namespace:
+    '''
+    Reads the command line arguments of the runner
+    '''
+    parser = argparse.ArgumentParser(description="Runs the preprocessing steps for a PALM domain defined in a json config.")
+    parser.add_argument("config", help="run config (json file) with the domain and the configuration of each step")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of steps running at the same time (default: number of CPUs)")
+    parser.add_argument("--state", default=None, help="file with the fingerprints of the last runs (default: .run_state.json next to the config)")
+    parser.add_argument("--force", action="store_true", help="run all steps, even if their inputs and config are unchanged")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parseArguments()
+    config = readConfig(args.config)
+    stateFile = args.state or config.get("state_file") or os.path.join(os.path.dirname(os.path.abspath(args.config)), ".run_state.json")
+
+    status = runDomain(config, stateFile, workers=args.workers or config.get("workers"), force=args.force)
+
+    print(", ".join(f"{name}: {result}" for name, result in status.items()))
+    sys.exit(1 if any(result in ("failed", "blocked") for result in status.values()) else 0)
@@ -1,59 +1,69 @@
 import geopandas as gpd
 import pandas as pd
 import os
-import rasterio
-from rasterio.transform import from_origin
-from rasterio.features import rasterize
+import sys
 import numpy as np
 
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cachedClip
+from common.config import configure
+from common.crs import clipAndReproject
+from common.manifest import outputsUpToDate, readManifest, recordOutputs, writeManifest
+from common.vectorio import datasetFiles, vectorPath, writeVector
+from common.rasterise import gridFromBounds, rasteriseToGeoTiff
+
 # set data paths
 data_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/soil/ISBK50"
 keys_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/soil"
 outpath = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/soil/processed"
 
+# set input files and domain
+clip_file = "clip_clc.shp"
+soil_file = "BK50.shp"
+key_file = "BK50_PALM.csv"
+epsg = 25832
+resolution = 32.0
+
+# processing options
+# rasterise block by block with this block size (in cells) for domains larger than memory, None rasterises the whole grid at once
+block_size = None
+# directory to cache clipped inputs between runs (GeoParquet), None disables the cache
+cache_path = None
+# format of the vector outputs: "parquet" (GeoParquet), "gpkg" (GeoPackage) or "shp" (Shapefile)
+vector_format = "shp"
+# recompute the outputs, even if the manifest shows that their inputs and options did not change
+force = False
+
 # define functions
-def rasteriseSoil(gdf:gpd.GeoDataFrame,column:str,resolution:float,replace_na:int) -> None:
+def rasteriseSoil(gdf:gpd.GeoDataFrame,column:str,resolution:float,replace_na:int,block_size:int=None) -> None:
     '''
-    Rasterises the processed soil dataset with a desired resolution and converts to values to integer
+    Rasterises the processed soil dataset with a desired resolution and converts to values to integer \n
+    With a block_size the grid is rasterised and written block by block.
     '''
     output_raster_path = os.path.join(outpath,f"soil_palm_{column}.tif")
 
-    # Set the desired raster resolution and bounding box
-    pixel_size = resolution  # Adjust this according to your needs
-    minx, miny, maxx, maxy = gdf.total_bounds
-    width = int((maxx - minx) / pixel_size)
-    height = int((maxy - miny) / pixel_size)
-
-    # Define the raster transform
-    transform = from_origin(minx, maxy, pixel_size, pixel_size)
-
-    # Define the CRS
-    crs = gdf.crs
-
-    # Create a new raster file
-    with rasterio.open(output_raster_path, 'w', driver='GTiff', count=1, dtype='int16', width=width, height=height, transform=transform, crs=crs, nodata=-9999) as dst:
-        # Handle NaN values and round to integers
-        shapes = [
-            (geom, int(round(value)) if not np.isnan(value) else -9999)
-            for geom, value in zip(gdf.geometry, gdf[column])
-        ]
-        # Rasterize the GeoDataFrame into the new raster
-        raster = rasterize(shapes, out_shape=(height, width), transform=transform)
-
-        # change nodata values as no missing values should be present
-        raster[raster == 0] = replace_na
-        
-        # Write the raster data to the output raster
-        dst.write(raster, 1)
-
-def translateSoil(clip_file:str, soil_file:str, key_file:str,epsg=25832) -> gpd.GeoDataFrame:
+    # Define the raster grid from the extent of the soil data
+    grid = gridFromBounds(gdf.total_bounds, resolution, gdf.crs)
+
+    # Rasterise and write, features without a value are set to nodata
+    # change nodata values (0) as no missing values should be present
+    rasteriseToGeoTiff(gdf, [column], grid, {column: output_raster_path}, fill=0, nodata=-9999, replace={0: replace_na}, block_size=block_size)
+
+def translateSoil(clip_file:str, soil_file:str, key_file:str,epsg=25832,cache_dir:str=None) -> gpd.GeoDataFrame:
     '''
-    This function translates the soil data from NRW (BK50) to PALM classes
+    This function translates the soil data from NRW (BK50) to PALM classes \n
+    With a cache directory, the clipped soil data is read from the cache as long as the soil file and the clipper did not change
     '''
     # read and clip data
     clipper = gpd.read_file(os.path.join(data_path,clip_file))
-    soil = gpd.read_file(os.path.join(data_path, soil_file), mask = clipper)
-    soil = soil.clip(clipper)
+
+    def readSoil() -> gpd.GeoDataFrame:
+        # clip in the CRS of the soil data with the clipper transformed to it, the soil data keeps its CRS
+        soil = gpd.read_file(os.path.join(data_path, soil_file), mask = clipper)
+        return clipAndReproject(soil, clipper)
+
+    soil = cachedClip(readSoil, os.path.join(data_path, soil_file), None, clipper, None, cache_dir)
 
     # read translation table
     keys = pd.read_csv(os.path.join(keys_path,key_file))
@@ -64,15 +74,38 @@ def translateSoil(clip_file:str, soil_file:str, key_file:str,epsg=25832) -> gpd.
     # return geodataframe
     return soil_palm
 
-# read and translate soil
-soil_palm = translateSoil("clip_clc.shp","BK50.shp","BK50_PALM.csv")
+def run(config:dict = None) -> None:
+    '''
+    Translates the soil data to PALM soil types and rasterises them. \n
+    The data paths and processing options of this script can be overridden with a step config (see runner/run_domain.py)
+    '''
+    configure(globals(), config)
+
+    # skip the translation if the outputs were created from the same inputs and options (manifest of outpath)
+    outputs = [vectorPath(outpath, "soil_palm", vector_format), os.path.join(outpath,"soil_palm_soil_type.tif")]
+    inputs = datasetFiles(os.path.join(data_path,clip_file)) + datasetFiles(os.path.join(data_path,soil_file)) + [os.path.join(keys_path,key_file)]
+    options = {"epsg": epsg, "resolution": resolution, "replace_na": 2}
+    manifest = readManifest(outpath, "soil2PALM")
+    if not force and outputsUpToDate(manifest, outputs, inputs, options):
+        print("soil outputs are up to date")
+        return
+
+    # read and translate soil
+    soil_palm = translateSoil(clip_file,soil_file,key_file,epsg=epsg,cache_dir=cache_path)
+
+    # keep only relevant columns
+    soil_palm = soil_palm[["ART","Text","soil_type","PALM_text","geometry"]]
+
+    # save vector data
+    writeVector(soil_palm, vectorPath(outpath, "soil_palm", vector_format))
+    print("saved vector data")
 
-# keep only relevant columns
-soil_palm = soil_palm[["ART","Text","soil_type","PALM_text","geometry"]]
+    # rasterise 
+    rasteriseSoil(soil_palm,"soil_type",resolution,replace_na=options["replace_na"],block_size=block_size)
 
-# save shapefile
-soil_palm.to_file(os.path.join(outpath,"soil_palm.shp"))
-print("saved shapefile")
+    # record the dependencies of the outputs
+    recordOutputs(manifest, outputs, inputs, options)
+    writeManifest(outpath, manifest, "soil2PALM")
 
-# rasterise 
-rasteriseSoil(soil_palm,"soil_type",32.0,replace_na=2)
\ No newline at end of file
+if __name__ == "__main__":
+    run()
\ No newline at end of file
@@ -1,24 +1,55 @@
 import geopandas as gpd
 import pandas as pd
 import os
+import sys
+import math
+import shapely
 from shapely.geometry import Polygon
+from concurrent.futures import ProcessPoolExecutor
+
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.config import configure
+from common.manifest import isUpToDate, readManifest, recordOutput, writeManifest
+from common.rasterise import gridFromBounds, rasteriseToGeoTiff
+from common.vectorio import datasetFiles, listVectorFiles, readVector, readVectorFiles, vectorPath, writeVector
 
 # set data paths
 build_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/test_area/buildings/shp"
 outpath = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/test_area/trees/mask"
 
+# processing options
+# format of the vector outputs: "parquet" (GeoParquet), "gpkg" (GeoPackage) or "shp" (Shapefile)
+vector_format = "shp"
+# create all tree masks, even if the manifest shows that their building files did not change
+force = False
+# create one tree mask for the whole domain tile by tile with this tile size (in m, e.g. 1000 for the LiDAR tiles),
+# None creates one tree mask per building file
+tile_size = None
+# number of processes creating the tiles of the tree mask, None uses the number of CPUs
+workers = None
+# with a tile size, also save the tree mask as raster with this resolution (in m, e.g. 1.0 for the LiDAR grid)
+mask_resolution = None
+
 def create_tree_mask(directory:str, outpath:str) -> gpd.GeoDataFrame:
     '''
-    Function to create a tree mask from a directory of building shapefiles.
-    Building geometries are simplified, buffered and dissolved by ID
+    Function to create a tree mask from a directory of building files (GeoParquet, GeoPackage or Shapefile).
+    Building geometries are simplified, buffered and dissolved by ID.
+    Tree masks whose building file did not change since they were created (manifest of outpath) are skipped
     '''
-    # Get a list of all building shapefiles in the directory
-    shapefile_list = [file for file in os.listdir(directory) if file.endswith(".shp")]
+    # Get a list of all building files in the directory
+    file_list = listVectorFiles(directory)
+    manifest = {} if force else readManifest(outpath)
+    config = {"vector_format": vector_format, "simplify": 1, "buffer": 1}
+
+    # Iterate over each file and read the GML IDs and geometries into a GeoDataFrame
+    for file in file_list:
+        name = os.path.splitext(os.path.basename(file))[0].replace("LoD2","tree_mask")
+        output = vectorPath(outpath, name, vector_format)
+        if isUpToDate(manifest, output, datasetFiles(file), config):
+            continue
 
-    # Iterate over each shapefile and read it into a GeoDataFrame
-    for shapefile in shapefile_list:
-        # Read the shapefile into a GeoDataFrame
-        gdf = gpd.read_file(os.path.join(directory, shapefile))
+        gdf = readVector(file, columns=["gml_id"])
 
         # create unique ID for each GML ID
         gdf["ID"] = gdf.groupby("gml_id").ngroup()
@@ -33,17 +64,102 @@ def create_tree_mask(directory:str, outpath:str) -> gpd.GeoDataFrame:
         build_extend = gpd.GeoDataFrame([1], geometry=[polygon], crs=gdf.crs)
 
         # simplify, buffer and dissolve building geometries
-        gdf.geometry = gdf.geometry.simplify(1)
-        gdf.geometry = gdf.geometry.buffer(1)
+        gdf.geometry = gdf.geometry.simplify(config["simplify"])
+        gdf.geometry = gdf.geometry.buffer(config["buffer"])
         gdf = gdf.dissolve(by='ID')
 
         # create tree mask from difference of building extent and buildings
         tree_mask = gpd.overlay(build_extend, gdf, how='difference')
 
-        # transform tree mask to geoseries
-        tree_mask_geom = tree_mask.geometry
+        # reduce tree mask to geometries
+        tree_mask_geom = tree_mask[["geometry"]]
 
-        # save tree mask
-        tree_mask_geom.to_file(os.path.join(outpath, shapefile.replace("LoD2","tree_mask")))
+        # save tree mask and record its dependencies
+        writeVector(tree_mask_geom, output)
+        recordOutput(manifest, output, datasetFiles(file), config)
+        writeManifest(outpath, manifest)
+
+def tile_boxes(bounds:tuple, tile_size:float) -> dict:
+    '''
+    Function to divide the extent of the buildings into square tiles aligned to multiples of the tile size (e.g. the 1 km LiDAR tiles).
+    Returns a dictionary of tile names ("<x>_<y>" of the lower left corner in tile units) and tile polygons clipped to the extent
+    '''
+    minx, miny, maxx, maxy = bounds
+    extent = shapely.box(minx, miny, maxx, maxy)
+    tiles = {}
+    for x in range(math.floor(minx / tile_size), math.ceil(maxx / tile_size)):
+        for y in range(math.floor(miny / tile_size), math.ceil(maxy / tile_size)):
+            tile = shapely.intersection(shapely.box(x * tile_size, y * tile_size, (x + 1) * tile_size, (y + 1) * tile_size), extent)
+            if not tile.is_empty and tile.area > 0:
+                tiles[f"{x}_{y}"] = tile
+    return tiles
+
+def tile_tree_mask(tile, buildings) -> object:
+    '''
+    Function to create the tree mask of one tile: the tile minus the union of the buildings intersecting it
+    '''
+    if len(buildings) == 0:
+        return tile
+    return shapely.difference(tile, shapely.union_all(buildings))
+
+def create_tree_mask_tiled(directory:str, outpath:str, tile_size:float=1000, workers:int=None, mask_resolution:float=None) -> gpd.GeoDataFrame:
+    '''
+    Function to create one tree mask for the whole domain from a directory of building files, tile by tile.
+    Building geometries are simplified and buffered, the tiles are processed in parallel (union of the buildings intersecting
+    a tile and difference with the tile), so no difference with one polygon of the whole extent is needed.
+    The tree mask is saved as one file with one polygon per tile (column "tile"), optionally also as raster (1 for the tree
+    mask, 0 for buildings) with the given resolution on the grid of the tiles. It is skipped if the building files did not change (manifest of outpath)
+    '''
+    file_list = listVectorFiles(directory)
+    inputs = [path for file in file_list for path in datasetFiles(file)]
+    manifest = {} if force else readManifest(outpath)
+    config = {"vector_format": vector_format, "simplify": 1, "buffer": 1, "tile_size": tile_size, "mask_resolution": mask_resolution}
+    output = vectorPath(outpath, "tree_mask", vector_format)
+    raster_output = os.path.join(outpath, "tree_mask.tif")
+    outputs = [output] + ([raster_output] if mask_resolution else [])
+    if all(isUpToDate(manifest, path, inputs, config) for path in outputs):
+        return readVector(output)
+
+    # read the buildings of all files, only the geometries are needed
+    buildings = readVectorFiles(file_list, columns=[], workers=workers)
+    geometries = shapely.buffer(shapely.simplify(buildings.geometry.values, config["simplify"]), config["buffer"])
+
+    # buildings intersecting each tile from a spatial index
+    tiles = tile_boxes(buildings.total_bounds, tile_size)
+    tree = shapely.STRtree(geometries)
+    jobs = {name: geometries[tree.query(tile, predicate="intersects")] for name, tile in tiles.items()}
+
+    # create the tree mask of each tile in parallel
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        masks = list(executor.map(tile_tree_mask, tiles.values(), jobs.values()))
+
+    tree_mask = gpd.GeoDataFrame({"tile": list(tiles)}, geometry=masks, crs=buildings.crs)
+    writeVector(tree_mask, output)
+
+    # rasterise the tree mask on a grid aligned to multiples of the resolution, e.g. the LiDAR grid
+    if mask_resolution:
+        minx, miny, maxx, maxy = buildings.total_bounds
+        bounds = (math.floor(minx / mask_resolution) * mask_resolution, math.floor(miny / mask_resolution) * mask_resolution,
+                  math.ceil(maxx / mask_resolution) * mask_resolution, math.ceil(maxy / mask_resolution) * mask_resolution)
+        grid = gridFromBounds(bounds, mask_resolution, buildings.crs)
+        rasteriseToGeoTiff(tree_mask.assign(mask=1), ["mask"], grid, {"mask": raster_output}, dtypes={"mask": "uint8"}, fill=0, nodata=255, block_size=4096)
+
+    # record the dependencies of the outputs
+    for path in outputs:
+        recordOutput(manifest, path, inputs, config)
+    writeManifest(outpath, manifest)
+    return tree_mask
+
+def run(config:dict = None) -> None:
+    '''
+    Creates the tree masks from the building files.
+    The data paths and processing options of this script can be overridden with a step config (see runner/run_domain.py)
+    '''
+    configure(globals(), config)
+    if tile_size:
+        create_tree_mask_tiled(build_path, outpath, tile_size, workers, mask_resolution)
+    else:
+        create_tree_mask(build_path, outpath)
 
-create_tree_mask(build_path, outpath)
\ No newline at end of file
+if __name__ == "__main__":
+    run()
\ No newline at end of file
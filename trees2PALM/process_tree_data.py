@@ -1,11 +1,27 @@
 import geopandas as gpd
 import pandas as pd
 import os
+import sys
 import rasterio
 from rasterstats import zonal_stats
 import rioxarray as rio
 import numpy as np
 from rasterio.features import geometry_mask
+from rasterio.enums import Resampling
+from rasterio.warp import transform_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.io import MemoryFile
+import rasterio.shutil
+import rasterio.windows
+import shapely
+
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import DEFAULT_MAX_BYTES, cacheKey, evict
+from common.config import configure
+from common.crs import reprojectWindow
+from common.rasterise import GTIFF_PROFILE, RasterGrid, blockWindows, boundsWindow, rasteriseIndex
+from common.vectorio import listVectorFiles, readVectorFiles
 
 ## data paths
 dem_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/test_area/dem"
@@ -14,17 +30,36 @@ lai_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/
 dsm_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/test_area/trees/dsm"
 chm_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/test_area/trees/chm"
 
-def combine_tree_files(directory:str) -> gpd.GeoDataFrame:
+## input files and domain
+lai_file = "VI_20200805T104031_S2A_T32ULC-010m_V101_LAI.tiff"
+dem_file = "tif/dem_city.tif"
+dsm_file = "processed/dom_city.tif"
+epsg = 25832
+
+## processing options
+# compute the canopy height model block by block with this block size (in cells), so that the memory needed does not depend
+# on the size of the domain (see create_chm_windowed), None reads the whole rasters at once
+block_size = None
+# engine of the zonal statistics of the LAI over the trees: "rasterstats" (feature by feature) or "bincount" (the trees
+# rasterised in layers of non-overlapping trees and reduced with vectorised grouped reductions, see zonal_stats_grouped)
+zonal_engine = "rasterstats"
+# reproject only the window of the LAI raster covering the trees instead of the whole tile (see prepare_lai_window)
+lai_window = False
+# directory to cache the reprojected LAI window (Cloud Optimized GeoTiff) between runs, None disables the cache
+cache_path = None
+# scale factor of the LAI values
+LAI_SCALE = 0.0008
+
+def combine_tree_files(directory:str, bbox:tuple=None, workers:int=None) -> gpd.GeoDataFrame:
     """
-    Combines all tree files in a directory to a single GeoDataFrame.
+    Combines all tree files (GeoParquet, GeoPackage or Shapefile) in a directory to a single GeoDataFrame.
+    The files are read concurrently and concatenated once.
     :param directory: path to directory containing tree files
+    :param bbox: optional bounding box (minx, miny, maxx, maxy), only trees intersecting it are read
+    :param workers: number of reading threads
     :return: GeoDataFrame containing all trees
     """
-    tree_files = [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith(".shp")]
-    trees = gpd.GeoDataFrame()
-    for file in tree_files:
-        trees = pd.concat([trees, gpd.read_file(file)], ignore_index=True)
-    return trees
+    return readVectorFiles(listVectorFiles(directory), bbox=bbox, workers=workers)
 
 def prepare_lai_raster(rasterDs:str, epsg=25832):
     """
@@ -36,11 +71,168 @@ def prepare_lai_raster(rasterDs:str, epsg=25832):
     lai_rast = lai_rast.rio.reproject(epsg)
 
     # get lai as array and affine of raster
-    lai = lai_rast.values * 0.0008
+    lai = lai_rast.values * LAI_SCALE
     lai_affine = lai_rast.rio.transform()
 
     return lai, lai_affine
 
+def non_overlapping_layers(geometries:np.ndarray) -> list:
+    """
+    Splits geometries into layers of geometries that do not intersect each other, so that each layer can be rasterised
+    without one geometry overwriting another. The intersecting pairs are queried once from a spatial index and each layer is
+    a maximal set of non-intersecting geometries of the remaining ones, selected with array operations on the pairs: in each
+    round the geometries without a remaining neighbour of a lower position join the layer and their neighbours are excluded.
+    :param geometries: array of shapely geometries
+    :return: list of arrays with the positions of the geometries of each layer
+    """
+    tree = shapely.STRtree(geometries)
+    i, j = tree.query(geometries, predicate="intersects")
+    distinct = i != j
+    i, j = i[distinct], j[distinct]
+
+    layers = []
+    remaining = np.ones(len(geometries), dtype=bool)
+    while remaining.any():
+        # pairs of geometries that are both still without a layer
+        pairs = remaining[i] & remaining[j]
+        i, j = i[pairs], j[pairs]
+
+        candidate = remaining.copy()
+        layer = np.zeros(len(geometries), dtype=bool)
+        ci, cj = i, j
+        while candidate.any():
+            # a candidate joins the layer if none of its candidate neighbours has a lower position
+            blocked = np.zeros(len(geometries), dtype=bool)
+            blocked[ci[cj < ci]] = True
+            joins = candidate & ~blocked
+            layer |= joins
+            candidate &= ~joins
+            candidate[cj[joins[ci]]] = False
+            pairs = candidate[ci] & candidate[cj]
+            ci, cj = ci[pairs], cj[pairs]
+
+        layers.append(np.flatnonzero(layer))
+        remaining &= ~layer
+
+    return layers
+
+def zonal_stats_grouped(trees:gpd.GeoDataFrame, values:np.ndarray, affine, nodata=None) -> gpd.GeoDataFrame:
+    """
+    Calculates the mean, median and max of a raster for each tree and attaches them as columns to a copy of the trees.
+    The positions of the trees are rasterised onto the grid of the raster and the statistics of all trees are calculated
+    with grouped reductions (bincount for the mean, one sort for median and max) instead of feature by feature.
+    Overlapping trees are rasterised in separate layers (see non_overlapping_layers), so a cell covered by several trees is
+    counted for each of them. Each layer is rasterised only in the window of the raster covering its trees. As with rasterstats, only cells whose centre lies within a tree are used and nodata and NaN
+    cells are ignored. Trees without cells get NaN.
+    :param trees: GeoDataFrame with the tree polygons (in the CRS of the raster)
+    :param values: raster values as 2D array
+    :param affine: affine transformation of the raster
+    :param nodata: nodata value of the raster
+    :return: GeoDataFrame of the trees with the columns mean, median and max
+    """
+    grid = RasterGrid(affine, values.shape[1], values.shape[0], trees.crs)
+    geometries = trees.geometry.values
+    usable = ~np.isnan(values)
+    if nodata is not None:
+        usable &= values != nodata
+
+    # (tree, value) pairs of the cells of each layer of non-overlapping trees, each layer is rasterised only in the window
+    # covering its trees
+    ids, cells = [], []
+    for positions in non_overlapping_layers(geometries):
+        layer = geometries[positions]
+        present = ~(shapely.is_missing(layer) | shapely.is_empty(layer))
+        if not present.any():
+            continue
+        window = boundsWindow(grid, shapely.total_bounds(layer[present]))
+        if window is None:
+            continue
+        window_grid = RasterGrid(rasterio.windows.transform(window, affine), int(window.width), int(window.height), grid.crs)
+        index = rasteriseIndex(layer, window_grid)
+        rows, columns = window.toslices()
+        valid = (index >= 0) & usable[rows, columns]
+        ids.append(positions[index[valid]])
+        cells.append(values[rows, columns][valid])
+    ids = np.concatenate(ids) if ids else np.empty(0, dtype="int64")
+    values = np.concatenate(cells).astype("float64") if cells else np.empty(0)
+
+    # mean from the sums and counts of the cells of each tree
+    count = np.bincount(ids, minlength=len(trees))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(ids, weights=values, minlength=len(trees)) / count
+
+    # median and max from the values sorted by tree and value
+    order = np.lexsort((values, ids))
+    values = values[order]
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    found = count > 0
+    median = np.full(len(trees), np.nan)
+    maximum = np.full(len(trees), np.nan)
+    lower = start[found] + (count[found] - 1) // 2
+    upper = start[found] + count[found] // 2
+    median[found] = (values[lower] + values[upper]) / 2
+    maximum[found] = values[start[found] + count[found] - 1]
+
+    return trees.assign(mean=mean, median=median, max=maximum)
+
+def prepare_lai_window(rasterDs:str, bounds:tuple, epsg=25832, cache_dir:str=None):
+    """
+    Prepares the LAI raster for zonal statistics like prepare_lai_raster, but reprojects only the window covering the trees.
+    Only the part of the tile covering the window is read and reprojected (see common/crs.py). The window is aligned to the
+    grid of the whole reprojected tile, so its cells are the same as with prepare_lai_raster (the values can differ for a few
+    cells, since GDAL approximates the transformation per chunk of the output). The reprojected window keeps the
+    dtype of the tile and the scale factor is only applied to the returned array (float32).
+    With a cache directory, the reprojected window is saved as tiled, compressed Cloud Optimized GeoTiff, keyed on the LAI
+    tile, the bounds and the target CRS, and read from there in later runs.
+    :param rasterDs: file name of the LAI raster in lai_path
+    :param bounds: bounds of the trees (minx, miny, maxx, maxy) in the target CRS
+    :param epsg: EPSG code of the target CRS
+    :param cache_dir: directory of the cache, None disables the cache
+    :return: scaled LAI values (NaN for nodata) and affine transformation of the window
+    """
+    source = os.path.join(lai_path, rasterDs)
+    if not np.all(np.isfinite(bounds)):
+        raise ValueError(f"the trees have no valid bounds (e.g. no trees were found), so no window of the LAI tile {source} can be prepared")
+    cached = None
+    if cache_dir is not None:
+        domain = gpd.GeoDataFrame(geometry=[shapely.box(*bounds)], crs=epsg)
+        cached = os.path.join(cache_dir, f"{cacheKey(source, 'LAI', domain, epsg)}.tif")
+
+    if cached is None or not os.path.exists(cached):
+        with rasterio.open(source) as src:
+            tile_bounds = transform_bounds(src.crs, f"EPSG:{epsg}", *src.bounds, densify_pts=21)
+            if not (bounds[0] < tile_bounds[2] and bounds[2] > tile_bounds[0] and bounds[1] < tile_bounds[3] and bounds[3] > tile_bounds[1]):
+                raise ValueError(f"the trees (bounds {tuple(round(float(v), 1) for v in bounds)}) do not intersect the LAI tile {source} "
+                                 f"(bounds {tuple(round(v, 1) for v in tile_bounds)} in EPSG:{epsg})")
+
+            # reproject only the part of the tile covering the window (nearest neighbour, as rio.reproject), the nodata cells stay nodata
+            raw, transform = reprojectWindow(src, epsg, bounds, resampling=Resampling.nearest)
+            height, width = raw.shape
+            profile = dict(driver="GTiff", width=width, height=height, count=1, dtype=raw.dtype, crs=f"EPSG:{epsg}", transform=transform, nodata=src.nodata)
+
+        if cached is not None:
+            # write the window as COG via a temporary file, so that no incomplete entries are read
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = os.path.join(cache_dir, f"tmp_{os.path.basename(cached)}")
+            with MemoryFile() as memfile:
+                with memfile.open(**profile) as mem:
+                    mem.write(raw.filled(profile["nodata"]) if profile["nodata"] is not None else raw.data, 1)
+                    mem.scales = (LAI_SCALE,)
+                    rasterio.shutil.copy(mem, tmp_path, driver="COG", compress="deflate", blocksize=512)
+            os.replace(tmp_path, cached)
+            evict(cache_dir, DEFAULT_MAX_BYTES, keep=cached)
+    else:
+        print(f"read {rasterDs} from cache")
+        # the modification time is used as last access time for the eviction
+        os.utime(cached)
+        with rasterio.open(cached) as src:
+            raw = src.read(1, masked=True)
+            transform = src.transform
+
+    # apply the scale factor only to the window, as float32
+    lai = raw.astype("float32") * np.float32(LAI_SCALE)
+    return lai.filled(np.nan), transform
+
 def create_chm(demDS:str,dsmDS:str,clipper:gpd.GeoDataFrame):
     # Open the raster datasets
     with rasterio.open(os.path.join(dem_path, demDS)) as src1, rasterio.open(os.path.join(dsm_path, dsmDS)) as src2:
@@ -63,30 +255,82 @@ def create_chm(demDS:str,dsmDS:str,clipper:gpd.GeoDataFrame):
                     crs=src1.crs, transform=src1.transform) as dst:
         dst.write(clipped_chm, 1)
 
-trees = combine_tree_files(tree_path)
+def create_chm_windowed(demDS:str, dsmDS:str, clipper:gpd.GeoDataFrame, block_size:int=4096) -> None:
+    """
+    Creates the canopy height model block by block on the grid of the DEM and saves it as tiled, compressed float32 GeoTiff.
+    If the grid of the DSM differs, it is resampled bilinearly to the grid of the DEM while reading (WarpedVRT).
+    For each block only the tree polygons intersecting it are rasterised to the mask, cells outside the trees and nodata
+    cells of the DEM or DSM are set to NaN. The memory needed is bounded by the block size.
+    :param demDS: file name of the DEM in dem_path
+    :param dsmDS: file name of the DSM in dsm_path
+    :param clipper: GeoDataFrame with the tree polygons
+    :param block_size: size of the blocks in cells
+    """
+    with rasterio.open(os.path.join(dem_path, demDS)) as dem, rasterio.open(os.path.join(dsm_path, dsmDS)) as dsm_src:
+        grid = RasterGrid(dem.transform, dem.width, dem.height, dem.crs)
+
+        dsm = dsm_src
+        if (dsm_src.crs, dsm_src.transform, dsm_src.shape) != (dem.crs, dem.transform, dem.shape):
+            dsm = WarpedVRT(dsm_src, crs=dem.crs, transform=dem.transform, width=dem.width, height=dem.height, resampling=Resampling.bilinear)
+
+        geometries = clipper.geometry.values
+        tree = shapely.STRtree(geometries)
+        profile = dict(GTIFF_PROFILE, width=grid.width, height=grid.height, transform=grid.transform, crs=grid.crs, count=1, dtype="float32", nodata=np.nan, predictor=3)
+
+        with dsm, rasterio.open(os.path.join(chm_path, "chm_city.tif"), "w", **profile) as dst:
+            for window in blockWindows(grid, block_size):
+                dem_block = dem.read(1, window=window, masked=True).astype("float32")
+                dsm_block = dsm.read(1, window=window, masked=True).astype("float32")
+                chm = (dsm_block - dem_block).filled(np.nan)
+
+                # mask of the tree polygons intersecting the block
+                mask = rasteriseIndex(geometries, grid, window=window, tree=tree) >= 0
+                dst.write(np.where(mask, chm, np.nan).astype("float32", copy=False), 1, window=window)
+
+def run(config:dict = None) -> None:
+    '''
+    Calculates the LAI statistics of the detected trees and the canopy height model.
+    The data paths and processing options of this script can be overridden with a step config (see runner/run_domain.py)
+    '''
+    configure(globals(), config)
+
+    ## process tree data
+    trees = combine_tree_files(tree_path)
+
+    # get lai raster files
+    if lai_window:
+        lai, lai_affine = prepare_lai_window(lai_file, trees.total_bounds, epsg, cache_path)
+    else:
+        lai, lai_affine = prepare_lai_raster(lai_file, epsg)
 
-# get lai raster files
-lai, lai_affine = prepare_lai_raster("VI_20200805T104031_S2A_T32ULC-010m_V101_LAI.tiff")
+    # calculate zonal statistics
+    if zonal_engine == "bincount":
+        lai_stats = zonal_stats_grouped(trees, lai, lai_affine, nodata=-32768).set_crs(epsg, allow_override=True)
+    else:
+        stats = zonal_stats(trees, lai, affine=lai_affine, stats=["mean","median","max"], nodata=-32768, geojson_out=True)
 
-# calculate zonal statistics
-stats = zonal_stats(trees, lai, affine=lai_affine, stats=["mean","median","max"], nodata=-32768, geojson_out=True)
+        # create geodataframe from stats
+        lai_stats = gpd.GeoDataFrame.from_features(stats)
+        lai_stats.crs = f"EPSG:{epsg}"
 
-# create geodataframe from stats
-lai_stats = gpd.GeoDataFrame.from_features(stats)
-lai_stats.crs = "EPSG:25832"
+    # drop all rows where mean is nan
+    lai_stats = lai_stats.dropna(subset=["mean"])
 
-# drop all rows where mean is nan
-lai_stats = lai_stats.dropna(subset=["mean"])
+    # drop all rows where mean is smaller than 0.6
+    lai_stats = lai_stats[lai_stats["mean"] > 0.6]
 
-# drop all rows where mean is smaller than 0.6
-lai_stats = lai_stats[lai_stats["mean"] > 0.6]
+    # summarize lai stats by mean and max
+    lai_stats_means = lai_stats.agg({"mean":"mean","median":"mean","max":"mean"})
+    lai_stats_max = lai_stats.agg({"mean":"max","median":"max","max":"max"})
 
-# summarize lai stats by mean and max
-lai_stats_means = lai_stats.agg({"mean":"mean","median":"mean","max":"mean"})
-lai_stats_max = lai_stats.agg({"mean":"max","median":"max","max":"max"})
+    # combine stats and save
+    lai_stats_summary = pd.concat([lai_stats_means,lai_stats_max], axis=1).T
+    lai_stats_summary.to_csv(os.path.join(tree_path,"lai_stats_summary.csv"))
 
-# combine stats and save
-lai_stats_summary = pd.concat([lai_stats_means,lai_stats_max], axis=1).T
-lai_stats_summary.to_csv(os.path.join(tree_path,"lai_stats_summary.csv"))
+    if block_size:
+        create_chm_windowed(dem_file,dsm_file,lai_stats,block_size)
+    else:
+        create_chm(dem_file,dsm_file,lai_stats)
 
-create_chm("tif/dem_city.tif","processed/dom_city.tif",lai_stats)
\ No newline at end of file
+if __name__ == "__main__":
+    run()
\ No newline at end of file
@@ -1,11 +1,67 @@
 # import libraries
 from osgeo import gdal, osr
 import os
+import sys
 import glob
+import numpy as np
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# pyarrow is optional, it parses the .xyz files multi-threaded (see read_xyz)
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa_csv = None
+
+# shared modules of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.config import configure
+from common.manifest import isUpToDate, readManifest, recordOutput, writeManifest
 
 # set the path to the elevation data
 dem_path = "/media/lara/2TB SSD/sciebo/Promotion/01_PALM_Evaluation/dev_geodata/dem"
 
+# set the target resolution and CRS
+resolution = 2.0
+epsg = 25832
+
+# processing options
+# resample all tiles and rebuild the merged raster, even if the manifest shows that their inputs did not change
+force = False
+# number of processes resampling tiles in parallel, 1 resamples the tiles one after another
+workers = 1
+# GDAL block cache of each process in MB and number of threads GDAL uses for warping and compression ("ALL_CPUS" or a number),
+# None keeps the GDAL defaults
+gdal_cache_mb = None
+gdal_threads = None
+# mosaic of the tiles: "warp" (merged_raster.tif warped from the tiles) or "vrt" (virtual mosaic of the tiles written once as
+# tiled, compressed Cloud Optimized GeoTiff with overviews)
+mosaic = "warp"
+# with the "vrt" mosaic, False skips the resampled tiles and resamples the .xyz files into the mosaic in one pass
+keep_tiles = True
+# reader of the .xyz files: "gdal" (GDAL XYZ driver) or "numpy" (vectorised parser, see xyz_to_geotiff)
+xyz_reader = "gdal"
+# aggregation to the target resolution with the "numpy" reader: "bilinear" or "mean"
+aggregation = "bilinear"
+
+# module variables passed to the worker processes, which do not inherit the configured values of the main process with the
+# spawn or forkserver start method
+WORKER_SETTINGS = ("dem_path", "resolution", "epsg", "gdal_cache_mb", "gdal_threads", "xyz_reader", "aggregation")
+
+# creation options of the Cloud Optimized GeoTiff of the "vrt" mosaic
+COG_OPTIONS = ["COMPRESS=DEFLATE", "PREDICTOR=YES", "BLOCKSIZE=512", "OVERVIEWS=AUTO", "BIGTIFF=IF_SAFER"]
+
+def configure_gdal(cache_mb:int = None, threads = None) -> None:
+    '''
+    Function to set the GDAL block cache (in MB) and the number of threads used for warping and compression \n
+    Called in the main process and in each worker process
+    '''
+    if cache_mb is not None:
+        gdal.SetCacheMax(int(cache_mb * 1024**2))
+    if threads is not None:
+        gdal.SetConfigOption("GDAL_NUM_THREADS", str(threads))
+
 def resample_geotiff(input_path:str, output_path:str, target_resolution:float, epsg=25832)-> None:
     '''
     Function to import elevation raster dataset and resample it to a desired resolution \n
@@ -49,25 +105,231 @@ def resample_geotiff(input_path:str, output_path:str, target_resolution:float, e
 
     print(f"Resampling complete. Output saved to {output_path}")
 
-# create a list of a .xyz files in the elevation data directory
-input_files = glob.glob(os.path.join(dem_path,'*.xyz'))
+def read_xyz(input_path:str) -> tuple:
+    '''
+    Function to read a regularly spaced .xyz file (x, y and z separated by spaces) without the GDAL XYZ driver \n
+    The file is parsed in one vectorised pass, with pyarrow if installed (memory-mapped, multi-threaded), otherwise the file is
+    read into memory and parsed with NumPy. The grid is inferred from the coordinates and the values are scattered into an
+    array. Returns the array (float32, NaN for missing points) and the geotransform of the grid
+    '''
+    if pa_csv is not None:
+        try:
+            with pa.memory_map(input_path) as source:
+                table = pa_csv.read_csv(source, read_options=pa_csv.ReadOptions(column_names=["x","y","z"]), parse_options=pa_csv.ParseOptions(delimiter=" "))
+            x, y, z = (table.column(name).to_numpy() for name in ["x","y","z"])
+        except pa.ArrowInvalid:
+            # e.g. several spaces between the columns
+            x, y, z = None, None, None
+    if pa_csv is None or x is None:
+        # NumPy only parses bytes, so the whole file is read into memory
+        with open(input_path, "rb") as file:
+            x, y, z = np.fromstring(file.read(), sep=" ").reshape(-1, 3).T
+
+    # the coordinates are cell centres, the spacing is the smallest distance between distinct coordinates
+    xs, ys = np.unique(x), np.unique(y)
+    dx = np.diff(xs).min() if len(xs) > 1 else 1.0
+    dy = np.diff(ys).min() if len(ys) > 1 else dx
+    cols = np.rint((x - xs[0]) / dx).astype(np.int64)
+    rows = np.rint((ys[-1] - y) / dy).astype(np.int64)
+
+    grid = np.full((rows.max() + 1, cols.max() + 1), np.nan, dtype=np.float32)
+    grid[rows, cols] = z
+    geotransform = tuple(float(value) for value in (xs[0] - dx / 2, dx, 0, ys[-1] + dy / 2, 0, -dy))
+    return grid, geotransform
+
+def aggregate_mean(grid:np.ndarray, factor:int, block_rows=1024) -> np.ndarray:
+    '''
+    Function to aggregate a grid to a coarser resolution by the mean of factor x factor cells (NaN cells are ignored) \n
+    The output is computed in blocks of output rows, incomplete cells at the right and bottom edge are dropped
+    '''
+    out_height, out_width = grid.shape[0] // factor, grid.shape[1] // factor
+    output = np.empty((out_height, out_width), dtype=np.float32)
+    for start in range(0, out_height, block_rows):
+        stop = min(start + block_rows, out_height)
+        block = grid[start*factor:stop*factor, :out_width*factor].reshape(stop - start, factor, out_width, factor)
+        valid = ~np.isnan(block)
+        count = valid.sum(axis=(1, 3))
+        total = np.where(valid, block, 0).sum(axis=(1, 3), dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            output[start:stop] = np.where(count > 0, total / count, np.nan)
+    return output
+
+def bilinear_weights(out_size:int, factor:float, in_size:int) -> tuple:
+    '''
+    Function to calculate the source cells and their weights for the centres of the output cells along one axis \n
+    As in the bilinear resampling of GDAL, the triangular kernel is widened to the factor when downsampling, so every source
+    cell within factor cells of the centre contributes. Source cells outside the grid receive the weight 0
+    '''
+    scale = max(factor, 1.0)
+    centre = (np.arange(out_size) + 0.5) * factor - 0.5
+    index = np.floor(centre - scale).astype(np.int64)[:, None] + 1 + np.arange(int(np.ceil(2 * scale)) + 1)[None, :]
+    weight = np.maximum(0, 1 - np.abs(index - centre[:, None]) / scale)
+    weight[(index < 0) | (index >= in_size)] = 0
+    return np.clip(index, 0, in_size - 1), weight
+
+def resample_bilinear(grid:np.ndarray, factor:float, out_shape:tuple, block_rows=1024) -> np.ndarray:
+    '''
+    Function to resample a grid bilinearly to a coarser grid (factor = target / source resolution) with the same kernel as
+    the bilinear resampling of GDAL (see bilinear_weights), so the result is the same as with resample_geotiff \n
+    NaN cells are left out and the weights of the remaining cells are normalised, output cells whose centre lies in a NaN cell
+    are NaN (as in GDAL). The kernel is applied to the columns and then to the rows, in blocks of output rows
+    '''
+    row_index, row_weight = bilinear_weights(out_shape[0], factor, grid.shape[0])
+    col_index, col_weight = bilinear_weights(out_shape[1], factor, grid.shape[1])
+    row_centre = np.minimum(np.floor((np.arange(out_shape[0]) + 0.5) * factor).astype(np.int64), grid.shape[0] - 1)
+    col_centre = np.minimum(np.floor((np.arange(out_shape[1]) + 0.5) * factor).astype(np.int64), grid.shape[1] - 1)
+
+    output = np.empty(out_shape, dtype=np.float32)
+    for start in range(0, out_shape[0], block_rows):
+        rows = slice(start, min(start + block_rows, out_shape[0]))
+        # source rows needed by this block of output rows
+        first, last = row_index[rows].min(), row_index[rows].max() + 1
+        valid = ~np.isnan(grid[first:last])
+        values = np.where(valid, grid[first:last], 0)
+
+        total = np.zeros((rows.stop - start, out_shape[1]), dtype=np.float64)
+        weights = np.zeros_like(total)
+        for column_values, column_weights in ((values, total), (valid, weights)):
+            columns = sum(column_values[:, col_index[:, tap]] * col_weight[:, tap] for tap in range(col_index.shape[1]))
+            for tap in range(row_index.shape[1]):
+                column_weights += columns[row_index[rows, tap] - first] * row_weight[rows, tap, None]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            output[rows] = np.where(weights > 0, total / weights, np.nan)
+        output[rows][np.isnan(grid[np.ix_(row_centre[rows], col_centre)])] = np.nan
+    return output
+
+def xyz_to_geotiff(input_path:str, output_path:str, target_resolution:float, epsg=25832, aggregation="bilinear") -> None:
+    '''
+    Function to convert a .xyz file to a GeoTiff with a desired resolution without the GDAL XYZ driver (see read_xyz) \n
+    The grid is aggregated to the target resolution by "bilinear" resampling (same kernel and result as resample_geotiff) or by the "mean" of
+    all cells of a target cell (the target resolution has to be a multiple of the resolution of the file)
+    '''
+    grid, input_geotransform = read_xyz(input_path)
+    factor = target_resolution / input_geotransform[1]
+
+    # same grid as resample_geotiff: origin of the file and size truncated to whole target cells
+    out_shape = (int(grid.shape[0] / factor), int(grid.shape[1] / factor))
+    if aggregation == "mean":
+        if not np.isclose(factor, round(factor)):
+            raise ValueError(f"target resolution {target_resolution} is not a multiple of the resolution of {input_path}")
+        output = aggregate_mean(grid, int(round(factor)))[:out_shape[0], :out_shape[1]]
+    else:
+        output = resample_bilinear(grid, factor, out_shape)
+
+    output_dataset = gdal.GetDriverByName('GTiff').Create(output_path, out_shape[1], out_shape[0], 1, gdal.GDT_Float32)
+    output_dataset.SetGeoTransform((
+        input_geotransform[0], target_resolution, 0,
+        input_geotransform[3], 0, -target_resolution
+    ))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    output_dataset.SetProjection(srs.ExportToWkt())
+    band = output_dataset.GetRasterBand(1)
+    band.SetNoDataValue(float("nan"))
+    band.WriteArray(output)
+    output_dataset = None
+
+    print(f"Resampling complete. Output saved to {output_path}")
+
+def init_resample_worker(settings:dict) -> None:
+    '''
+    Function to apply the configured module variables of the main process (see WORKER_SETTINGS) and the GDAL settings in a
+    worker process
+    '''
+    configure(globals(), settings)
+    configure_gdal(gdal_cache_mb, gdal_threads)
+
+def resample_tiles(tiles:dict, target_resolution:float, epsg=25832, workers=1, resample=resample_geotiff):
+    '''
+    Function to resample several tiles (dictionary of output and input paths) with resample_geotiff (or xyz_to_geotiff) \n
+    With more than one worker the tiles are resampled in a process pool. Yields the output path of each finished tile
+    '''
+    if workers == 1:
+        for output_path, input_path in tiles.items():
+            resample(input_path, output_path, target_resolution, epsg)
+            yield output_path
+        return
+
+    settings = {key: globals()[key] for key in WORKER_SETTINGS}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_resample_worker, initargs=(settings,)) as executor:
+        jobs = {executor.submit(resample, input_path, output_path, target_resolution, epsg): output_path for output_path, input_path in tiles.items()}
+        for future in as_completed(jobs):
+            future.result()
+            yield jobs[future]
+
+def build_mosaic(input_paths:list, output_path:str, target_resolution:float = None, epsg=25832) -> None:
+    '''
+    Function to combine tiles into one Cloud Optimized GeoTiff (tiled, compressed, with overviews) through a virtual mosaic \n
+    The tiles are only read once. With a target resolution, the tiles (e.g. .xyz files) are resampled bilinearly while writing
+    '''
+    # virtual mosaic in memory, the .xyz files have no CRS
+    vrt = gdal.BuildVRT("", input_paths, outputSRS=f"EPSG:{epsg}")
+
+    creation_options = COG_OPTIONS + ([f"NUM_THREADS={gdal_threads}"] if gdal_threads is not None else [])
+    if target_resolution is None:
+        gdal.Translate(output_path, vrt, format="COG", creationOptions=creation_options)
+    else:
+        gdal.Warp(output_path, vrt, format="COG", xRes=target_resolution, yRes=target_resolution, resampleAlg=gdal.GRA_Bilinear,
+                  outputType=gdal.GDT_Float32, multithread=True, creationOptions=creation_options)
+    vrt = None
+
+    print(f"Mosaic complete. Output saved to {output_path}")
+
+def run(config:dict = None) -> None:
+    '''
+    Resamples all .xyz files in the elevation data directory to the target resolution and merges them. \n
+    The data paths and processing options of this script can be overridden with a step config (see runner/run_domain.py)
+    '''
+    configure(globals(), config)
+    configure_gdal(gdal_cache_mb, gdal_threads)
+
+    # create a list of a .xyz files in the elevation data directory
+    input_files = glob.glob(os.path.join(dem_path,'*.xyz'))
+
+    # extract only the file name without the whole path
+    xyz_files = [os.path.basename(file) for file in input_files]
+
+    # create an empty list for exported tif files
+    tif_files = []
+
+    # define the target resolution
+    target_resolution = resolution
 
-# extract only the file name without the whole path
-xyz_files = [os.path.basename(file) for file in input_files]
+    # the manifest records the content hashes of the inputs and the config of every output
+    manifest = {} if force else readManifest(dem_path)
+    config = {"resolution": target_resolution, "epsg": epsg, "xyz_reader": xyz_reader, "aggregation": aggregation if xyz_reader == "numpy" else None}
+    resample = partial(xyz_to_geotiff, aggregation=aggregation) if xyz_reader == "numpy" else resample_geotiff
 
-# create an empty list for exported tif files
-tif_files = []
+    # the output and input path of each tile
+    tiles = {}
+    for file in xyz_files:
+        input_geotiff = os.path.join(dem_path,file)
+        output_geotiff = os.path.join(dem_path,file.replace("dgm1", f"dgm{int(target_resolution)}").replace(".xyz", ".tif"))
+        tif_files.append(output_geotiff)
+        tiles[output_geotiff] = input_geotiff
 
-# define the target resolution
-target_resolution = 2.0
+    # resample each raster file to the desired resolution (in parallel with more than one worker), unchanged tiles are skipped
+    resample_tiles_first = mosaic == "warp" or keep_tiles
+    if resample_tiles_first:
+        stale = {output: tiles[output] for output in tif_files if not isUpToDate(manifest, output, [tiles[output]], config)}
+        for output_geotiff in resample_tiles(stale, target_resolution, epsg, workers, resample):
+            # save the manifest after each tile, so an interrupted run keeps the finished tiles
+            recordOutput(manifest, output_geotiff, [tiles[output_geotiff]], config)
+            writeManifest(dem_path, manifest)
 
-# loop through the file list and resample each raster file to the desired resolution
-for file in xyz_files:
-    input_geotiff = os.path.join(dem_path,file)
-    output_geotiff = os.path.join(dem_path,file.replace("dgm1", f"dgm{int(target_resolution)}").replace(".xyz", ".tif"))
-    tif_files.append(output_geotiff)
-    resample_geotiff(input_geotiff, output_geotiff, target_resolution)
+    # combine the resampled raster files (or the .xyz files) into one, if any of them changed
+    merged_raster = os.path.join(dem_path,'merged_raster.tif')
+    sources = tif_files if resample_tiles_first else [tiles[output] for output in tif_files]
+    merged_config = {**config, "mosaic": mosaic, "keep_tiles": resample_tiles_first}
+    if not isUpToDate(manifest, merged_raster, sources, merged_config):
+        if mosaic == "vrt":
+            build_mosaic(sources, merged_raster, None if resample_tiles_first else target_resolution, epsg)
+        else:
+            merged = gdal.Warp(merged_raster, tif_files, format="GTiff")
+            merged = None
+        recordOutput(manifest, merged_raster, sources, merged_config)
+    writeManifest(dem_path, manifest)
 
-# combine the resampled raster files into one
-merged = gdal.Warp(os.path.join(dem_path,'merged_raster.tif'), tif_files, format="GTiff")
-merged = None
+if __name__ == "__main__":
+    run()
\ No newline at end of file